@@ -0,0 +1,51 @@
+"""Аутентификация по токену с кэшированием пользователя."""
+import copy
+import time
+
+from django.conf import settings
+from rest_framework.authentication import TokenAuthentication
+
+from foodgram.cache import Namespace
+
+TOKENS = Namespace('token')
+# Поколение токенов пользователя читается только из общего кэша, чтобы
+# сброс сразу был виден всем процессам.
+GENERATIONS = Namespace('token-user', local_timeout=0)
+
+
+def invalidate_user(user_id):
+    """Сбрасывает кэшированные токены пользователя во всех процессах."""
+    GENERATIONS.set(user_id, time.time_ns(), settings.TOKEN_AUTH_CACHE_TTL)
+
+
+def forget_token(key):
+    TOKENS.delete(key)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication, который помнит token -> user.
+
+    Пара хранится в кэше проекта (память процесса, затем общий кэш)
+    TOKEN_AUTH_CACHE_TTL секунд вместе с поколением токенов
+    пользователя. Сигналы меняют поколение при удалении токена и при
+    сохранении или удалении пользователя, и запись перестаёт
+    действовать. Без общего кэша (см. foodgram.cache.check_shared_tier)
+    сброс не дошёл бы до других процессов, поэтому токен проверяется
+    по базе.
+    Запись в кэш делается только после чтения из базы: попадание в
+    память процесса не продлевает её срок.
+    """
+
+    def authenticate_credentials(self, key):
+        if getattr(TOKENS.cache, 'shared', None) is None:
+            return super().authenticate_credentials(key)
+        entry = TOKENS.get(key)
+        if entry is not None and (GENERATIONS.get(entry[0].id)
+                                  != entry[2]):
+            entry = None
+        if entry is None:
+            user, token = super().authenticate_credentials(key)
+            entry = (user, token, GENERATIONS.get(user.id))
+            TOKENS.set(key, entry, settings.TOKEN_AUTH_CACHE_TTL)
+        user, token, _ = entry
+        return copy.copy(user), token
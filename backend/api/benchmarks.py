@@ -0,0 +1,256 @@
+"""Микробенчмарки горячих путей API внутри процесса.
+
+Набор данных создаётся детерминированно (random.Random(seed)) в
+отдельной тестовой базе, запросы идут через APIClient со всем стеком
+middleware, создание и изменение рецепта - через
+CreateRecipeSerializer, как в RecipeViewSet. Для каждого случая
+записываются время (медиана, p95, минимум), число SQL-запросов и
+память, выделенная за один прогон (tracemalloc, отдельным прогоном,
+чтобы не искажать время). compare ищет регрессии между двумя
+прогонами.
+"""
+import base64
+import itertools
+import statistics
+import time
+import tracemalloc
+from io import BytesIO
+
+from django.db import connection
+from PIL import Image
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from api.serializers import CreateRecipeSerializer
+from foodgram.queries import QueryInspector
+from recipes import counters, shopping, similar
+from recipes.models import (FavoriteRecipe, Ingredient, IngredientInRecipe,
+                            Recipe, ShoppingCart, Tag)
+from users.models import Follower, User
+
+WORDS = ('суп', 'салат', 'пирог', 'каша', 'соус', 'рагу', 'омлет', 'плов',
+         'борщ', 'блины', 'запеканка', 'котлеты', 'паста', 'хлеб', 'торт',
+         'гуляш', 'щи', 'оладьи', 'пюре', 'сырники')
+UNITS = ('г', 'кг', 'мл', 'л', 'шт', 'ст. л.', 'ч. л.')
+# Параметры RecipeFilter; в случаях перебираются все их сочетания.
+FILTERS = ('author', 'tags', 'is_favorited', 'is_in_shopping_cart',
+           'search', 'ordering')
+# Меньшие изменения памяти не считаются регрессией, КБ.
+MIN_ALLOC_DELTA = 64
+
+
+def create_all(model, objects):
+    """bulk_create с ключами: SQLite их не возвращает, база пуста."""
+    model.objects.bulk_create(objects, batch_size=5000)
+    return list(model.objects.order_by('id'))
+
+
+def seed(rng, recipes, users, ingredients, tags=8):
+    """Заполняет пустую базу, возвращает пользователя для запросов."""
+    authors = create_all(User, (
+        User(email=f'user{i}@example.com', username=f'user{i}',
+             first_name='Имя', last_name='Фамилия', password='-')
+        for i in range(users)))
+    tag_objects = create_all(Tag, (
+        Tag(name=f'Тэг {i}', color=f'#{i:06x}', slug=f'tag{i}')
+        for i in range(tags)))
+    ingredient_objects = create_all(Ingredient, (
+        Ingredient(name=f'{rng.choice(WORDS)} {i}',
+                   measurement_unit=rng.choice(UNITS))
+        for i in range(ingredients)))
+    recipe_objects = create_all(Recipe, (
+        Recipe(author=rng.choice(authors), image='upload/benchmark.png',
+               name=f'{rng.choice(WORDS)} {i}',
+               text=' '.join(rng.choices(WORDS, k=30)),
+               cooking_time=rng.randint(1, 240))
+        for i in range(recipes)))
+    Recipe.tags.through.objects.bulk_create(
+        Recipe.tags.through(recipe_id=recipe.id, tag_id=tag.id)
+        for recipe in recipe_objects
+        for tag in rng.sample(tag_objects, rng.randint(1, 3)))
+    IngredientInRecipe.objects.bulk_create(
+        (IngredientInRecipe(recipe=recipe, ingredient=ingredient,
+                            amount=rng.randint(1, 500))
+         for recipe in recipe_objects
+         for ingredient in rng.sample(ingredient_objects,
+                                      rng.randint(3, 10))),
+        batch_size=5000)
+    for model, count, targets in ((FavoriteRecipe, 20, recipe_objects),
+                                  (ShoppingCart, 10, recipe_objects)):
+        model.objects.bulk_create(
+            (model(user=user, recipe=recipe) for user in authors
+             for recipe in rng.sample(targets, count)), batch_size=5000)
+    Follower.objects.bulk_create(
+        Follower(user=user, author=author) for user in authors
+        for author in rng.sample(authors, 10) if author != user)
+    counters.reconcile()
+    shopping.rebuild()
+    similar.rebuild()
+    return authors[0]
+
+
+def make_image():
+    buffer = BytesIO()
+    Image.new('RGB', (64, 64), (200, 120, 40)).save(buffer, 'PNG')
+    return ('data:image/png;base64,'
+            + base64.b64encode(buffer.getvalue()).decode())
+
+
+def profile(func):
+    """Число SQL-запросов и память одного прогона."""
+    queries = QueryInspector()
+    with connection.execute_wrapper(queries):
+        func()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        func()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        'queries': sum(queries.counts.values()),
+        'alloc_peak_kb': round((peak - before) / 1024, 1),
+        'alloc_retained_kb': round((current - before) / 1024, 1),
+    }
+
+
+def measure(cases, iterations, rounds):
+    """Время, запросы и память случаев {имя: функция}.
+
+    Случаи выполняются по кругу, rounds кругов по iterations прогонов:
+    медленные изменения скорости машины ложатся на все случаи поровну.
+    """
+    timings = {name: [] for name in cases}
+    for func in cases.values():
+        func()
+    for _ in range(rounds):
+        for name, func in cases.items():
+            for _ in range(iterations):
+                start = time.perf_counter()
+                func()
+                timings[name].append((time.perf_counter() - start) * 1000)
+    results = {}
+    for name, func in cases.items():
+        values = sorted(timings[name])
+        results[name] = {
+            'median_ms': round(statistics.median(values), 3),
+            'p95_ms': round(values[int((len(values) - 1) * 0.95)], 3),
+            'min_ms': round(values[0], 3),
+            **profile(func),
+        }
+    return results
+
+
+class Suite:
+    """Случаи бенчмарка: имя -> функция одного прогона."""
+
+    def __init__(self, user):
+        self.user = user
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+        self.recipe = (Recipe.objects.filter(author=user)
+                       .order_by('id').first())
+        self.tags = list(Tag.objects.order_by('id'))
+        self.ingredient_ids = list(Ingredient.objects.order_by('id')
+                                   .values_list('id', flat=True)[:10])
+        self.image = make_image()
+        self.created = itertools.count()
+        self.updated = itertools.count()
+
+    def get(self, path, **params):
+        def run():
+            response = self.client.get(path, params)
+            if response.status_code != 200:
+                raise AssertionError(f'{path}: {response.status_code}')
+        return run
+
+    def list_params(self, names):
+        values = {'author': self.recipe.author_id,
+                  'tags': [tag.slug for tag in self.tags[:2]],
+                  'is_favorited': 1, 'is_in_shopping_cart': 1,
+                  'search': WORDS[0], 'ordering': 'popular'}
+        return {name: values[name] for name in names}
+
+    def save(self, instance, data, number):
+        # Состав и тэги меняются от прогона к прогону.
+        shift = number % 4
+        data['ingredients'] = [
+            {'id': pk, 'amount': 100}
+            for pk in self.ingredient_ids[shift:shift + 6]]
+        data['tags'] = [tag.id for tag in self.tags[shift:shift + 2]]
+        request = Request(APIRequestFactory().post('/api/recipes/'))
+        request.user = self.user
+        serializer = CreateRecipeSerializer(
+            instance, data=data, partial=instance is not None,
+            context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return serializer.data
+
+    def create(self):
+        number = next(self.created)
+        return self.save(None, {'name': f'Бенчмарк {number}',
+                                'image': self.image, 'text': 'Текст',
+                                'cooking_time': 10}, number)
+
+    def update(self):
+        number = next(self.updated)
+        # Рецепт читается заново, как в get_object() представления.
+        recipe = Recipe.objects.get(pk=self.recipe.pk)
+        return self.save(recipe, {'name': recipe.name, 'text': recipe.text,
+                                  'cooking_time': 10 + number % 4}, number)
+
+    def cases(self):
+        yield 'recipes.detail', self.get(f'/api/recipes/{self.recipe.id}/')
+        for size in range(len(FILTERS) + 1):
+            for names in itertools.combinations(FILTERS, size):
+                name = 'recipes.list' + (f'?{"&".join(names)}'
+                                         if names else '')
+                yield name, self.get('/api/recipes/',
+                                     **self.list_params(names))
+        yield 'ingredients.search', self.get('/api/ingredients/',
+                                             name=WORDS[1][:3])
+        yield 'users.subscriptions', self.get('/api/users/subscriptions/',
+                                              recipes_limit=3)
+        yield 'shopping_list', self.user.get_shopping_list
+        yield 'recipes.create', self.create
+        yield 'recipes.update', self.update
+
+
+def compare(base, current, tolerance, min_delta):
+    """Строки сравнения и число регрессий.
+
+    Регрессия - рост медианы времени больше чем на tolerance (и на
+    min_delta мс), рост числа запросов или рост пиковой памяти больше
+    чем на tolerance (и на MIN_ALLOC_DELTA КБ).
+    """
+    lines, regressions = [], 0
+    base_results, results = base['results'], current['results']
+    for name in sorted(base_results.keys() | results.keys()):
+        if name not in results:
+            lines.append(f'{name}: нет в новом прогоне')
+            continue
+        if name not in base_results:
+            lines.append(f'{name}: новый случай')
+            continue
+        old, new = base_results[name], results[name]
+        problems = []
+        delta = new['median_ms'] - old['median_ms']
+        if delta > min_delta and delta > old['median_ms'] * tolerance:
+            problems.append('время')
+        if new['queries'] > old['queries']:
+            problems.append('запросы')
+        growth = new['alloc_peak_kb'] - old['alloc_peak_kb']
+        if (growth > MIN_ALLOC_DELTA
+                and growth > old['alloc_peak_kb'] * tolerance):
+            problems.append('память')
+        regressions += bool(problems)
+        change = delta / old['median_ms'] if old['median_ms'] else 0
+        lines.append(
+            f'{name}: {old["median_ms"]:.2f} -> {new["median_ms"]:.2f} мс '
+            f'({change:+.1%}), SQL {old["queries"]} -> {new["queries"]}, '
+            f'память {old["alloc_peak_kb"]:.0f} -> '
+            f'{new["alloc_peak_kb"]:.0f} КБ'
+            + (f'  РЕГРЕССИЯ: {", ".join(problems)}' if problems else ''))
+    return lines, regressions
@@ -0,0 +1,90 @@
+"""Выгрузка списка покупок в разных форматах."""
+import csv
+import hashlib
+from io import BytesIO
+
+from django.conf import settings
+
+
+class Echo:
+    """Псевдофайл для csv.writer: возвращает записанную строку."""
+
+    def write(self, value):
+        return value
+
+
+CHUNK_SIZE = 500
+
+
+def shopping_list_rows(user):
+    """Строки списка покупок одним запросом, для ETag и для тела.
+
+    Строки читаются в память целиком: ETag нужен до первого байта тела.
+    Их не больше, чем ингредиентов в справочнике, - по строке на
+    ингредиент. StreamingHttpResponse отдаёт по частям только
+    отрендеренный файл.
+    """
+    return list(user.get_shopping_list_rows())
+
+
+def iter_shopping_list_rows(user):
+    """Строки списка покупок серверным курсором, когда ETag не нужен."""
+    return user.get_shopping_list_rows().iterator(chunk_size=CHUNK_SIZE)
+
+
+def shopping_list_etag(rows, file_format):
+    """ETag, одинаковый для одинаковых списков покупок."""
+    digest = hashlib.sha1(file_format.encode())
+    for name, unit, total in rows:
+        digest.update(f'|{name}:{unit}:{total}'.encode())
+    return f'"{digest.hexdigest()}"'
+
+
+def render_txt(rows):
+    for name, unit, total in rows:
+        yield f'{name}: {total} {unit}\n'
+
+
+def render_csv(rows):
+    writer = csv.writer(Echo())
+    header = ('Ингредиент', 'Количество', 'Единица измерения')
+    yield '\ufeff' + writer.writerow(header)
+    for name, unit, total in rows:
+        yield writer.writerow((name, total, unit))
+
+
+def render_pdf(rows):
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+    from reportlab.pdfgen.canvas import Canvas
+
+    font = 'ShoppingListFont'
+    if font not in pdfmetrics.getRegisteredFontNames():
+        pdfmetrics.registerFont(
+            TTFont(font, settings.SHOPPING_LIST_PDF_FONT))
+    buffer = BytesIO()
+    canvas = Canvas(buffer, pagesize=A4)
+    width, height = A4
+    margin, line_height = 50, 18
+    canvas.setFont(font, 16)
+    canvas.drawString(margin, height - margin, 'Список покупок')
+    canvas.setFont(font, 12)
+    y = height - margin - 2 * line_height
+    for name, unit, total in rows:
+        if y < margin:
+            canvas.showPage()
+            canvas.setFont(font, 12)
+            y = height - margin
+        canvas.drawString(margin, y, f'{name}: {total} {unit}')
+        y -= line_height
+    canvas.save()
+    buffer.seek(0)
+    yield from iter(lambda: buffer.read(64 * 1024), b'')
+
+
+FORMATS = {
+    'txt': (render_txt, 'text/plain; charset=utf-8'),
+    'csv': (render_csv, 'text/csv; charset=utf-8'),
+    'pdf': (render_pdf, 'application/pdf'),
+}
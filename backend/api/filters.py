@@ -1,10 +1,13 @@
 from django_filters.rest_framework import FilterSet
 from django_filters.rest_framework.filters import (ModelChoiceFilter,
                                                    ModelMultipleChoiceFilter,
-                                                   BooleanFilter, CharFilter)
+                                                   BooleanFilter, CharFilter,
+                                                   ChoiceFilter)
 
 from users.models import User
-from recipes.models import Recipe, Tag, Ingredient
+from recipes.models import (Recipe, Tag, Ingredient, FavoriteRecipe,
+                            ShoppingCart)
+from recipes.search import search_recipes
 
 
 class RecipeFilter(FilterSet):
@@ -15,23 +18,33 @@ class RecipeFilter(FilterSet):
                                      to_field_name='slug')
     is_favorited = BooleanFilter(method='filter_is_favorited')
     is_in_shopping_cart = BooleanFilter(method='filter_is_in_shopping_cart')
+    search = CharFilter(method='filter_search')
+    ordering = ChoiceFilter(choices=(('popular', 'popular'),),
+                            method='filter_ordering')
 
     class Meta:
         model = Recipe
         fields = ('author', 'tags')
 
+    def filter_search(self, queryset, name, value):
+        return search_recipes(queryset, value)
+
+    def filter_ordering(self, queryset, name, value):
+        # Порядок совпадает с индексом recipe_popular_idx.
+        return queryset.order_by('-favorites_count', '-pub_date', '-id')
+
     def filter_is_favorited(self, queryset, name, value):
-        return self.filter_related(queryset, self.request.user.favorite, value)
+        return self.filter_related(queryset, FavoriteRecipe, value)
 
-    def filter_related(self, queryset, name, value):
+    def filter_related(self, queryset, model, value):
+        # Подзапрос, а не список id: избранное может быть большим.
         if value and not self.request.user.is_anonymous:
-            recipe = name.values_list('recipe', flat=True)
-            return queryset.filter(id__in=recipe)
+            return queryset.filter(id__in=model.objects.filter(
+                user=self.request.user).values('recipe'))
         return queryset
 
     def filter_is_in_shopping_cart(self, queryset, name, value):
-        return self.filter_related(queryset, self.request.user.shopping_cart,
-                                   value)
+        return self.filter_related(queryset, ShoppingCart, value)
 
 
 class IngredientFilter(FilterSet):
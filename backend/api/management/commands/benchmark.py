@@ -0,0 +1,91 @@
+import json
+import os
+import platform
+import random
+import tempfile
+from fnmatch import fnmatch
+
+import django
+from django.core.management import BaseCommand, CommandError
+from django.db import connection
+from django.test import override_settings
+from django.utils import timezone
+
+from api.benchmarks import Suite, measure, seed
+from foodgram.metrics import REGISTRY
+
+# Кэши на время прогона: тестовые данные не должны попасть в общий кэш.
+CACHES = {
+    'default': {
+        'BACKEND': 'foodgram.cache.TwoTierCache',
+        'LOCATION': 'benchmark',
+        'OPTIONS': {'SHARED': 'shared'},
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'benchmark',
+    },
+}
+
+
+class Command(BaseCommand):
+    help = ('Микробенчмарки горячих путей API на детерминированном наборе '
+            'данных в тестовой базе; результаты пишутся в JSON.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default='benchmark.json')
+        parser.add_argument('--iterations', type=int, default=5,
+                            help='прогонов случая за круг')
+        parser.add_argument('--rounds', type=int, default=5)
+        parser.add_argument('--case', default='*',
+                            help='шаблон имён случаев, например recipes.*')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--recipes', type=int, default=2000)
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--ingredients', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 1 or options['rounds'] < 1:
+            raise CommandError('--iterations and --rounds must be '
+                               'positive integers.')
+        dataset = {name: options[name]
+                   for name in ('seed', 'recipes', 'users', 'ingredients')}
+        old_name = connection.settings_dict['NAME']
+        with tempfile.TemporaryDirectory() as directory, override_settings(
+                ALLOWED_HOSTS=['*'], CACHES=CACHES, MEDIA_ROOT=directory,
+                METRICS_DIR=os.path.join(directory, 'metrics'),
+                N_PLUS_ONE='off', RECIPE_IMAGE_JOBS=True):
+            connection.creation.create_test_db(
+                verbosity=0, autoclobber=True, serialize=False)
+            try:
+                user = seed(random.Random(dataset.pop('seed')), **dataset)
+                cases = {name: func for name, func in Suite(user).cases()
+                         if fnmatch(name, options['case'])}
+                results = measure(cases, options['iterations'],
+                                  options['rounds'])
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+                # Соединение с тестовой базой SQLite в памяти само не
+                # закрывается.
+                connection.close()
+                # Иначе метрики прогона попадут в METRICS_DIR при выходе.
+                REGISTRY.clear()
+        for name, result in results.items():
+            self.stdout.write(f'{name}: {result["median_ms"]:.2f} мс, '
+                              f'SQL {result["queries"]}, память '
+                              f'{result["alloc_peak_kb"]:.0f} КБ')
+        report = {
+            'created': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'dataset': {name: options[name] for name in
+                        ('seed', 'recipes', 'users', 'ingredients')},
+            'iterations': options['iterations'],
+            'rounds': options['rounds'],
+            'results': results,
+        }
+        with open(options['output'], 'w') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+        self.stdout.write(self.style.SUCCESS(
+            f'Случаев: {len(results)}, результаты в {options["output"]}'))
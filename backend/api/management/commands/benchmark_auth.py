@@ -0,0 +1,56 @@
+import time
+
+from django.core.management import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from api.authentication import CachedTokenAuthentication, forget_token
+from users.models import User
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает TokenAuthentication и CachedTokenAuthentication.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000)
+
+    def measure(self, backend, key, requests):
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            for _ in range(requests):
+                backend.authenticate_credentials(key)
+            elapsed = time.perf_counter() - start
+        return elapsed / requests * 1e6, len(queries) / requests
+
+    def handle(self, *args, **options):
+        requests = options['requests']
+        try:
+            with transaction.atomic():
+                user = User.objects.create(
+                    email='benchmark-auth@example.com',
+                    username='benchmark-auth', first_name='benchmark',
+                    last_name='auth', password='-')
+                key = Token.objects.create(user=user).key
+                results = {
+                    'TokenAuthentication': self.measure(
+                        TokenAuthentication(), key, requests),
+                    'CachedTokenAuthentication': self.measure(
+                        CachedTokenAuthentication(), key, requests),
+                }
+                raise Rollback
+        except Rollback:
+            forget_token(key)
+        for name, (micros, queries) in results.items():
+            self.stdout.write(f'{name}: {micros:.1f} мкс/запрос, '
+                              f'{queries:.3f} SQL/запрос')
+        plain = results['TokenAuthentication'][0]
+        cached = results['CachedTokenAuthentication'][0]
+        self.stdout.write(self.style.SUCCESS(
+            f'Экономия: {plain - cached:.1f} мкс на запрос '
+            f'({plain / cached:.1f}x)'))
@@ -0,0 +1,39 @@
+import json
+
+from django.core.management import BaseCommand, CommandError
+
+from api.benchmarks import compare
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает два JSON-файла команды benchmark и завершается '
+            'с ошибкой, если есть регрессии.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('base')
+        parser.add_argument('current')
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help='допустимый рост времени и памяти, доля')
+        parser.add_argument('--min-delta', type=float, default=0.2,
+                            help='меньший рост медианы не считается, мс')
+
+    def load(self, path):
+        try:
+            with open(path) as file:
+                return json.load(file)
+        except (OSError, ValueError) as error:
+            raise CommandError(f'{path}: {error}')
+
+    def handle(self, *args, **options):
+        base = self.load(options['base'])
+        current = self.load(options['current'])
+        if base['dataset'] != current['dataset']:
+            self.stderr.write(self.style.WARNING(
+                'Наборы данных прогонов отличаются, сравнение неточно.'))
+        lines, regressions = compare(base, current, options['tolerance'],
+                                     options['min_delta'])
+        for line in lines:
+            self.stdout.write(line)
+        if regressions:
+            raise CommandError(f'Регрессий: {regressions}')
+        self.stdout.write(self.style.SUCCESS('Регрессий нет'))
@@ -0,0 +1,56 @@
+import os
+import statistics
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management import BaseCommand
+from django.test import Client, override_settings
+
+from foodgram.metrics import REGISTRY
+
+MIDDLEWARE = 'foodgram.middleware.MetricsMiddleware'
+
+
+class Command(BaseCommand):
+    help = 'Измеряет накладные расходы MetricsMiddleware на запрос.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default='/api/recipes/')
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--rounds', type=int, default=10)
+
+    def measure(self, middleware, path, requests):
+        with override_settings(MIDDLEWARE=middleware, ALLOWED_HOSTS=['*'],
+                               METRICS_DIR=self.metrics_dir):
+            client = Client()
+            client.get(path)
+            start = time.perf_counter()
+            for _ in range(requests):
+                client.get(path)
+        return (time.perf_counter() - start) / requests * 1e6
+
+    def handle(self, *args, **options):
+        path = options['path']
+        with_metrics = [MIDDLEWARE] + [
+            name for name in settings.MIDDLEWARE if name != MIDDLEWARE]
+        without_metrics = with_metrics[1:]
+        # Замеры чередуются, чтобы шум машины делился поровну. Метрики
+        # замеров пишутся во временный каталог, не в общий METRICS_DIR.
+        plain, measured = [], []
+        with tempfile.TemporaryDirectory() as directory:
+            self.metrics_dir = os.path.join(directory, 'metrics')
+            for _ in range(options['rounds']):
+                plain.append(self.measure(without_metrics, path,
+                                          options['requests']))
+                measured.append(self.measure(with_metrics, path,
+                                             options['requests']))
+        # Иначе замеры попадут в METRICS_DIR при выходе из процесса.
+        REGISTRY.clear()
+        plain = statistics.median(plain)
+        measured = statistics.median(measured)
+        self.stdout.write(f'{path}: без метрик {plain:.0f} мкс/запрос, '
+                          f'с метриками {measured:.0f} мкс/запрос')
+        self.stdout.write(self.style.SUCCESS(
+            f'Накладные расходы: {measured - plain:.1f} мкс '
+            f'({(measured - plain) / plain:.1%})'))
@@ -0,0 +1,96 @@
+import base64
+import json
+import multiprocessing
+import os
+from io import BytesIO
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import BaseCommand, CommandError
+from django.test import RequestFactory
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from PIL import Image
+from rest_framework.parsers import JSONParser, MultiPartParser
+from rest_framework.request import Request
+
+from api.uploads import LimitedTemporaryFileUploadHandler, RecipeImageField
+
+
+def make_image(size):
+    """PNG из шума размером около size байт."""
+    side = int((size / 3) ** 0.5)
+    buffer = BytesIO()
+    Image.frombytes('RGB', (side, side), os.urandom(side * side * 3)).save(
+        buffer, 'PNG', compress_level=0)
+    return buffer.getvalue()
+
+
+def read_rss():
+    """(текущий RSS, пик RSS) процесса в КБ."""
+    values = {}
+    with open('/proc/self/status') as status:
+        for line in status:
+            key, _, value = line.partition(':')
+            values[key] = value
+    return int(values['VmRSS'].split()[0]), int(values['VmHWM'].split()[0])
+
+
+def reset_peak():
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+    except OSError:
+        pass
+
+
+def parse_upload(body, content_type, queue):
+    django_request = RequestFactory().generic(
+        'POST', '/api/recipes/', body, content_type)
+    django_request.upload_handlers = [
+        LimitedTemporaryFileUploadHandler(django_request)]
+    del body
+    try:
+        reset_peak()
+        before, _ = read_rss()
+        request = Request(django_request,
+                          parsers=[JSONParser(), MultiPartParser()])
+        image = RecipeImageField().to_internal_value(request.data['image'])
+        _, peak = read_rss()
+        queue.put((peak - before, image.size))
+    except Exception as error:
+        queue.put(error)
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает пик RSS при загрузке изображения base64 и multipart.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=10,
+                            help='размер изображения, МБ')
+
+    def measure(self, body, content_type):
+        context = multiprocessing.get_context('fork')
+        queue = context.Queue()
+        process = context.Process(target=parse_upload,
+                                  args=(body, content_type, queue))
+        process.start()
+        result = queue.get()
+        process.join()
+        if isinstance(result, Exception):
+            raise CommandError(result)
+        return result
+
+    def handle(self, *args, **options):
+        image = make_image(options['size'] * 1024 * 1024)
+        json_body = json.dumps({
+            'image': 'data:image/png;base64,'
+            + base64.b64encode(image).decode()})
+        multipart_body = encode_multipart(BOUNDARY, {
+            'image': SimpleUploadedFile('image.png', image)})
+        del image
+        results = {
+            'base64 (JSON)': self.measure(json_body, 'application/json'),
+            'multipart': self.measure(multipart_body, MULTIPART_CONTENT),
+        }
+        for name, (growth, size) in results.items():
+            self.stdout.write(f'{name}: прирост пика RSS {growth / 1024:.1f} '
+                              f'МБ для файла {size / 1024 / 1024:.1f} МБ')
@@ -0,0 +1,91 @@
+"""Принадлежность объектов текущему пользователю в рамках запроса.
+
+Подписки, избранное и корзина пользователя загружаются пачками только
+для объектов текущей страницы и не чаще одного раза на объект за
+запрос. Счётчики попаданий ведутся на запрос и на процесс (STATS).
+"""
+from collections import Counter
+
+from recipes.models import FavoriteRecipe, ShoppingCart
+from users.models import Follower
+
+FOLLOWING = 'following'
+FAVORITES = 'favorites'
+CART = 'cart'
+
+SOURCES = {
+    FOLLOWING: (Follower, 'author_id'),
+    FAVORITES: (FavoriteRecipe, 'recipe_id'),
+    CART: (ShoppingCart, 'recipe_id'),
+}
+
+STATS = Counter()
+
+
+class Membership:
+
+    def __init__(self, user):
+        self.user = user
+        self.known = {kind: {} for kind in SOURCES}
+        self.complete = set()
+        self.stats = Counter()
+
+    @classmethod
+    def for_request(cls, request):
+        """Общий для всех сериализаторов объект текущего запроса."""
+        http_request = getattr(request, '_request', request)
+        membership = getattr(http_request, 'membership', None)
+        if membership is None:
+            membership = http_request.membership = cls(request.user)
+        return membership
+
+    def _count(self, name, value=1):
+        self.stats[name] += value
+        STATS[name] += value
+
+    def _queryset(self, kind):
+        model, field = SOURCES[kind]
+        self._count('queries')
+        return model.objects.filter(user=self.user).values_list(field,
+                                                                flat=True)
+
+    def prime(self, kind, ids):
+        """Загружает одним запросом ещё неизвестные ids."""
+        if not self.user.is_authenticated or kind in self.complete:
+            return
+        known = self.known[kind]
+        missing = {obj_id for obj_id in ids if obj_id not in known}
+        if not missing:
+            return
+        field = SOURCES[kind][1]
+        found = set(self._queryset(kind).filter(**{f'{field}__in':
+                                                   missing}))
+        for obj_id in missing:
+            known[obj_id] = obj_id in found
+
+    def all_ids(self, kind):
+        """Все ids данного вида у пользователя."""
+        if not self.user.is_authenticated:
+            return []
+        known = self.known[kind]
+        if kind not in self.complete:
+            found = set(self._queryset(kind))
+            known.update((obj_id, obj_id in found) for obj_id in known)
+            known.update(dict.fromkeys(found, True))
+            self.complete.add(kind)
+        return [obj_id for obj_id, member in known.items() if member]
+
+    def remember(self, kind, ids, value=True):
+        """Запоминает уже известный из запроса результат."""
+        self.known[kind].update(dict.fromkeys(ids, value))
+
+    def contains(self, kind, obj_id):
+        if not self.user.is_authenticated:
+            return False
+        known = self.known[kind]
+        if obj_id in known or kind in self.complete:
+            self._count('hits')
+            return known.get(obj_id, False)
+        self._count('misses')
+        self.prime(kind, (obj_id,))
+        return known[obj_id]
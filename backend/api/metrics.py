@@ -0,0 +1,14 @@
+from api import membership, response_cache
+from foodgram.metrics import collector
+
+
+@collector()
+def response_cache_metrics():
+    for state, value in response_cache.STATS.items():
+        yield 'foodgram_response_cache_total', {'state': state}, value
+
+
+@collector()
+def membership_metrics():
+    for event, value in membership.STATS.items():
+        yield 'foodgram_membership_total', {'event': event}, value
@@ -1,5 +1,119 @@
+from base64 import b64decode, b64encode
+from collections import OrderedDict
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 
 class RecipePagination(PageNumberPagination):
+    """Постраничный вывод рецептов.
+
+    По умолчанию работает по номерам страниц (page/limit). Если в
+    запросе есть параметр cursor (для первой страницы - пустой),
+    включается режим курсора по ключу сортировки: (-pub_date, -id), а
+    для ordering=popular - (-favorites_count, -pub_date, -id). Курсор
+    работает без OFFSET и COUNT(*), поэтому время ответа не зависит от
+    глубины ленты. Порядок по релевантности поиска ключом не задаётся,
+    search с курсором отклоняется.
+    """
     page_size_query_param = 'limit'
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+    search_message = 'Cursor pagination is not available with search.'
+    keys = {'': ('pub_date', 'id'),
+            'popular': ('favorites_count', 'pub_date', 'id')}
+    parsers = {'favorites_count': int, 'pub_date': parse_datetime,
+               'id': int}
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.use_cursor = self.cursor_query_param in request.query_params
+        if not self.use_cursor:
+            return super().paginate_queryset(queryset, request, view)
+        if request.query_params.get('search'):
+            raise ValidationError({self.cursor_query_param:
+                                   [self.search_message]})
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.ordering = request.query_params.get('ordering', '')
+        fields = self.keys[self.ordering]
+        page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request, fields)
+        reverse = cursor is not None and cursor[0]
+        if cursor is not None:
+            queryset = queryset.filter(
+                self.after(fields, cursor[1], 'gt' if reverse else 'lt'))
+        ordering = fields if reverse else [f'-{name}' for name in fields]
+        page = list(queryset.order_by(*ordering)[:page_size + 1])
+        has_more = len(page) > page_size
+        page = page[:page_size]
+        if reverse:
+            page.reverse()
+        self.has_next = has_more if not reverse else True
+        self.has_previous = has_more if reverse else cursor is not None
+        self.page = page
+        return page
+
+    def after(self, fields, values, lookup):
+        """Условие «ключ дальше values» для лексикографического порядка."""
+        condition = Q()
+        for i, name in enumerate(fields):
+            equal = dict(zip(fields[:i], values[:i]))
+            condition |= Q(**equal, **{f'{name}__{lookup}': values[i]})
+        return condition
+
+    def decode_cursor(self, request, fields):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            reverse, ordering, *raw = (
+                b64decode(encoded.encode('ascii')).decode('ascii')
+                .split('|'))
+            if (reverse not in ('0', '1') or ordering != self.ordering
+                    or len(raw) != len(fields)):
+                raise ValueError
+            values = [self.parsers[name](value)
+                      for name, value in zip(fields, raw)]
+            if None in values:
+                raise ValueError
+            return reverse == '1', values
+        except (TypeError, ValueError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, recipe, reverse):
+        values = []
+        for name in self.keys[self.ordering]:
+            value = getattr(recipe, name)
+            values.append(value.isoformat() if name == 'pub_date'
+                          else str(value))
+        raw = '|'.join((str(int(reverse)), self.ordering, *values))
+        encoded = b64encode(raw.encode('ascii')).decode('ascii')
+        url = remove_query_param(self.base_url, self.page_query_param)
+        return replace_query_param(url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.use_cursor:
+            return super().get_next_link()
+        if not (self.has_next and self.page):
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.use_cursor:
+            return super().get_previous_link()
+        if not (self.has_previous and self.page):
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        if not self.use_cursor:
+            return super().get_paginated_response(data)
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
@@ -0,0 +1,83 @@
+"""Кэш ответов API для анонимных пользователей.
+
+Для анонима флаги is_favorited, is_in_shopping_cart и is_subscribed
+всегда ложны, поэтому ответ зависит только от адреса и параметров
+запроса. В кэше хранятся данные ответа вместе с поколением - версиями
+рецептов, тэгов и пользователей из recipes.catalog, которые меняются
+по сигналам моделей. Запись другого поколения считается устаревшей.
+
+Если включён RESPONSE_CACHE_STALE, устаревшая запись ещё столько
+секунд отдаётся всем, кроме одного запроса, который её пересчитывает
+(stale-while-revalidate). Счётчики hit/stale/miss/bypass - в STATS.
+"""
+import functools
+import hashlib
+import time
+from collections import Counter
+
+from django.conf import settings
+from rest_framework.response import Response
+
+from foodgram.cache import Namespace
+from recipes.catalog import RECIPES, TAGS, USERS, get_versions
+
+RESPONSES = Namespace('response')
+STATS = Counter()
+LOCK_TIMEOUT = 30
+
+
+def generation(catalogs=()):
+    return ':'.join(str(version) for version in
+                    get_versions(RECIPES, TAGS, USERS, *catalogs))
+
+
+def cache_key(request, params):
+    """Ключ по хосту, пути и значимым параметрам в одном порядке."""
+    query = sorted(
+        (name, sorted(set(request.query_params.getlist(name))))
+        for name in params if request.query_params.get(name))
+    raw = f'{request.get_host()}{request.path}?{query!r}'
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def cache_anonymous(params=(), catalogs=None):
+    """Кэширует ответы метода ViewSet на GET-запросы анонимов.
+
+    params - параметры запроса, от которых зависит ответ; остальные
+    в ключ не входят. catalogs(request) - дополнительные версии
+    recipes.catalog, от которых зависит ответ на этот запрос.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, request, *args, **kwargs):
+            ttl = settings.RESPONSE_CACHE_TTL
+            if (not ttl or request.method != 'GET'
+                    or request.user.is_authenticated):
+                STATS['bypass'] += 1
+                return method(self, request, *args, **kwargs)
+            key = cache_key(request, params)
+            current = generation(catalogs(request) if catalogs else ())
+            entry = RESPONSES.get(key)
+            if entry is not None:
+                entry_generation, stored_at, data = entry
+                age = time.time() - stored_at
+                if entry_generation == current and age < ttl:
+                    return cached_response(data, 'hit')
+                if (age < ttl + settings.RESPONSE_CACHE_STALE
+                        and not RESPONSES.add(f'{key}:lock', 1, LOCK_TIMEOUT)):
+                    return cached_response(data, 'stale')
+            STATS['miss'] += 1
+            response = method(self, request, *args, **kwargs)
+            if response.status_code == 200:
+                RESPONSES.set(key, (current, time.time(), response.data),
+                              ttl + settings.RESPONSE_CACHE_STALE)
+            RESPONSES.delete(f'{key}:lock')
+            response['X-Cache'] = 'miss'
+            return response
+        return wrapper
+    return decorator
+
+
+def cached_response(data, state):
+    STATS[state] += 1
+    return Response(data, headers={'X-Cache': state})
@@ -1,17 +1,28 @@
 from django.contrib.auth.password_validation import validate_password
-from rest_framework.serializers import (ModelSerializer,
+from django.db.models import Manager, Prefetch, prefetch_related_objects
+from rest_framework.serializers import (ModelSerializer, ListSerializer,
                                         SerializerMethodField,
                                         Serializer, CharField,
                                         ValidationError,
                                         PrimaryKeyRelatedField,
-                                        IntegerField)
+                                        IntegerField, FloatField)
 from rest_framework.validators import UniqueTogetherValidator
-from drf_extra_fields.fields import Base64ImageField
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.urls import reverse
 from django.utils.translation import gettext_lazy as _
 
+from recipes import shopping, similar
+from recipes.catalog import RECIPES, bump_version
+from recipes.counters import increment
+from recipes.images import replace_variants, schedule_variants
 from recipes.models import (Tag, Ingredient, Recipe, IngredientInRecipe,
                             FavoriteRecipe, ShoppingCart)
 from users.models import User
+from jobs.models import Job
+from api.membership import Membership, FOLLOWING, FAVORITES, CART
+from api.uploads import RecipeImageField
 
 
 class TagSerializer(ModelSerializer):
@@ -36,6 +47,28 @@ class IngredientInRecipeSerializer(ModelSerializer):
         fields = ['id', 'amount', 'measurement_unit', 'name']
 
 
+class MembershipListSerializer(ListSerializer):
+    """Загружает флаги текущего пользователя для всей страницы сразу.
+
+    membership - пары (вид, атрибут объекта с id) для Membership.prime.
+    """
+    membership = ()
+
+    def to_representation(self, data):
+        objects = list(data.all() if isinstance(data, Manager) else data)
+        request = self.context.get('request')
+        if request is not None and objects:
+            membership = Membership.for_request(request)
+            for kind, attribute in self.membership:
+                membership.prime(kind, [getattr(obj, attribute)
+                                        for obj in objects])
+        return super().to_representation(objects)
+
+
+class UserListSerializer(MembershipListSerializer):
+    membership = ((FOLLOWING, 'id'),)
+
+
 class UserSerializer(ModelSerializer):
     is_subscribed = SerializerMethodField(read_only=True)
 
@@ -44,13 +77,11 @@ class UserSerializer(ModelSerializer):
         fields = ['id', 'email', 'username', 'last_name', 'first_name',
                   'is_subscribed', 'password']
         extra_kwargs = {'password': {'write_only': True}}
+        list_serializer_class = UserListSerializer
 
     def get_is_subscribed(self, obj):
         request = self.context.get('request')
-        user = request.user
-        if user.is_authenticated:
-            return user.is_following(obj)
-        return False
+        return Membership.for_request(request).contains(FOLLOWING, obj.id)
 
     def create(self, validated_data):
         user = User.objects.create(**validated_data)
@@ -60,9 +91,36 @@ class UserSerializer(ModelSerializer):
 
 
 class RecipeBaseSerializer(ModelSerializer):
+    image_variants = SerializerMethodField()
+
     class Meta:
         model = Recipe
-        fields = ['id', 'name', 'image', 'cooking_time']
+        fields = ['id', 'name', 'image', 'image_variants', 'cooking_time']
+
+    def get_image_variants(self, obj):
+        """Ссылки на уменьшенные копии, пока их нет - на оригинал."""
+        if not obj.image:
+            return None
+        request = self.context.get('request')
+        variants = obj.image_variants or {}
+        urls = {}
+        for variant in settings.RECIPE_IMAGE_VARIANTS:
+            name = variants.get(variant)
+            url = default_storage.url(name) if name else obj.image.url
+            urls[variant] = (request.build_absolute_uri(url) if request
+                             else url)
+        return urls
+
+
+class PantryRecipeSerializer(RecipeBaseSerializer):
+    coverage = FloatField(read_only=True)
+
+    class Meta(RecipeBaseSerializer.Meta):
+        fields = RecipeBaseSerializer.Meta.fields + ['coverage']
+
+
+class RecipeListSerializer(MembershipListSerializer):
+    membership = ((FAVORITES, 'id'), (CART, 'id'), (FOLLOWING, 'author_id'))
 
 
 class RecipeSerializer(RecipeBaseSerializer):
@@ -78,20 +136,15 @@ class RecipeSerializer(RecipeBaseSerializer):
                                                      'is_favorited',
                                                      'is_in_shopping_cart',
                                                      'text']
+        list_serializer_class = RecipeListSerializer
 
     def get_is_favorited(self, obj):
         request = self.context.get('request')
-        user = request.user
-        if user.is_authenticated:
-            return user.favorite.filter(recipe=obj).exists()
-        return False
+        return Membership.for_request(request).contains(FAVORITES, obj.id)
 
     def get_is_in_shopping_cart(self, obj):
         request = self.context.get('request')
-        user = request.user
-        if user.is_authenticated:
-            return user.shopping_cart.filter(recipe=obj).exists()
-        return False
+        return Membership.for_request(request).contains(CART, obj.id)
 
 
 class FavoriteRecipeSerializer(ModelSerializer):
@@ -150,10 +203,13 @@ class UserWithRecipeSerializer(UserSerializer):
         fields = UserSerializer.Meta.fields + ['recipes', 'recipes_count']
 
     def get_recipes(self, obj):
-        query = obj.recipes.all()
-        limit = self.context.get('recipes_limit')
-        if limit:
-            query = query[:int(limit)]
+        if hasattr(obj, 'latest_recipes'):
+            query = obj.latest_recipes
+        else:
+            query = obj.recipes.all()
+            limit = self.context.get('recipes_limit')
+            if limit:
+                query = query[:int(limit)]
         serializer = RecipeBaseSerializer(query, many=True,
                                           context={'request':
                                                    self.context.get('request')
@@ -161,7 +217,7 @@ class UserWithRecipeSerializer(UserSerializer):
         return serializer.data
 
     def get_recipes_count(self, obj):
-        return obj.recipes.count()
+        return obj.recipes_count
 
 
 class CreateIngredientInRecipeSerializer(Serializer):
@@ -174,7 +230,7 @@ class CreateRecipeSerializer(ModelSerializer):
     tags = PrimaryKeyRelatedField(many=True, queryset=Tag.objects.all(),
                                   error_messages={
                                       'does_not_exist': _('invalid tag id')})
-    image = Base64ImageField(use_url=True, max_length=None)
+    image = RecipeImageField(use_url=True, max_length=None)
     author = UserSerializer(read_only=True)
 
     class Meta:
@@ -186,19 +242,16 @@ class CreateRecipeSerializer(ModelSerializer):
         if len(data) == 0:
             raise ValidationError([{'ingredients':
                                     ['Need ingredients']}])
-        uniq_ingredient = set()
-        for item in data:
-            if item['id'] in uniq_ingredient:
-                raise ValidationError([{'ingredients':
-                                        ['Use uniq ingredients']}])
-            if not Ingredient.objects.filter(id=item['id']).exists():
-                raise ValidationError([{'ingredients':
-                                        ['Ingredient not found.']}])
-            if item['amount'] == 0:
-                raise ValidationError([{'amount':
-                                       ['Ingredient amount cannot be 0.']}])
-            uniq_ingredient.add(item['id'])
-
+        ids = [item['id'] for item in data]
+        if len(set(ids)) != len(ids):
+            raise ValidationError([{'ingredients':
+                                    ['Use uniq ingredients']}])
+        if any(item['amount'] == 0 for item in data):
+            raise ValidationError([{'amount':
+                                   ['Ingredient amount cannot be 0.']}])
+        if Ingredient.objects.filter(id__in=ids).count() != len(ids):
+            raise ValidationError([{'ingredients':
+                                    ['Ingredient not found.']}])
         return data
 
     def validate_cooking_time(self, value):
@@ -207,33 +260,125 @@ class CreateRecipeSerializer(ModelSerializer):
                                    ['Time cannot be less than 1']}])
         return value
 
+    def set_tags(self, recipe, tags):
+        """Добавляет и удаляет только изменившиеся тэги.
+
+        Связи пишутся напрямую в промежуточную таблицу, m2m_changed не
+        отправляется.
+        """
+        through = Recipe.tags.through
+        old = set(through.objects.filter(recipe_id=recipe.id)
+                  .values_list('tag_id', flat=True))
+        new = {tag.id for tag in tags}
+        if old - new:
+            through.objects.filter(recipe_id=recipe.id,
+                                   tag_id__in=old - new).delete()
+        if new - old:
+            through.objects.bulk_create(
+                through(recipe_id=recipe.id, tag_id=tag_id)
+                for tag_id in new - old)
+
+    def set_ingredients(self, recipe, ingredients):
+        """Приводит состав рецепта к ingredients минимумом запросов.
+
+        Разница строится по одной выборке (id, ингредиент, количество),
+        удаление идёт без сигналов post_delete.
+        """
+        existing = {ingredient_id: (pk, amount)
+                    for pk, ingredient_id, amount in
+                    IngredientInRecipe.objects.filter(recipe=recipe)
+                    .values_list('id', 'ingredient_id', 'amount')}
+        new_amounts = {i['id']: i['amount'] for i in ingredients}
+        deltas = {}
+        to_create, to_update = [], []
+        for ingredient_id, amount in new_amounts.items():
+            pk, old_amount = existing.get(ingredient_id, (None, 0))
+            deltas[ingredient_id] = amount - old_amount
+            if pk is None:
+                to_create.append(IngredientInRecipe(
+                    ingredient_id=ingredient_id, amount=amount,
+                    recipe=recipe))
+            elif amount != old_amount:
+                to_update.append(IngredientInRecipe(id=pk, amount=amount))
+        to_delete = []
+        for ingredient_id, (pk, amount) in existing.items():
+            if ingredient_id not in new_amounts:
+                deltas[ingredient_id] = -amount
+                to_delete.append(pk)
+        if to_delete:
+            queryset = IngredientInRecipe.objects.filter(pk__in=to_delete)
+            queryset._raw_delete(queryset.db)
+        if to_update:
+            IngredientInRecipe.objects.bulk_update(to_update, ('amount',))
+        if to_create:
+            IngredientInRecipe.objects.bulk_create(to_create)
+        shopping.recipe_changed(recipe, deltas)
+        if existing.keys() != new_amounts.keys():
+            similar.index_recipes({recipe.id: list(new_amounts)})
+
+    @transaction.atomic
     def create(self, data):
         ingredients = data.pop('ingredients')
         tags = data.pop('tags')
-        recipe = Recipe.objects.create(author=self.context.get('request').user,
-                                       **data)
-        recipe.tags.set(tags)
-        ingredientInRecipe = []
-        for i in ingredients:
-            ingredientInRecipe.append(IngredientInRecipe(ingredient_id=i['id'],
-                                                         amount=i['amount'],
-                                                         recipe=recipe))
-        IngredientInRecipe.objects.bulk_create(ingredientInRecipe)
+        author = self.context.get('request').user
+        recipe = Recipe.objects.create(author=author, **data)
+        increment(User, author.id, 'recipes_count')
+        recipe.tags.add(*tags)
+        IngredientInRecipe.objects.bulk_create(
+            IngredientInRecipe(ingredient_id=i['id'], amount=i['amount'],
+                               recipe=recipe) for i in ingredients)
+        similar.index_recipes({recipe.id: [i['id'] for i in ingredients]})
+        schedule_variants(recipe)
         return recipe
 
+    @transaction.atomic
     def update(self, obj, data):
-        IngredientInRecipe.objects.filter(recipe=obj).delete()
-        obj.tags.clear()
-        obj.tags.set(data.pop('tags'))
-        ingredients = data.pop('ingredients')
-        ingredientInRecipe = []
-        for i in ingredients:
-            ingredientInRecipe.append(IngredientInRecipe(ingredient_id=i['id'],
-                                                         amount=i['amount'],
-                                                         recipe=obj))
-        IngredientInRecipe.objects.bulk_create(ingredientInRecipe)
-        return super().update(obj, data)
+        self.set_tags(obj, data.pop('tags'))
+        self.set_ingredients(obj, data.pop('ingredients'))
+        if 'image' in data:
+            old_variants = obj.image_variants
+            data['image_variants'] = {}
+        # Пишутся только изменённые поля, счётчики остаются как в базе.
+        for name, value in data.items():
+            setattr(obj, name, value)
+        if data:
+            obj.save(update_fields=list(data))
+        else:
+            # Тэги и состав пишутся без сигналов, версию меняем сами.
+            transaction.on_commit(lambda: bump_version(RECIPES))
+        if 'image' in data:
+            replace_variants(obj, old_variants)
+        return obj
 
     def to_representation(self, instance):
         request = self.context.get('request')
+        prefetch_related_objects(
+            [instance], 'tags', Prefetch(
+                'ingredients',
+                queryset=IngredientInRecipe.objects.select_related(
+                    'ingredient')))
         return RecipeSerializer(instance, context={'request': request}).data
+
+
+class JobSerializer(ModelSerializer):
+    url = SerializerMethodField()
+    file = SerializerMethodField()
+
+    class Meta:
+        model = Job
+        fields = ['id', 'url', 'task', 'status', 'attempts', 'result', 'file',
+                  'created_at', 'started_at', 'finished_at']
+
+    def get_url(self, obj):
+        url = reverse('job-detail', args=[obj.id])
+        return self.context['request'].build_absolute_uri(url)
+
+    def get_file(self, obj):
+        """Ссылка на файл, созданный задачей, если он есть."""
+        if obj.status != Job.DONE or not isinstance(obj.result, dict):
+            return None
+        name = obj.result.get('file')
+        if not name:
+            return None
+        url = default_storage.url(name)
+        return self.context['request'].build_absolute_uri(url)
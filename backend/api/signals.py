@@ -0,0 +1,21 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from api.authentication import invalidate_user
+from recipes.catalog import USERS, bump_version
+from users.models import User
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(instance, **kwargs):
+    invalidate_user(instance.user_id)
+
+
+@receiver((post_save, post_delete), sender=User)
+def user_changed(instance, update_fields=None, **kwargs):
+    invalidate_user(instance.id)
+    # Вход пользователя меняет только last_login, его нет в ответах API.
+    if update_fields != frozenset(('last_login',)):
+        transaction.on_commit(lambda: bump_version(USERS))
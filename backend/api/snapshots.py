@@ -0,0 +1,61 @@
+"""Готовые ответы для полных списков справочников."""
+import gzip
+import hashlib
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+from rest_framework.renderers import JSONRenderer
+
+from foodgram.cache import Namespace
+from recipes.catalog import get_version
+
+# Ключ содержит версию справочника, так что запись не устаревает.
+SNAPSHOTS = Namespace('snapshot', local_timeout=24 * 60 * 60)
+
+
+class CatalogSnapshot:
+    """Сериализованный справочник, собранный один раз на версию.
+
+    Тело ответа хранится в кэше проекта в виде байтов (обычном и
+    сжатом gzip), ETag считается по содержимому, поэтому совпадает во
+    всех процессах.
+    """
+
+    def __init__(self, catalog, queryset, serializer_class):
+        self.catalog = catalog
+        self.queryset = queryset
+        self.serializer_class = serializer_class
+
+    def _build(self):
+        data = self.serializer_class(self.queryset.all(), many=True).data
+        body = JSONRenderer().render(data)
+        digest = hashlib.sha1(body).hexdigest()
+        return {'body': body,
+                'etag': f'"{digest}"',
+                'gzip_body': gzip.compress(body, mtime=0),
+                'gzip_etag': f'"{digest}-gzip"'}
+
+    def get(self):
+        version = get_version(self.catalog)
+        return SNAPSHOTS.read_through(f'{self.catalog}:{version}',
+                                      self._build, 24 * 60 * 60)
+
+    def response(self, request):
+        snapshot = self.get()
+        use_gzip = 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', '')
+        if use_gzip:
+            body, etag = snapshot['gzip_body'], snapshot['gzip_etag']
+        else:
+            body, etag = snapshot['body'], snapshot['etag']
+        if etag in request.META.get('HTTP_IF_NONE_MATCH', ''):
+            response = HttpResponse(status=304)
+        else:
+            response = HttpResponse(body, content_type='application/json')
+            if use_gzip:
+                response['Content-Encoding'] = 'gzip'
+        response['ETag'] = etag
+        response['Cache-Control'] = (
+            f'public, max-age={settings.CATALOG_CACHE_MAX_AGE}')
+        patch_vary_headers(response, ('Accept-Encoding',))
+        return response
@@ -0,0 +1,21 @@
+"""Фоновые задачи API (см. jobs.queue)."""
+import uuid
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+from api.exports import FORMATS, iter_shopping_list_rows
+from jobs.queue import task
+
+
+@task('api.shopping_list')
+def shopping_list(job):
+    """Сохраняет список покупок в файл, результат - имя файла."""
+    file_format = job.payload['type']
+    render, _ = FORMATS[file_format]
+    content = b''.join(chunk.encode() if isinstance(chunk, str) else chunk
+                       for chunk in render(iter_shopping_list_rows(job.user)))
+    name = default_storage.save(
+        f'shopping_lists/{uuid.uuid4().hex}.{file_format}',
+        ContentFile(content))
+    return {'file': name}
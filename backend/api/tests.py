@@ -0,0 +1,549 @@
+import tempfile
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock
+from urllib.parse import unquote
+
+from django.core.cache import caches
+from django.core.files.storage import default_storage
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from api import tasks
+from api.authentication import (GENERATIONS, TOKENS,
+                                CachedTokenAuthentication)
+from api.serializers import CreateRecipeSerializer
+from foodgram.cache import check_shared_tier
+from jobs.models import Job
+from recipes import counters, shopping
+from recipes.catalog import (POPULARITY, RECIPES, TAGS, get_version,
+                             get_versions)
+from recipes.models import (FavoriteRecipe, Ingredient, IngredientInRecipe,
+                            Recipe, ShoppingCart, Tag)
+from recipes.tests import OtherProcessMixin
+from users.models import User
+
+
+def create_user(number):
+    return User.objects.create_user(
+        username=f'user{number}', email=f'user{number}@example.com',
+        first_name='Имя', last_name='Фамилия', password='pass-word-42')
+
+
+def create_recipes(authors, count):
+    tags = [Tag.objects.create(name=f'Тэг {i}', color=f'#00000{i}',
+                               slug=f'tag{i}') for i in range(3)]
+    ingredients = [Ingredient.objects.create(name=f'Продукт {i}',
+                                             measurement_unit='г')
+                   for i in range(4)]
+    recipes = []
+    for i in range(count):
+        recipe = Recipe.objects.create(
+            author=authors[i % len(authors)], name=f'Рецепт {i}',
+            image='upload/recipe.png', text='Текст', cooking_time=10)
+        recipe.tags.set(tags[:i % 3 + 1])
+        IngredientInRecipe.objects.bulk_create(
+            IngredientInRecipe(recipe=recipe, ingredient=ingredient,
+                               amount=100)
+            for ingredient in ingredients[:i % 4 + 1])
+        recipes.append(recipe)
+    return recipes
+
+
+class RecipeListQueriesTest(TestCase):
+    """Число запросов списка рецептов не зависит от размера страницы."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user(0)
+        authors = [cls.user] + [create_user(i) for i in range(1, 4)]
+        recipes = cls.recipes = create_recipes(authors, 25)
+        FavoriteRecipe.objects.bulk_create(
+            FavoriteRecipe(user=user, recipe=recipe)
+            for user in authors for recipe in recipes[::2])
+        ShoppingCart.objects.bulk_create(
+            ShoppingCart(user=user, recipe=recipe)
+            for user in authors for recipe in recipes[::3])
+
+    def setUp(self):
+        caches['default'].clear()
+
+    def assert_list_queries(self, client, expected):
+        for limit in (2, 6, 20):
+            with self.subTest(limit=limit):
+                # Ответ для анонимов кэшируется, каждый размер - с нуля.
+                caches['default'].clear()
+                with self.assertNumQueries(expected):
+                    response = client.get('/api/recipes/', {'limit': limit})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.data['results']), limit)
+
+    def test_anonymous(self):
+        self.assert_list_queries(APIClient(), 4)
+
+    def test_authenticated(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        self.assert_list_queries(client, 7)
+
+    def test_related_filters(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        for name, expected in (('is_favorited', self.recipes[::2]),
+                               ('is_in_shopping_cart', self.recipes[::3])):
+            with self.subTest(name=name):
+                response = client.get('/api/recipes/',
+                                      {name: 1, 'limit': 50})
+                self.assertEqual(
+                    {recipe['id'] for recipe in response.data['results']},
+                    {recipe.id for recipe in expected})
+                self.assertTrue(all(recipe[name]
+                                    for recipe in response.data['results']))
+
+
+class CachedTokenAuthenticationTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user(0)
+        cls.token = Token.objects.create(user=cls.user)
+
+    def setUp(self):
+        caches['default'].clear()
+        self.auth = CachedTokenAuthentication()
+
+    def authenticate(self, queries):
+        with self.assertNumQueries(queries):
+            user, _ = self.auth.authenticate_credentials(self.token.key)
+        self.assertEqual(user, self.user)
+
+    def test_cached(self):
+        self.authenticate(1)
+        self.authenticate(0)
+
+    def test_generation_changed_by_other_process(self):
+        self.authenticate(1)
+        # Другой процесс пишет новое поколение только в общий кэш.
+        caches['shared'].set(GENERATIONS.key(self.user.id), 'other')
+        self.authenticate(1)
+
+    def test_local_hit_does_not_extend_expiry(self):
+        now = 1000.0
+        with mock.patch('foodgram.cache.time.monotonic',
+                        side_effect=lambda: now):
+            self.authenticate(1)
+            now += 3
+            self.authenticate(0)
+            caches['shared'].delete(TOKENS.key(self.token.key))
+            now += 3
+            self.authenticate(1)
+
+    @override_settings(CACHES={'default': {
+        'BACKEND': 'foodgram.cache.TwoTierCache', 'LOCATION': 'local'}})
+    def test_without_shared_cache(self):
+        self.assertEqual([error.id for error in check_shared_tier(None)],
+                         ['foodgram.E001'])
+        self.authenticate(1)
+        self.authenticate(1)
+
+
+class CatalogSnapshotTest(OtherProcessMixin, TestCase):
+    def test_rebuilt_after_change_in_other_process(self):
+        tag = Tag.objects.create(name='Завтрак', color='#ff0000',
+                                 slug='breakfast')
+        response = self.client.get('/api/tags/')
+        self.assertEqual(response.json()[0]['name'], 'Завтрак')
+        Tag.objects.filter(pk=tag.pk).update(name='Обед')
+        self.bump_in_other_process(TAGS)
+        response = self.client.get('/api/tags/')
+        self.assertEqual(response.json()[0]['name'], 'Обед')
+
+
+class AnonymousResponseCacheTest(OtherProcessMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.recipe = create_recipes([create_user(0)], 1)[0]
+
+    def get(self, state):
+        response = self.client.get('/api/recipes/')
+        self.assertEqual(response['X-Cache'], state)
+        return response.data['results'][0]['name']
+
+    def test_invalidated_by_other_process(self):
+        self.get('miss')
+        with self.assertNumQueries(0):
+            self.get('hit')
+        Recipe.objects.filter(pk=self.recipe.pk).update(name='Новое имя')
+        self.bump_in_other_process(RECIPES)
+        self.assertEqual(self.get('miss'), 'Новое имя')
+        self.get('hit')
+
+
+class PopularOrderingCacheTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user(0)
+        cls.recipes = create_recipes([cls.user], 2)
+
+    def setUp(self):
+        caches['default'].clear()
+
+    def popular(self):
+        response = self.client.get('/api/recipes/', {'ordering': 'popular'})
+        return [recipe['id'] for recipe in response.data['results']]
+
+    def post(self, path):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.post(path)
+        self.assertEqual(response.status_code, 201)
+
+    def test_favorite_invalidates_cached_ordering(self):
+        first, second = self.recipes
+        self.assertEqual(self.popular(), [second.id, first.id])
+        self.client.get('/api/recipes/')
+        version = get_version(RECIPES)
+        self.post(f'/api/recipes/{first.id}/favorite/')
+        self.assertEqual(self.popular(), [first.id, second.id])
+        # Остальные страницы и индекс продуктов не сбрасываются.
+        self.assertEqual(get_version(RECIPES), version)
+        self.assertEqual(self.client.get('/api/recipes/')['X-Cache'], 'hit')
+
+    def test_cart_changes_no_versions(self):
+        versions = get_versions(RECIPES, POPULARITY)
+        self.post(f'/api/recipes/{self.recipes[0].id}/shopping_cart/')
+        self.assertEqual(get_versions(RECIPES, POPULARITY), versions)
+
+
+class DownloadShoppingCartTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user(0)
+        recipe = create_recipes([cls.user], 1)[0]
+        ShoppingCart.objects.create(user=cls.user, recipe=recipe)
+        shopping.add_recipe(cls.user, recipe)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def download(self, **params):
+        return self.client.get('/api/recipes/download_shopping_cart/',
+                               params)
+
+    def test_async_false(self):
+        for value in ('0', 'false', 'False', ''):
+            with self.subTest(value=value):
+                response = self.download(**{'async': value})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(b''.join(response.streaming_content)
+                                 .decode(), 'Продукт 0: 100 г\n')
+
+    def test_etag(self):
+        with self.assertNumQueries(1):
+            response = self.download(type='csv')
+            b''.join(response.streaming_content)
+        with self.assertNumQueries(1):
+            response = self.client.get(
+                '/api/recipes/download_shopping_cart/', {'type': 'csv'},
+                HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_async_true(self):
+        for value in ('1', 'true'):
+            with self.subTest(value=value):
+                self.assertEqual(self.download(**{'async': value})
+                                 .status_code, 202)
+
+    def test_async_invalid(self):
+        self.assertEqual(self.download(**{'async': 'maybe'}).status_code,
+                         400)
+
+    def test_async_file(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.download(**{'async': '1', 'type': 'txt'})
+        with override_settings(MEDIA_ROOT=directory.name):
+            result = tasks.shopping_list(Job.objects.get(user=self.user))
+            with default_storage.open(result['file']) as file:
+                self.assertEqual(file.read().decode(), 'Продукт 0: 100 г\n')
+
+
+class SubscriptionsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user(0)
+        cls.authors = [create_user(i) for i in range(1, 4)]
+        cls.recipes = create_recipes(cls.authors, 12)
+        for author in cls.authors:
+            cls.user.follow(author)
+        counters.reconcile()
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def latest(self, author, limit):
+        recipes = sorted((recipe for recipe in self.recipes
+                          if recipe.author_id == author['id']),
+                         key=lambda recipe: (recipe.pub_date, recipe.id),
+                         reverse=True)
+        return [recipe.id for recipe in recipes[:limit]]
+
+    def test_recipes_limit(self):
+        for limit in (1, 3, 10):
+            with self.subTest(limit=limit):
+                with self.assertNumQueries(3):
+                    response = self.client.get('/api/users/subscriptions/',
+                                               {'recipes_limit': limit})
+                self.assertEqual(len(response.data['results']), 3)
+                for author in response.data['results']:
+                    self.assertEqual(
+                        [recipe['id'] for recipe in author['recipes']],
+                        self.latest(author, limit))
+                    self.assertEqual(author['recipes_count'], 4)
+
+    def test_without_limit(self):
+        response = self.client.get('/api/users/subscriptions/')
+        for author in response.data['results']:
+            self.assertEqual(len(author['recipes']), 4)
+
+
+class RecipeSearchTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author, cls.other = create_user(0), create_user(1)
+        cls.soup = Tag.objects.create(name='Суп', color='#00ff00',
+                                      slug='soup')
+
+    def create(self, name, text='Текст', author=None, tags=()):
+        recipe = Recipe.objects.create(
+            author=author or self.author, name=name, text=text,
+            image='upload/recipe.png', cooking_time=10)
+        recipe.tags.set(tags)
+        return recipe
+
+    def search(self, query, **params):
+        # Версии меняются после коммита, а его в TestCase нет.
+        caches['default'].clear()
+        response = self.client.get('/api/recipes/',
+                                   {'search': query, **params})
+        self.assertEqual(response.status_code, 200)
+        return [recipe['id'] for recipe in response.data['results']]
+
+    def test_sqlite_triggers(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('FTS5 есть только в SQLite')
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT name FROM sqlite_master "
+                           "WHERE type = 'trigger' AND name LIKE "
+                           "'recipes_recipe_fts_%'")
+            triggers = {name for name, in cursor.fetchall()}
+        self.assertEqual(triggers, {'recipes_recipe_fts_insert',
+                                    'recipes_recipe_fts_delete',
+                                    'recipes_recipe_fts_update'})
+
+    def test_new_recipe_found(self):
+        recipe = self.create('Борщ украинский')
+        self.create('Салат')
+        self.assertEqual(self.search('борщ'), [recipe.id])
+
+    def test_edit_reflected(self):
+        recipe = self.create('Борщ украинский')
+        recipe.name = 'Щи суточные'
+        recipe.save()
+        self.assertEqual(self.search('борщ'), [])
+        self.assertEqual(self.search('щи'), [recipe.id])
+        recipe.delete()
+        self.assertEqual(self.search('щи'), [])
+
+    def test_combined_with_filters(self):
+        tagged = self.create('Борщ с тэгом', tags=[self.soup])
+        self.create('Борщ без тэга')
+        other = self.create('Борщ другого автора', author=self.other,
+                            tags=[self.soup])
+        self.assertCountEqual(self.search('борщ', tags='soup'),
+                              [tagged.id, other.id])
+        self.assertEqual(self.search('борщ', tags='soup',
+                                     author=self.other.id), [other.id])
+
+    def test_ranked(self):
+        in_text = self.create('Суп дня', text='Сегодня борщ со сметаной')
+        in_name = self.create('Борщ', text='Свёкла, капуста')
+        self.assertEqual(self.search('борщ'), [in_name.id, in_text.id])
+
+
+class StaleCountersTest(TestCase):
+    """Сохранение устаревшего экземпляра не откатывает счётчики."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user(0)
+        cls.recipe, = create_recipes([cls.user], 1)
+
+    def test_recipe_update(self):
+        stale = Recipe.objects.get(pk=self.recipe.pk)
+        counters.increment(Recipe, stale.pk, 'favorites_count')
+        serializer = CreateRecipeSerializer(
+            stale, partial=True,
+            context={'request': SimpleNamespace(user=self.user)},
+            data={'name': 'Новое название',
+                  'tags': [tag.id for tag in Tag.objects.all()],
+                  'ingredients': [{'id': Ingredient.objects.first().id,
+                                   'amount': 50}]})
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        serializer.save()
+        recipe = Recipe.objects.get(pk=stale.pk)
+        self.assertEqual(recipe.name, 'Новое название')
+        self.assertEqual(recipe.favorites_count, 1)
+
+    def test_full_save(self):
+        stale = Recipe.objects.get(pk=self.recipe.pk)
+        counters.increment(Recipe, stale.pk, 'in_carts_count')
+        stale.text = 'Другой текст'
+        stale.save()
+        recipe = Recipe.objects.get(pk=stale.pk)
+        self.assertEqual(recipe.text, 'Другой текст')
+        self.assertEqual(recipe.in_carts_count, 1)
+
+    def test_set_password(self):
+        stale = User.objects.get(pk=self.user.pk)
+        counters.increment(User, stale.pk, 'recipes_count')
+        User.objects.filter(pk=stale.pk).update(followers_count=3)
+        client = APIClient()
+        client.force_authenticate(stale)
+        response = client.post('/api/users/set_password/',
+                               {'current_password': 'pass-word-42',
+                                'new_password': 'new-pass-word-42'})
+        self.assertEqual(response.status_code, 204)
+        user = User.objects.get(pk=stale.pk)
+        self.assertTrue(user.check_password('new-pass-word-42'))
+        self.assertEqual((user.recipes_count, user.followers_count),
+                         (self.user.recipes_count + 1, 3))
+
+
+class RecipeUpdateQueriesTest(TestCase):
+    """Изменение рецепта пишет только разницу тэгов и состава."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user(0)
+        cls.recipe, = create_recipes([cls.user], 4)[3:]
+        cls.ingredients = list(Ingredient.objects.all()) + [
+            Ingredient.objects.create(name=f'Продукт {i}',
+                                      measurement_unit='г')
+            for i in range(4, 8)]
+        ShoppingCart.objects.create(user=cls.user, recipe=cls.recipe)
+        shopping.rebuild()
+
+    def test_update(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        # Из четырёх ингредиентов один удаляется, один меняется.
+        ingredients = ([{'id': item.id, 'amount': 100}
+                        for item in self.ingredients[:2]]
+                       + [{'id': self.ingredients[2].id, 'amount': 7}]
+                       + [{'id': item.id, 'amount': 20}
+                          for item in self.ingredients[4:7]])
+        tag = Tag.objects.get(slug='tag1')
+        version = get_version(RECIPES)
+        with self.captureOnCommitCallbacks(execute=True), \
+                self.assertNumQueries(27):
+            response = client.patch(f'/api/recipes/{self.recipe.id}/',
+                                    {'tags': [tag.id],
+                                     'ingredients': ingredients},
+                                    format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertNotEqual(get_version(RECIPES), version)
+        self.assertEqual([item['id'] for item in response.data['tags']],
+                         [tag.id])
+        expected = {item['id']: item['amount'] for item in ingredients}
+        self.assertEqual({item['id']: item['amount']
+                          for item in response.data['ingredients']},
+                         expected)
+        self.assertEqual(dict(self.user.shopping_list.values_list(
+            'ingredient_id', 'amount')), expected)
+
+
+class RecipeCursorPaginationTest(TestCase):
+    """Режим курсора: ключ сортировки, без OFFSET и COUNT(*)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.recipes = create_recipes([create_user(0)], 8)
+        base = timezone.now() - timedelta(days=1)
+        for i, recipe in enumerate(cls.recipes):
+            # Пары рецептов с одинаковой датой проверяют сортировку по id.
+            Recipe.objects.filter(pk=recipe.pk).update(
+                pub_date=base + timedelta(minutes=i // 2),
+                favorites_count=i % 3)
+
+    def setUp(self):
+        caches['default'].clear()
+        self.client = APIClient()
+
+    def walk(self, url, params, link='next'):
+        pages = []
+        while url:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200, response.data)
+            self.assertNotIn('count', response.data)
+            pages.append([recipe['id']
+                          for recipe in response.data['results']])
+            url, params = response.data[link], None
+        return pages
+
+    def test_next_and_previous(self):
+        expected = list(Recipe.objects.order_by('-pub_date', '-id')
+                        .values_list('id', flat=True))
+        with CaptureQueriesContext(connection) as queries:
+            pages = self.walk('/api/recipes/', {'cursor': '', 'limit': 3})
+        self.assertEqual(pages, [expected[:3], expected[3:6], expected[6:]])
+        self.assertFalse([query for query in queries
+                          if 'COUNT(' in query['sql']])
+        last = self.client.get('/api/recipes/', {'cursor': '', 'limit': 3})
+        for _ in range(2):
+            last = self.client.get(last.data['next'])
+        self.assertIsNone(last.data['next'])
+        self.assertEqual(self.walk(last.data['previous'], None, 'previous'),
+                         [expected[3:6], expected[:3]])
+
+    def test_popular(self):
+        expected = list(Recipe.objects.order_by(
+            '-favorites_count', '-pub_date', '-id')
+            .values_list('id', flat=True))
+        pages = self.walk('/api/recipes/', {'cursor': '', 'limit': 3,
+                                            'ordering': 'popular'})
+        self.assertEqual(sum(pages, []), expected)
+
+    def test_stable_across_inserts(self):
+        first = self.client.get('/api/recipes/', {'cursor': '', 'limit': 3})
+        Recipe.objects.create(author=self.recipes[0].author, name='Новый',
+                              image='upload/recipe.png', text='Текст',
+                              cooking_time=10)
+        second = self.client.get(first.data['next'])
+        expected = list(Recipe.objects.order_by('-pub_date', '-id')
+                        .exclude(name='Новый')
+                        .values_list('id', flat=True))
+        self.assertEqual([recipe['id'] for recipe in second.data['results']],
+                         expected[3:6])
+
+    def test_invalid_cursor(self):
+        popular = self.client.get('/api/recipes/', {
+            'cursor': '', 'limit': 3, 'ordering': 'popular'})
+        cursor = popular.data['next'].split('cursor=')[1].split('&')[0]
+        for value in ('garbage', 'MXwxfDI=', unquote(cursor)):
+            with self.subTest(cursor=value):
+                response = self.client.get('/api/recipes/',
+                                           {'cursor': value})
+                self.assertEqual(response.status_code, 404)
+
+    def test_search_rejected(self):
+        response = self.client.get('/api/recipes/',
+                                   {'cursor': '', 'search': 'Рецепт'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('cursor', response.data)
@@ -0,0 +1,76 @@
+"""Приём изображений рецептов: multipart с потоковой записью и base64."""
+import base64
+import binascii
+import uuid
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.http.multipartparser import MultiPartParserError
+from drf_extra_fields.fields import Base64ImageField
+from PIL import Image
+from rest_framework.fields import ImageField
+from rest_framework.serializers import ValidationError
+
+
+class LimitedTemporaryFileUploadHandler(TemporaryFileUploadHandler):
+    """Пишет файл во временный файл по частям и следит за размером."""
+    chunk_size = 64 * 1024
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.received = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > settings.RECIPE_IMAGE_MAX_SIZE:
+            raise MultiPartParserError(
+                f'File is larger than {settings.RECIPE_IMAGE_MAX_SIZE} bytes')
+        return super().receive_data_chunk(raw_data, start)
+
+
+def check_image(file):
+    """Проверяет размеры по заголовку, не декодируя изображение."""
+    try:
+        with Image.open(file) as image:
+            width, height = image.size
+    except (OSError, ValueError, Image.DecompressionBombError):
+        raise ValidationError('Upload a valid image.')
+    finally:
+        file.seek(0)
+    if max(width, height) > settings.RECIPE_IMAGE_MAX_SIDE:
+        raise ValidationError(
+            f'Image side must not exceed {settings.RECIPE_IMAGE_MAX_SIDE}px.')
+
+
+class RecipeImageField(Base64ImageField):
+    """Изображение рецепта: файл из multipart или строка base64."""
+
+    def to_internal_value(self, data):
+        if data in self.EMPTY_VALUES:
+            return None
+        if isinstance(data, UploadedFile):
+            if data.size > settings.RECIPE_IMAGE_MAX_SIZE:
+                raise ValidationError('Image file is too large.')
+            check_image(data)
+            return ImageField.to_internal_value(self, data)
+        if not isinstance(data, str):
+            raise ValidationError('Upload a file or a base64 string.')
+        if ';base64,' in data:
+            data = data.split(';base64,', 1)[1]
+        if len(data) * 3 // 4 > settings.RECIPE_IMAGE_MAX_SIZE:
+            raise ValidationError('Image file is too large.')
+        try:
+            decoded = base64.b64decode(data)
+        except (TypeError, binascii.Error, ValueError):
+            raise ValidationError(self.INVALID_FILE_MESSAGE)
+        del data
+        check_image(BytesIO(decoded))
+        name = str(uuid.uuid4())
+        extension = self.get_file_extension(name, decoded)
+        if extension not in self.ALLOWED_TYPES:
+            raise ValidationError(self.INVALID_TYPE_MESSAGE)
+        return ImageField.to_internal_value(
+            self, ContentFile(decoded, name=f'{name}.{extension}'))
@@ -3,7 +3,8 @@ from django.urls import include, path
 
 from .views import (UserViewSet, TagViewSet, IngredientViewSet,
                     RecipeViewSet, FavoriteRecipeView, ShoppingCartView,
-                    download_shopping_cart)
+                    download_shopping_cart, JobView, RecipeImportView,
+                    job_stats)
 
 router = DefaultRouter()
 router.register('tags', TagViewSet)
@@ -13,6 +14,10 @@ router.register('users', UserViewSet)
 
 
 urlpatterns = [path('recipes/download_shopping_cart/', download_shopping_cart),
+               path('recipes/import/', RecipeImportView.as_view()),
+               path('jobs/stats/', job_stats),
+               path('jobs/<int:job_id>/', JobView.as_view(),
+                    name='job-detail'),
                path('', include(router.urls)),
                path('recipes/<int:recipe_id>/favorite/',
                     FavoriteRecipeView.as_view()),
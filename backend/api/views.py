@@ -1,37 +1,75 @@
+import uuid
+
 from rest_framework.viewsets import (ModelViewSet, ReadOnlyModelViewSet,
                                      GenericViewSet)
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from rest_framework.decorators import api_view, action
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.decorators import (api_view, action,
+                                       permission_classes)
+from rest_framework.permissions import (IsAuthenticated, AllowAny,
+                                        IsAdminUser)
 from rest_framework import status, filters
+from rest_framework.exceptions import ValidationError
+from rest_framework.fields import BooleanField
+from rest_framework.parsers import FormParser, JSONParser, MultiPartParser
+from django.conf import settings
+from django.core.files.storage import default_storage
 from django.shortcuts import get_object_or_404
-from django.http.response import HttpResponse
+from django.db import transaction
+from django.db.models import (OuterRef, Prefetch, Subquery,
+                              prefetch_related_objects)
+from django.http.response import HttpResponse, StreamingHttpResponse
 from rest_framework.mixins import (CreateModelMixin, ListModelMixin,
                                    RetrieveModelMixin)
 from django_filters.rest_framework import DjangoFilterBackend
+from django_filters.utils import translate_validation
 
-from recipes.models import (Tag, Ingredient, Recipe)
+from recipes.catalog import TAGS, INGREDIENTS, POPULARITY
+from recipes.search import ingredient_index
+from recipes import shopping
+from recipes.similar import similar_recipes
+from recipes.pantry import pantry_index
+from recipes.counters import increment
+from recipes.models import Tag, Ingredient, Recipe, IngredientInRecipe
 from users.models import User
+from jobs.models import Job
+from jobs.queue import enqueue, stats
 from api.filters import RecipeFilter, IngredientFilter
 from api.permissions import AuthorPermission
 from api.serializers import (TagSerializer, IngredientSerializer,
                              RecipeSerializer, FavoriteRecipeSerializer,
                              ShoppingCartSerializer, UserSerializer,
-                             PasswordSerializer,
-                             CreateRecipeSerializer)
+                             PasswordSerializer, RecipeBaseSerializer,
+                             PantryRecipeSerializer, CreateRecipeSerializer,
+                             JobSerializer)
 from api.serializers import UserWithRecipeSerializer as UserRecipeSer
 from api.paginations import RecipePagination
+from api.snapshots import CatalogSnapshot
+from api.exports import FORMATS, shopping_list_etag, shopping_list_rows
+from api.membership import Membership, FOLLOWING, FAVORITES, CART
+from api.uploads import LimitedTemporaryFileUploadHandler
+from api.response_cache import cache_anonymous
+
+
+class CatalogViewSet(ReadOnlyModelViewSet):
+    """Справочник, полный список которого отдаётся готовым снимком."""
+    pagination_class = None
+    snapshot = None
+
+    def list(self, request, *args, **kwargs):
+        if request.accepted_renderer.format != 'json':
+            return super().list(request, *args, **kwargs)
+        return self.snapshot.response(request)
 
 
-class TagViewSet(ReadOnlyModelViewSet):
+class TagViewSet(CatalogViewSet):
     """ViewSet для тэгов."""
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
-    pagination_class = None
+    snapshot = CatalogSnapshot(TAGS, queryset, serializer_class)
 
 
-class IngredientViewSet(ReadOnlyModelViewSet):
+class IngredientViewSet(CatalogViewSet):
     """ViewSet для ингридиентов."""
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
@@ -39,7 +77,23 @@ class IngredientViewSet(ReadOnlyModelViewSet):
     filterset_fields = ('name', )
     search_fields = ('^name',)
     filterset_class = IngredientFilter
-    pagination_class = None
+    snapshot = CatalogSnapshot(INGREDIENTS, queryset, serializer_class)
+
+    def list(self, request, *args, **kwargs):
+        query = (request.query_params.get('name')
+                 or request.query_params.get('search'))
+        if not query:
+            return super().list(request, *args, **kwargs)
+        limit = request.query_params.get('limit')
+        limit = int(limit) if limit and limit.isdigit() else None
+        return Response(ingredient_index.search(query, limit))
+
+
+def ordering_catalogs(request):
+    """Число добавлений в избранное видно только в ordering=popular."""
+    if request.query_params.get('ordering') == 'popular':
+        return (POPULARITY,)
+    return ()
 
 
 class RecipeViewSet(ModelViewSet):
@@ -50,12 +104,105 @@ class RecipeViewSet(ModelViewSet):
     permission_classes = (AuthorPermission,)
     filterset_class = RecipeFilter
     pagination_class = RecipePagination
+    parser_classes = (JSONParser, MultiPartParser, FormParser)
+    lookup_value_regex = r'\d+'
+
+    def initialize_request(self, request, *args, **kwargs):
+        # Файлы из multipart сразу пишутся на диск по частям.
+        request.upload_handlers = [LimitedTemporaryFileUploadHandler(request)]
+        return super().initialize_request(request, *args, **kwargs)
+
+    def get_queryset(self):
+        """Рецепты со связанными данными.
+
+        Число запросов на страницу не зависит от её размера: вложенные
+        объекты подгружаются через prefetch_related, а флаги текущего
+        пользователя - пачкой через Membership.
+        """
+        queryset = Recipe.objects.select_related('author')
+        if self.action in ('update', 'partial_update', 'destroy'):
+            # Изменение читает состав само, ответ подгружает его заново.
+            return queryset
+        ingredients = IngredientInRecipe.objects.select_related('ingredient')
+        return queryset.prefetch_related(
+            'tags', Prefetch('ingredients', queryset=ingredients))
 
     def get_serializer_class(self):
         if self.request.method == "GET":
             return RecipeSerializer
         return CreateRecipeSerializer
 
+    @cache_anonymous(params=('page', 'limit', 'cursor', 'author', 'tags',
+                             'search', 'ordering'),
+                     catalogs=ordering_catalogs)
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @cache_anonymous()
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+    @action(detail=True, url_path='similar', pagination_class=None,
+            filter_backends=[])
+    def similar(self, request, pk=None):
+        recipe = get_object_or_404(Recipe.objects.only('id'), id=pk)
+        ranked = [recipe_id for recipe_id, _ in similar_recipes(recipe.id)]
+        found = Recipe.objects.only(
+            'id', 'name', 'image', 'image_variants', 'cooking_time'
+        ).in_bulk(ranked)
+        serializer = RecipeBaseSerializer(
+            [found[recipe_id] for recipe_id in ranked if recipe_id in found],
+            many=True, context={'request': request})
+        return Response(serializer.data)
+
+    @action(detail=False, url_path='pantry', pagination_class=None,
+            filter_backends=[])
+    def pantry(self, request):
+        """Рецепты по продуктам из ?ingredients=, по доле покрытия.
+
+        Принимает и фильтры списка рецептов: tags, author, is_favorited,
+        is_in_shopping_cart.
+        """
+        ingredient_ids = get_id_list(request, 'ingredients')
+        limit = get_pantry_limit(request)
+        filterset = RecipeFilter(request.query_params,
+                                 queryset=Recipe.objects.none(),
+                                 request=request)
+        if not filterset.is_valid():
+            raise translate_validation(filterset.errors)
+        data = filterset.form.cleaned_data
+        recipe_ids = None
+        if request.user.is_authenticated:
+            membership = Membership.for_request(request)
+            for name, related in (('is_favorited', FAVORITES),
+                                  ('is_in_shopping_cart', CART)):
+                if data.get(name):
+                    ids = set(membership.all_ids(related))
+                    recipe_ids = (ids if recipe_ids is None
+                                  else recipe_ids & ids)
+        author = data.get('author')
+        ranked = pantry_index.match(
+            ingredient_ids, limit,
+            tag_ids=[tag.id for tag in data.get('tags') or ()],
+            author_id=author.id if author else None, recipe_ids=recipe_ids)
+        found = Recipe.objects.only(
+            'id', 'name', 'image', 'image_variants', 'cooking_time'
+        ).in_bulk([recipe_id for recipe_id, _ in ranked])
+        recipes = []
+        for recipe_id, coverage in ranked:
+            if recipe_id in found:
+                found[recipe_id].coverage = coverage
+                recipes.append(found[recipe_id])
+        serializer = PantryRecipeSerializer(recipes, many=True,
+                                            context={'request': request})
+        return Response(serializer.data)
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        shopping.recipe_deleted(instance)
+        instance.delete()
+        increment(User, instance.author_id, 'recipes_count', -1)
+
 
 class FavoriteRecipeView(APIView):
     """ViewSet для избранного."""
@@ -68,7 +215,9 @@ class FavoriteRecipeView(APIView):
         if not serializer.is_valid():
             return Response(serializer.errors,
                             status=status.HTTP_400_BAD_REQUEST)
-        serializer.save()
+        with transaction.atomic():
+            serializer.save()
+            increment(Recipe, recipe_id, 'favorites_count')
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     def delete(self, request, recipe_id):
@@ -77,7 +226,9 @@ class FavoriteRecipeView(APIView):
         if not user.favorite.filter(recipe=recipe).exists():
             return Response({"errors": "рецепта нет в избранном"},
                             status=status.HTTP_400_BAD_REQUEST)
-        user.favorite.filter(recipe=recipe).delete()
+        with transaction.atomic():
+            deleted, _ = user.favorite.filter(recipe=recipe).delete()
+            increment(Recipe, recipe.id, 'favorites_count', -deleted)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
@@ -92,7 +243,10 @@ class ShoppingCartView(APIView):
         if not serializer.is_valid():
             return Response(serializer.errors,
                             status=status.HTTP_400_BAD_REQUEST)
-        serializer.save()
+        with transaction.atomic():
+            cart = serializer.save()
+            shopping.add_recipe(request.user, cart.recipe)
+            increment(Recipe, recipe_id, 'in_carts_count')
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     def delete(self, request, recipe_id):
@@ -102,7 +256,10 @@ class ShoppingCartView(APIView):
             return Response({"errors": "рецепта нет в списке покупок"},
                             status=status.HTTP_400_BAD_REQUEST)
 
-        user.shopping_cart.filter(recipe=recipe).delete()
+        with transaction.atomic():
+            deleted, _ = user.shopping_cart.filter(recipe=recipe).delete()
+            shopping.remove_recipe(user, recipe)
+            increment(Recipe, recipe.id, 'in_carts_count', -deleted)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
@@ -113,13 +270,117 @@ def download_shopping_cart(request):
                          "Authentication credentials were not provided."},
                         status=status.HTTP_401_UNAUTHORIZED)
     user = request.user
-    filename = 'shopping_list.txt'
-    response = HttpResponse(user.get_shopping_list(),
-                            content_type='text/plain')
-    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    file_format = request.query_params.get('type', 'txt')
+    if file_format not in FORMATS:
+        return Response({"detail": "Unsupported format."},
+                        status=status.HTTP_400_BAD_REQUEST)
+    run_async = request.query_params.get('async')
+    if run_async and BooleanField().to_internal_value(run_async):
+        job = enqueue('api.shopping_list', {'type': file_format}, user=user)
+        return job_accepted(request, job)
+    rows = shopping_list_rows(user)
+    etag = shopping_list_etag(rows, file_format)
+    if etag in request.META.get('HTTP_IF_NONE_MATCH', ''):
+        response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+    else:
+        render, content_type = FORMATS[file_format]
+        filename = f'shopping_list.{file_format}'
+        response = StreamingHttpResponse(render(rows),
+                                         content_type=content_type)
+        response['Content-Disposition'] = (
+            f'attachment; filename="{filename}"')
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
     return response
 
 
+def job_accepted(request, job):
+    """Ответ 202 со ссылкой на статус поставленной задачи."""
+    data = JobSerializer(job, context={'request': request}).data
+    return Response(data, status=status.HTTP_202_ACCEPTED,
+                    headers={'Location': data['url']})
+
+
+class JobView(APIView):
+    """Статус фоновой задачи, видна только её владельцу."""
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request, job_id):
+        job = get_object_or_404(Job, id=job_id, user=request.user)
+        return Response(JobSerializer(job, context={'request': request}).data)
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def job_stats(request):
+    return Response(stats())
+
+
+class RecipeImportView(APIView):
+    """Загрузка JSONL с рецептами (см. import_recipes) в фоне."""
+    permission_classes = (IsAdminUser,)
+    parser_classes = (MultiPartParser,)
+
+    def post(self, request):
+        upload = request.FILES.get('file')
+        if upload is None:
+            raise ValidationError({'file': ['No file was submitted.']})
+        suffix = '.jsonl.gz' if upload.name.endswith('.gz') else '.jsonl'
+        path = default_storage.save(f'imports/{uuid.uuid4().hex}{suffix}',
+                                    upload)
+        job = enqueue('recipes.import', {'path': path}, user=request.user)
+        return job_accepted(request, job)
+
+
+def get_id_list(request, name):
+    """Непустой список id из ?name=1&name=2 или ?name=1,2."""
+    values = [value for param in request.query_params.getlist(name)
+              for value in param.split(',') if value]
+    if not values or not all(value.isdigit() for value in values):
+        raise ValidationError({name: ['Must be a list of integer ids.']})
+    return [int(value) for value in values]
+
+
+def get_pantry_limit(request):
+    """Значение limit для подбора по продуктам: не больше PANTRY_MAX_LIMIT."""
+    limit = request.query_params.get('limit') or str(settings.PANTRY_LIMIT)
+    if not limit.isdigit() or int(limit) < 1:
+        raise ValidationError({'limit': ['Must be a positive integer.']})
+    return min(int(limit), settings.PANTRY_MAX_LIMIT)
+
+
+def get_recipes_limit(request):
+    """Значение recipes_limit из запроса: None или целое число > 0."""
+    recipes_limit = request.query_params.get('recipes_limit')
+    if recipes_limit is None or recipes_limit == '':
+        return None
+    if not recipes_limit.isdigit() or int(recipes_limit) < 1:
+        raise ValidationError(
+            {'recipes_limit': ['Must be a positive integer.']})
+    return int(recipes_limit)
+
+
+def attach_recipes(authors, recipes_limit):
+    """Загружает рецепты авторов одним запросом.
+
+    С recipes_limit берутся по recipes_limit последних рецептов каждого
+    автора: id отбираются коррелированным подзапросом с LIMIT. Результат
+    кладётся в атрибут latest_recipes каждого автора.
+    """
+    authors = list(authors)
+    recipes = (Recipe.objects.order_by('-pub_date', '-id')
+               .only('id', 'author_id', 'name', 'image', 'image_variants',
+                     'cooking_time'))
+    if recipes_limit is not None:
+        latest = (Recipe.objects.filter(author_id=OuterRef('author_id'))
+                  .order_by('-pub_date', '-id')
+                  .values('id')[:recipes_limit])
+        recipes = recipes.filter(id__in=Subquery(latest))
+    prefetch_related_objects(authors, Prefetch('recipes', queryset=recipes,
+                                               to_attr='latest_recipes'))
+    return authors
+
+
 class UserViewSet(CreateModelMixin, ListModelMixin, RetrieveModelMixin,
                   GenericViewSet):
     """ViewSet для пользователя."""
@@ -127,6 +388,10 @@ class UserViewSet(CreateModelMixin, ListModelMixin, RetrieveModelMixin,
     serializer_class = UserSerializer
     permission_classes = (AllowAny,)
 
+    @cache_anonymous()
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
     @action(detail=False, url_path='me', permission_classes=[IsAuthenticated])
     def user_me(self, request):
         serializer = self.serializer_class(request.user, context={'request':
@@ -143,7 +408,8 @@ class UserViewSet(CreateModelMixin, ListModelMixin, RetrieveModelMixin,
             return Response(serializer.errors,
                             status=status.HTTP_400_BAD_REQUEST)
         user.set_password(serializer.validated_data['new_password'])
-        user.save()
+        # request.user может быть из кэша токенов: только пароль.
+        user.save(update_fields=['password'])
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(detail=True, methods=['post', 'delete'], url_path='subscribe',
@@ -154,16 +420,20 @@ class UserViewSet(CreateModelMixin, ListModelMixin, RetrieveModelMixin,
         if user == author:
             return Response({"detail": "Subscribe to myself"},
                             status=status.HTTP_400_BAD_REQUEST)
+        membership = Membership.for_request(request)
         if request.method == "POST":
-            if user.is_following(author):
+            if membership.contains(FOLLOWING, author.id):
                 return Response({"detail": "Already subscribed."},
                                 status=status.HTTP_400_BAD_REQUEST)
+            recipes_limit = get_recipes_limit(request)
             user.follow(author)
-            recipes_limit = request.query_params.get('recipes_limit')
+            membership.remember(FOLLOWING, [author.id])
+            author.refresh_from_db()
+            attach_recipes([author], recipes_limit)
             serializer = UserRecipeSer(author, context={
                 'request': request, 'recipes_limit': recipes_limit})
             return Response(serializer.data, status=status.HTTP_201_CREATED)
-        if not user.is_following(author):
+        if not membership.contains(FOLLOWING, author.id):
             return Response({"detail": "Not subscribed."},
                             status=status.HTTP_400_BAD_REQUEST)
         user.unfollow(author)
@@ -172,10 +442,12 @@ class UserViewSet(CreateModelMixin, ListModelMixin, RetrieveModelMixin,
     @action(detail=False, url_path='subscriptions',
             permission_classes=[IsAuthenticated])
     def subscriptions(self, request):
-        recipes_limit = request.query_params.get('recipes_limit')
+        recipes_limit = get_recipes_limit(request)
         context = {"request": request, 'recipes_limit': recipes_limit}
         user = request.user
         query = User.objects.filter(following__user=user)
-        serializer = UserRecipeSer(self.paginate_queryset(query),
-                                   many=True, context=context)
+        page = attach_recipes(self.paginate_queryset(query), recipes_limit)
+        Membership.for_request(request).remember(
+            FOLLOWING, [author.id for author in page])
+        serializer = UserRecipeSer(page, many=True, context=context)
         return self.get_paginated_response(serializer.data)
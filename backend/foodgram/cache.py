@@ -0,0 +1,297 @@
+"""Двухуровневый кэш проекта.
+
+Первый уровень - LRU в памяти процесса с TTL и ограничением по числу
+записей и объёму, второй - общий для всех процессов кэш (файловый,
+в базе или Redis, см. CACHE_URL). Запись идёт в оба уровня, чтение -
+сначала из памяти, потом из общего кэша. Копия в памяти живёт не
+дольше LOCAL_TIMEOUT секунд (или таймаута пространства имён), поэтому
+изменения из других процессов видны с этой задержкой. Без общего
+уровня процессы не видят изменений друг друга, это ошибка системной
+проверки check_shared_tier.
+
+Ключи проекта собираются через Namespace: <имя>:<версия>:<ключ>.
+Счётчики попаданий, промахов и вытеснений ведутся по именам (STATS).
+"""
+import pickle
+import threading
+import time
+from collections import Counter, OrderedDict, defaultdict
+
+from django.core import checks
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+STATS = defaultdict(Counter)
+# Время жизни копии в памяти по пространствам имён, см. Namespace.
+LOCAL_TIMEOUTS = {}
+_MISSING = object()
+_local_caches = {}
+_local_caches_lock = threading.Lock()
+
+
+def namespace_of(key):
+    """Пространство имён ключа вида имя:..."""
+    return key.split(':', 1)[0]
+
+
+class LRUCache:
+    """Ограниченный словарь с TTL, потокобезопасный.
+
+    Значения хранятся как есть; size - наибольшее число записей,
+    max_bytes - наибольший суммарный размер (для значений-байтов).
+    """
+
+    def __init__(self, size, ttl=None, max_bytes=None, on_evict=None):
+        self.size = size
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.on_evict = on_evict
+        self.bytes = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _weight(self, value):
+        return len(value) if isinstance(value, bytes) else 0
+
+    def _pop(self, key):
+        _, value = self._data.pop(key)
+        self.bytes -= self._weight(value)
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            expires, value = item
+            if expires is not None and expires < time.monotonic():
+                self._pop(key)
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=_MISSING):
+        ttl = self.ttl if ttl is _MISSING else ttl
+        expires = None if ttl is None else time.monotonic() + ttl
+        with self._lock:
+            if key in self._data:
+                self._pop(key)
+            self._data[key] = (expires, value)
+            self.bytes += self._weight(value)
+            while self._data and (
+                    len(self._data) > self.size
+                    or self.max_bytes and self.bytes > self.max_bytes):
+                evicted = next(iter(self._data))
+                self._pop(evicted)
+                if self.on_evict is not None:
+                    self.on_evict(evicted)
+
+    def delete(self, key):
+        with self._lock:
+            if key not in self._data:
+                return False
+            self._pop(key)
+            return True
+
+    def delete_where(self, predicate):
+        with self._lock:
+            for key in [key for key, (_, value) in self._data.items()
+                        if predicate(value)]:
+                self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def __len__(self):
+        return len(self._data)
+
+
+def _count_eviction(key):
+    # Ключи в LRU собраны make_key: префикс:версия:ключ.
+    STATS[namespace_of(key.split(':', 2)[-1])]['evictions'] += 1
+
+
+class TwoTierCache(BaseCache):
+    """Бэкенд кэша Django: LRU в памяти процесса поверх общего кэша.
+
+    OPTIONS: SHARED - алиас общего кэша (без него кэш только в памяти),
+    MAX_ENTRIES и MAX_BYTES - пределы памяти, LOCAL_TIMEOUT - сколько
+    секунд копия в памяти считается актуальной.
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._shared_alias = options.get('SHARED')
+        self._local_timeout = options.get('LOCAL_TIMEOUT', 5)
+        # Один LRU на процесс: экземпляры бэкенда создаются на поток.
+        with _local_caches_lock:
+            if location not in _local_caches:
+                _local_caches[location] = LRUCache(
+                    self._max_entries, max_bytes=options.get('MAX_BYTES'),
+                    on_evict=_count_eviction)
+        self._local = _local_caches[location]
+
+    @property
+    def shared(self):
+        return caches[self._shared_alias] if self._shared_alias else None
+
+    def _local_ttl(self, key, timeout):
+        """Срок жизни копии в памяти, секунды (None - бессрочно)."""
+        expires = self.get_backend_timeout(timeout)
+        ttl = None if expires is None else max(expires - time.time(), 0)
+        if self.shared is None:
+            return ttl
+        local = LOCAL_TIMEOUTS.get(namespace_of(key), self._local_timeout)
+        return local if ttl is None else min(ttl, local)
+
+    def _keep(self, key, value, timeout, version):
+        ttl = self._local_ttl(key, timeout)
+        if ttl is None or ttl > 0:
+            self._local.set(self.make_key(key, version), pickle.dumps(
+                value, pickle.HIGHEST_PROTOCOL), ttl)
+
+    def _from_local(self, key, version):
+        data = self._local.get(self.make_key(key, version))
+        return _MISSING if data is None else pickle.loads(data)
+
+    def get(self, key, default=None, version=None):
+        value = self.get_many([key], version=version).get(key, _MISSING)
+        return default if value is _MISSING else value
+
+    def get_many(self, keys, version=None):
+        found, missing = {}, []
+        for key in keys:
+            self.validate_key(key)
+            value = self._from_local(key, version)
+            if value is _MISSING:
+                missing.append(key)
+            else:
+                STATS[namespace_of(key)]['local_hits'] += 1
+                found[key] = value
+        if missing and self.shared is not None:
+            shared = self.shared.get_many(missing, version=version)
+            for key, value in shared.items():
+                STATS[namespace_of(key)]['shared_hits'] += 1
+                self._keep(key, value, DEFAULT_TIMEOUT, version)
+            found.update(shared)
+        for key in missing:
+            if key not in found:
+                STATS[namespace_of(key)]['misses'] += 1
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.validate_key(key)
+        STATS[namespace_of(key)]['sets'] += 1
+        if self.shared is not None:
+            self.shared.set(key, value, timeout, version=version)
+        self._keep(key, value, timeout, version)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.validate_key(key)
+        if self.shared is not None:
+            if not self.shared.add(key, value, timeout, version=version):
+                return False
+        elif self._from_local(key, version) is not _MISSING:
+            return False
+        self._keep(key, value, timeout, version)
+        return True
+
+    def incr(self, key, delta=1, version=None):
+        if self.shared is None:
+            return super().incr(key, delta, version)
+        self._local.delete(self.make_key(key, version))
+        return self.shared.incr(key, delta, version=version)
+
+    def delete(self, key, version=None):
+        self.validate_key(key)
+        deleted = self._local.delete(self.make_key(key, version))
+        if self.shared is not None:
+            deleted = self.shared.delete(key, version=version)
+        return deleted
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        if self.shared is not None:
+            self._local.delete(self.make_key(key, version))
+            return self.shared.touch(key, timeout, version=version)
+        value = self._from_local(key, version)
+        if value is _MISSING:
+            return False
+        self._keep(key, value, timeout, version)
+        return True
+
+    def has_key(self, key, version=None):
+        return self.get(key, _MISSING, version=version) is not _MISSING
+
+    def clear(self):
+        self._local.clear()
+        if self.shared is not None:
+            self.shared.clear()
+
+
+class Namespace:
+    """Ключи проекта одного назначения: <name>:<version>:<key>.
+
+    version меняется, когда меняется формат хранимых значений.
+    local_timeout - сколько секунд копия в памяти процесса может
+    расходиться с общим кэшем (0 - читать только общий кэш).
+    """
+
+    def __init__(self, name, version=1, local_timeout=None,
+                 alias='default'):
+        self.name = name
+        self.version = version
+        self.alias = alias
+        if local_timeout is not None:
+            LOCAL_TIMEOUTS[name] = local_timeout
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def key(self, key):
+        return f'{self.name}:{self.version}:{key}'
+
+    def get(self, key, default=None):
+        return self.cache.get(self.key(key), default)
+
+    def get_many(self, keys):
+        found = self.cache.get_many([self.key(key) for key in keys])
+        return {key: found[self.key(key)] for key in keys
+                if self.key(key) in found}
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT):
+        self.cache.set(self.key(key), value, timeout)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT):
+        return self.cache.add(self.key(key), value, timeout)
+
+    def delete(self, key):
+        return self.cache.delete(self.key(key))
+
+    def read_through(self, key, compute, timeout=DEFAULT_TIMEOUT):
+        """Значение из кэша, а при промахе - compute(), сохранённое."""
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = compute()
+            self.set(key, value, timeout)
+        return value
+
+
+def check_shared_tier(app_configs, **kwargs):
+    """У кэша default должен быть общий для процессов уровень."""
+    if getattr(caches['default'], 'shared', None) is not None:
+        return []
+    return [checks.Error(
+        'The default cache has no shared tier, so catalog versions, '
+        'cached responses and token generations are not seen by other '
+        'processes.',
+        hint="Set OPTIONS['SHARED'] of the default cache to the alias of "
+             'a cache shared by all worker processes.',
+        id='foodgram.E001')]
+
+
+def stats():
+    """Счётчики попаданий, промахов и вытеснений по пространствам имён."""
+    return {name: dict(counter) for name, counter in STATS.items()}
@@ -0,0 +1,199 @@
+"""Метрики запросов в текстовом формате Prometheus.
+
+Каждый процесс копит счётчики и гистограммы в памяти (REGISTRY) и не
+чаще раза в METRICS_FLUSH_INTERVAL секунд сбрасывает их в свой файл
+в METRICS_DIR. Эндпоинт /metrics складывает файлы всех процессов,
+поэтому показывает сумму по всем воркерам gunicorn. Файлы завершённых
+процессов остаются, чтобы счётчики не уменьшались; каталог стоит
+очищать при выкладке. Имя файла - pid и время старта процесса: pid
+завершённого процесса может достаться новому.
+
+Кроме метрик запросов в файл попадают значения коллекторов (collector)
+с per_process=True - счётчики других подсистем процесса. Коллекторы
+с per_process=False вызываются один раз при чтении /metrics.
+"""
+import atexit
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+
+from django.conf import settings
+
+from foodgram import cache
+
+# Границы корзин гистограмм, см. Registry.observe.
+BUCKETS = {
+    'foodgram_http_request_duration_seconds': (
+        0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+    'foodgram_http_request_queries': (0, 1, 2, 5, 10, 20, 50, 100),
+}
+COLLECTORS = []
+
+
+class Registry:
+    """Счётчики и гистограммы процесса, потокобезопасно."""
+
+    def __init__(self):
+        self.counters = defaultdict(float)
+        self.histograms = {}
+        self.flushed_at = 0.0
+        self._pid = None
+        self._started = None
+        self._lock = threading.Lock()
+
+    def inc(self, name, labels, value=1):
+        with self._lock:
+            self.counters[name, labels] += value
+
+    def observe(self, name, labels, value):
+        buckets = BUCKETS[name]
+        with self._lock:
+            histogram = self.histograms.get((name, labels))
+            if histogram is None:
+                # Счётчики корзин, затем сумма и число наблюдений.
+                histogram = self.histograms[name, labels] = (
+                    [0] * (len(buckets) + 3))
+            histogram[bisect_left(buckets, value)] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    def clear(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def dump(self):
+        with self._lock:
+            counters = [[name, list(labels), value]
+                        for (name, labels), value in self.counters.items()]
+            histograms = [[name, list(labels), list(values)]
+                          for (name, labels), values
+                          in self.histograms.items()]
+        for collect in COLLECTORS:
+            if collect.per_process:
+                counters.extend([name, sorted(labels.items()), value]
+                                for name, labels, value in collect())
+        return {'counters': counters, 'histograms': histograms}
+
+    def filename(self):
+        """Имя файла процесса; после fork у потомка оно своё."""
+        pid = os.getpid()
+        if pid != self._pid:
+            self._pid, self._started = pid, time.time_ns()
+        return f'{pid}-{self._started}.json'
+
+    def flush(self):
+        """Записывает метрики процесса в METRICS_DIR."""
+        self.flushed_at = time.monotonic()
+        directory = settings.METRICS_DIR
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, self.filename())
+        temporary = f'{path}.{threading.get_ident()}.tmp'
+        with open(temporary, 'w') as file:
+            json.dump(self.dump(), file)
+        os.replace(temporary, path)
+
+    def maybe_flush(self):
+        if (time.monotonic() - self.flushed_at
+                >= settings.METRICS_FLUSH_INTERVAL):
+            self.flush()
+
+
+REGISTRY = Registry()
+
+
+@atexit.register
+def _flush_on_exit():
+    if REGISTRY.counters or REGISTRY.histograms:
+        REGISTRY.flush()
+
+
+def collector(per_process=True):
+    """Регистрирует функцию, которая отдаёт (имя, метки, значение).
+
+    Имена счётчиков оканчиваются на _total, остальные считаются
+    gauge. per_process - значения свои у каждого процесса и
+    складываются по всем воркерам.
+    """
+    def decorator(collect):
+        collect.per_process = per_process
+        COLLECTORS.append(collect)
+        return collect
+    return decorator
+
+
+@collector()
+def cache_metrics():
+    for namespace, counters in cache.stats().items():
+        for event, value in counters.items():
+            yield ('foodgram_cache_events_total',
+                   {'namespace': namespace, 'event': event}, value)
+
+
+def _number(value):
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+
+def _label(labels):
+    escaped = (f'{name}="' + str(value).replace('\\', r'\\')
+               .replace('"', r'\"').replace('\n', r'\n') + '"'
+               for name, value in labels)
+    return '{' + ','.join(escaped) + '}' if labels else ''
+
+
+def collect():
+    """Метрики всех процессов из METRICS_DIR, сложенные вместе."""
+    REGISTRY.flush()
+    counters = defaultdict(float)
+    histograms = {}
+    directory = settings.METRICS_DIR
+    for filename in os.listdir(directory):
+        if not filename.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(directory, filename)) as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            continue
+        for name, labels, value in data['counters']:
+            counters[name, tuple(map(tuple, labels))] += value
+        for name, labels, values in data['histograms']:
+            key = (name, tuple(map(tuple, labels)))
+            if key in histograms:
+                histograms[key] = [
+                    a + b for a, b in zip(histograms[key], values)]
+            else:
+                histograms[key] = values
+    for collect in COLLECTORS:
+        if not collect.per_process:
+            for name, labels, value in collect():
+                counters[name, tuple(sorted(labels.items()))] = value
+    return counters, histograms
+
+
+def render():
+    """Текст для /metrics в формате Prometheus 0.0.4."""
+    counters, histograms = collect()
+    lines = []
+    declared = set()
+    for (name, labels), value in sorted(counters.items()):
+        if name not in declared:
+            declared.add(name)
+            kind = 'counter' if name.endswith('_total') else 'gauge'
+            lines.append(f'# TYPE {name} {kind}')
+        lines.append(f'{name}{_label(labels)} {_number(value)}')
+    for (name, labels), values in sorted(histograms.items()):
+        if name not in declared:
+            declared.add(name)
+            lines.append(f'# TYPE {name} histogram')
+        cumulative = 0
+        for bound, count in zip(BUCKETS[name] + ('+Inf',), values):
+            cumulative += count
+            bucket = labels + (('le', bound),)
+            lines.append(f'{name}_bucket{_label(bucket)} {cumulative}')
+        lines.append(f'{name}_sum{_label(labels)} {_number(values[-2])}')
+        lines.append(f'{name}_count{_label(labels)} {values[-1]}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,121 @@
+import logging
+import time
+
+from django.conf import settings
+from django.db import connection
+
+from foodgram.metrics import REGISTRY
+from foodgram.queries import QueryInspector
+
+logger = logging.getLogger(__name__)
+
+
+class RequestTiming:
+    """Время и число SQL-запросов и время рендеринга одного запроса."""
+
+    def __init__(self):
+        self.queries = 0
+        self.sql = 0.0
+        self.render = 0.0
+        self._render_started = None
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql += time.perf_counter() - start
+            self.queries += 1
+
+    def render_started(self):
+        self._render_started = time.perf_counter()
+
+    def render_finished(self, response):
+        self.render = time.perf_counter() - self._render_started
+
+
+class MetricsMiddleware:
+    """Метрики запросов по представлениям (см. foodgram.metrics).
+
+    Считает длительность, число и время SQL-запросов, время рендеринга
+    ответа и размер ответа. Рендеринг - только работа renderer над
+    готовым response.data; сериализаторы выполняются в представлении
+    и попадают в app. Сотрудникам отдаёт те же цифры в заголовке
+    Server-Timing.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.METRICS_ENABLED:
+            return self.get_response(request)
+        timing = request.timing = RequestTiming()
+        start = time.perf_counter()
+        with connection.execute_wrapper(timing):
+            response = self.get_response(request)
+        total = time.perf_counter() - start
+        match = request.resolver_match
+        labels = (('view', match.view_name if match else 'unmatched'),
+                  ('method', request.method))
+        REGISTRY.observe('foodgram_http_request_duration_seconds',
+                         labels, total)
+        REGISTRY.observe('foodgram_http_request_queries', labels,
+                         timing.queries)
+        REGISTRY.inc('foodgram_http_requests_total',
+                     labels + (('status', response.status_code),))
+        REGISTRY.inc('foodgram_http_sql_seconds_total', labels, timing.sql)
+        REGISTRY.inc('foodgram_http_render_seconds_total', labels,
+                     timing.render)
+        if not response.streaming:
+            REGISTRY.inc('foodgram_http_response_bytes_total', labels,
+                         len(response.content))
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_staff:
+            response['Server-Timing'] = ', '.join((
+                f'db;dur={timing.sql * 1000:.1f};'
+                f'desc="{timing.queries} queries"',
+                f'render;dur={timing.render * 1000:.1f}',
+                f'app;dur={(total - timing.sql - timing.render) * 1000:.1f}',
+                f'total;dur={total * 1000:.1f}'))
+        REGISTRY.maybe_flush()
+        return response
+
+    def process_template_response(self, request, response):
+        # Вызывается прямо перед response.render(), конец рендеринга
+        # отмечает post-render callback.
+        timing = getattr(request, 'timing', None)
+        if timing is not None:
+            timing.render_started()
+            response.add_post_render_callback(timing.render_finished)
+        return response
+
+
+class QueryInspectorMiddleware:
+    """Повторяющиеся запросы (N+1) и журнал медленных запросов.
+
+    N_PLUS_ONE: off - только медленные запросы (для продакшена), log -
+    предупреждение в лог со стеком, raise - NPlusOneError, от которой
+    падают тесты и страница в runserver.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        mode = settings.N_PLUS_ONE
+        inspector = request.query_inspector = QueryInspector(
+            fingerprints=mode != 'off',
+            context={'method': request.method, 'path': request.path})
+        with connection.execute_wrapper(inspector):
+            response = self.get_response(request)
+        if inspector.fingerprints and inspector.repeated():
+            if mode == 'raise':
+                inspector.check()
+            logger.warning('Repeated queries in %s %s:\n%s', request.method,
+                           request.path, inspector.report())
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.query_inspector.context['view'] = (
+            request.resolver_match.view_name)
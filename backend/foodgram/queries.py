@@ -0,0 +1,126 @@
+"""Разбор SQL-запросов: повторы (N+1) и медленные запросы.
+
+Отпечаток запроса - его текст без литералов, списки IN (...) любой
+длины сводятся к одному виду. QueryInspector считает отпечатки и,
+когда отпечаток повторяется больше threshold раз, запоминает стек
+вызова из кода проекта. Запросы дольше SLOW_QUERY_MS пишутся в лог
+foodgram.slow_queries одной JSON-строкой.
+
+В тестах: with detect_n_plus_one(): ... - падает с NPlusOneError.
+"""
+import json
+import logging
+import os
+import re
+import time
+import traceback
+from collections import Counter
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection
+
+slow_logger = logging.getLogger('foodgram.slow_queries')
+
+STRINGS = re.compile(r"'(?:[^']|'')*'")
+NUMBERS = re.compile(r'(?<![\w."])-?\d+(?:\.\d+)?\b')
+IN_LISTS = re.compile(r'\bIN \((?:\s*(?:\?|%s|NULL),?)+\)', re.IGNORECASE)
+SPACES = re.compile(r'\s+')
+DJANGO_DB = os.path.join('django', 'db', '')
+# Кадры самого учёта запросов в стек не попадают.
+INSTRUMENTATION = {__file__, os.path.join(os.path.dirname(__file__),
+                                          'middleware.py')}
+
+
+class NPlusOneError(Exception):
+    pass
+
+
+def fingerprint(sql):
+    sql = STRINGS.sub('?', sql)
+    sql = NUMBERS.sub('?', sql)
+    sql = sql.replace('%s', '?')
+    sql = IN_LISTS.sub('IN (...)', sql)
+    return SPACES.sub(' ', sql).strip()
+
+
+def query_stack(callers=3):
+    """Откуда пришёл запрос: код проекта и ближайшие кадры библиотек."""
+    base = str(settings.BASE_DIR)
+    frames = [frame for frame in traceback.extract_stack()
+              if frame.filename not in INSTRUMENTATION]
+    nearest = {id(frame) for frame in [
+        frame for frame in frames
+        if DJANGO_DB not in frame.filename][-callers:]}
+    return [f'{frame.filename}:{frame.lineno} in {frame.name}'
+            for frame in frames
+            if id(frame) in nearest or frame.filename.startswith(base)
+            and 'site-packages' not in frame.filename]
+
+
+class QueryInspector:
+    """execute_wrapper: отпечатки запросов и медленные запросы.
+
+    fingerprints=False - только журнал медленных запросов (дёшево).
+    """
+
+    def __init__(self, threshold=None, fingerprints=True, context=None):
+        self.threshold = (settings.N_PLUS_ONE_THRESHOLD
+                          if threshold is None else threshold)
+        self.fingerprints = fingerprints
+        self.context = context or {}
+        self.counts = Counter()
+        self.stacks = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = (time.perf_counter() - start) * 1000
+            if self.fingerprints:
+                self._count(sql)
+            if duration >= settings.SLOW_QUERY_MS:
+                self._log_slow(sql, duration)
+
+    def _count(self, sql):
+        key = fingerprint(sql)
+        self.counts[key] += 1
+        # Стек берётся на первом лишнем повторе: он указывает на цикл.
+        if self.counts[key] == self.threshold + 1:
+            self.stacks[key] = query_stack()
+
+    def _log_slow(self, sql, duration):
+        slow_logger.warning(json.dumps({
+            'duration_ms': round(duration, 1),
+            'fingerprint': fingerprint(sql),
+            **self.context,
+        }, ensure_ascii=False))
+
+    def repeated(self):
+        """[(отпечаток, число повторов, стек)] сверх threshold."""
+        return [(key, count, self.stacks[key])
+                for key, count in self.counts.most_common()
+                if count > self.threshold]
+
+    def report(self):
+        lines = []
+        for key, count, stack in self.repeated():
+            lines.append(f'{count} x {key}')
+            lines.extend(f'    {frame}' for frame in stack)
+        return '\n'.join(lines)
+
+    def check(self):
+        if self.repeated():
+            raise NPlusOneError(
+                f'Queries repeated more than {self.threshold} times:\n'
+                + self.report())
+
+
+@contextmanager
+def detect_n_plus_one(threshold=None):
+    """Падает с NPlusOneError, если запрос в блоке повторился чаще."""
+    inspector = QueryInspector(threshold)
+    with connection.execute_wrapper(inspector):
+        yield inspector
+    inspector.check()
@@ -1,5 +1,8 @@
 # flake8: noqa
 import os
+import sys
+import tempfile
+
 import environ
 from pathlib import Path
 
@@ -26,6 +29,9 @@ SECRET_KEY = env.str('SECRET_KEY', 'django-insecure-oxthbs+oj66i-changeme')
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = env.bool('DEBUG', False)
 
+# manage.py test: SQLite, кэши и метрики только в памяти процесса.
+TESTING = sys.argv[1:2] == ['test']
+
 ALLOWED_HOSTS = env.list('ALLOWED_HOSTS', default=['127.0.0.1'])
 
 # Application definition
@@ -44,10 +50,13 @@ INSTALLED_APPS = [
     'api.apps.ApiConfig',
     'recipes.apps.RecipesConfig',
     'django_filters',
+    'jobs.apps.JobsConfig',
 
 ]
 
 MIDDLEWARE = [
+    'foodgram.middleware.MetricsMiddleware',
+    'foodgram.middleware.QueryInspectorMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -81,7 +90,7 @@ WSGI_APPLICATION = 'foodgram.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
 
-if DEBUG:
+if DEBUG or TESTING:
     DATABASES = {
         'default': {
             'ENGINE': 'django.db.backends.sqlite3',
@@ -127,7 +136,7 @@ REST_FRAMEWORK = {
     ],
 
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 6,
@@ -158,6 +167,117 @@ MEDIA_URL = '/media/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Все кэши проекта идут через foodgram.cache: LRU в памяти процесса
+# поверх общего кэша. CACHE_URL - файловый (по умолчанию), dbcache://
+# (нужен createcachetable) или redis:// (нужен пакет django-redis).
+CACHES = {
+    'default': {
+        'BACKEND': 'foodgram.cache.TwoTierCache',
+        'LOCATION': 'default',
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'SHARED': 'shared',
+            'MAX_ENTRIES': env.int('CACHE_LOCAL_MAX_ENTRIES', 10000),
+            'MAX_BYTES': env.int('CACHE_LOCAL_MAX_BYTES', 64 * 1024 * 1024),
+            'LOCAL_TIMEOUT': env.int('CACHE_LOCAL_TIMEOUT', 5),
+        },
+    },
+    'shared': env.cache(
+        'CACHE_URL', 'filecache:///tmp/foodgram-cache?MAX_ENTRIES=20000'),
+}
+if TESTING:
+    CACHES['shared'] = {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+
+# Метрики запросов, см. foodgram.metrics. METRICS_DIR должен быть общим
+# для всех воркеров gunicorn.
+METRICS_ENABLED = env.bool('METRICS_ENABLED', True)
+METRICS_DIR = (os.path.join(tempfile.gettempdir(), 'foodgram-metrics-test')
+               if TESTING else env.str('METRICS_DIR', '/tmp/foodgram-metrics'))
+METRICS_FLUSH_INTERVAL = env.float('METRICS_FLUSH_INTERVAL', 5)
+METRICS_TOKEN = env.str('METRICS_TOKEN', '')
+
+# Повторы запросов (N+1), см. foodgram.queries: off, log или raise.
+# В тестах повтор - ошибка.
+N_PLUS_ONE = ('raise' if TESTING
+              else env.str('N_PLUS_ONE', 'log' if DEBUG else 'off'))
+N_PLUS_ONE_THRESHOLD = env.int('N_PLUS_ONE_THRESHOLD', 5)
+# Запросы дольше SLOW_QUERY_MS пишутся JSON-строками в SLOW_QUERY_LOG
+# (или в stderr, если файл не задан).
+SLOW_QUERY_MS = env.float('SLOW_QUERY_MS', 200)
+SLOW_QUERY_LOG = env.str('SLOW_QUERY_LOG', '')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'message': {'format': '%(message)s'},
+    },
+    'handlers': {
+        'slow_queries': {
+            'class': 'logging.FileHandler',
+            'filename': SLOW_QUERY_LOG,
+            'formatter': 'message',
+        } if SLOW_QUERY_LOG else {
+            'class': 'logging.StreamHandler',
+            'formatter': 'message',
+        },
+    },
+    'loggers': {
+        'foodgram.slow_queries': {
+            'handlers': ['slow_queries'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
+    },
+}
+
+TOKEN_AUTH_CACHE_TTL = env.int('TOKEN_AUTH_CACHE_TTL', 60)
+
+INGREDIENT_SEARCH_LIMIT = env.int('INGREDIENT_SEARCH_LIMIT', 50)
+
+CATALOG_CACHE_MAX_AGE = env.int('CATALOG_CACHE_MAX_AGE', 0)
+
+# Кэш ответов для анонимов: срок жизни и окно stale-while-revalidate.
+RESPONSE_CACHE_TTL = env.int('RESPONSE_CACHE_TTL', 60)
+RESPONSE_CACHE_STALE = env.int('RESPONSE_CACHE_STALE', 0)
+
+ADMIN_EXACT_COUNT_LIMIT = env.int('ADMIN_EXACT_COUNT_LIMIT', 10000)
+
+SHOPPING_LIST_PDF_FONT = env.str(
+    'SHOPPING_LIST_PDF_FONT', '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf')
+
+RECIPE_IMAGE_VARIANTS = {
+    'thumbnail': (160, 160),
+    'card': (480, 480),
+    'detail': (1200, 1200),
+}
+RECIPE_IMAGE_FORMAT = env.str('RECIPE_IMAGE_FORMAT', 'WEBP')
+RECIPE_IMAGE_QUALITY = env.int('RECIPE_IMAGE_QUALITY', 80)
+RECIPE_IMAGE_MAX_SIZE = env.int('RECIPE_IMAGE_MAX_SIZE', 20 * 1024 * 1024)
+RECIPE_IMAGE_MAX_SIDE = env.int('RECIPE_IMAGE_MAX_SIDE', 6000)
+RECIPE_IMAGE_ASYNC = env.bool('RECIPE_IMAGE_ASYNC', True)
+RECIPE_IMAGE_WORKERS = env.int('RECIPE_IMAGE_WORKERS', 2)
+# Копии изображений делает run_worker, а не поток процесса API.
+RECIPE_IMAGE_JOBS = env.bool('RECIPE_IMAGE_JOBS', False)
+
+# 96 хешей в 32 полосах по 3: рецепт с коэффициентом Жаккара 0.5
+# становится кандидатом с вероятностью 0.99, с 0.3 - 0.58, с 0.1 - 0.03.
+SIMILAR_RECIPES_PERMUTATIONS = env.int('SIMILAR_RECIPES_PERMUTATIONS', 96)
+SIMILAR_RECIPES_BANDS = env.int('SIMILAR_RECIPES_BANDS', 32)
+SIMILAR_RECIPES_CANDIDATES = env.int('SIMILAR_RECIPES_CANDIDATES', 200)
+SIMILAR_RECIPES_LIMIT = env.int('SIMILAR_RECIPES_LIMIT', 10)
+
+JOBS_MAX_ATTEMPTS = env.int('JOBS_MAX_ATTEMPTS', 3)
+JOBS_VISIBILITY_TIMEOUT = env.int('JOBS_VISIBILITY_TIMEOUT', 300)
+JOBS_RETRY_BACKOFF = env.int('JOBS_RETRY_BACKOFF', 10)
+JOBS_RETRY_MAX_DELAY = env.int('JOBS_RETRY_MAX_DELAY', 3600)
+JOBS_POLL_INTERVAL = env.float('JOBS_POLL_INTERVAL', 1.0)
+
+PANTRY_INDEX_REFRESH = env.int('PANTRY_INDEX_REFRESH', 10)
+PANTRY_LIMIT = env.int('PANTRY_LIMIT', 20)
+PANTRY_MAX_LIMIT = env.int('PANTRY_MAX_LIMIT', 100)
+
 DJOSER = {
     'LOGIN_FIELD': 'email',
 }
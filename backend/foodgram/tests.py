@@ -0,0 +1,109 @@
+import os
+import tempfile
+from unittest import mock
+
+from django.http import HttpResponse
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import path
+
+from foodgram.metrics import Registry
+from foodgram.queries import NPlusOneError, detect_n_plus_one, fingerprint
+from users.models import User
+
+
+def users_one_by_one(request):
+    names = [User.objects.get(pk=pk).username
+             for pk in User.objects.values_list('pk', flat=True)]
+    return HttpResponse(', '.join(names))
+
+
+def users_at_once(request):
+    return HttpResponse(', '.join(User.objects.values_list('username',
+                                                           flat=True)))
+
+
+urlpatterns = [
+    path('loop/', users_one_by_one),
+    path('batch/', users_at_once),
+]
+
+
+class FingerprintTest(SimpleTestCase):
+    def test_strings(self):
+        self.assertEqual(
+            fingerprint("SELECT * FROM t WHERE name = 'O''Brien' "
+                        "AND slug = 'tag-1'"),
+            'SELECT * FROM t WHERE name = ? AND slug = ?')
+
+    def test_numbers(self):
+        self.assertEqual(
+            fingerprint('SELECT "t"."id" FROM "t" WHERE "t"."id" = 42 '
+                        'AND price > -1.5 LIMIT 21'),
+            'SELECT "t"."id" FROM "t" WHERE "t"."id" = ? '
+            'AND price > ? LIMIT ?')
+
+    def test_identifiers_keep_digits(self):
+        self.assertEqual(fingerprint('SELECT col1 FROM table2'),
+                         'SELECT col1 FROM table2')
+
+    def test_in_lists(self):
+        expected = 'SELECT * FROM t WHERE id IN (...)'
+        for sql in ('SELECT * FROM t WHERE id IN (1)',
+                    'SELECT * FROM t WHERE id IN (1, 2, 3)',
+                    'SELECT * FROM t WHERE id IN (%s, %s)',
+                    "SELECT * FROM t WHERE id IN ('a', 'b', NULL)"):
+            with self.subTest(sql=sql):
+                self.assertEqual(fingerprint(sql), expected)
+
+    def test_whitespace(self):
+        self.assertEqual(fingerprint('SELECT  *\n  FROM t'),
+                         'SELECT * FROM t')
+
+
+@override_settings(ROOT_URLCONF=__name__)
+class NPlusOneTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.bulk_create(
+            User(username=f'user{i}', email=f'user{i}@example.com',
+                 first_name='Имя', last_name='Фамилия', password='-')
+            for i in range(10))
+
+    def test_detect_n_plus_one(self):
+        with self.assertRaises(NPlusOneError):
+            with detect_n_plus_one(threshold=5):
+                users_one_by_one(None)
+        with detect_n_plus_one(threshold=5) as inspector:
+            users_at_once(None)
+        self.assertEqual(inspector.repeated(), [])
+
+    def test_raised_through_client(self):
+        with self.assertRaisesMessage(NPlusOneError,
+                                      'repeated more than 5 times'):
+            self.client.get('/loop/')
+
+    def test_batch_passes(self):
+        response = self.client.get('/batch/')
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(N_PLUS_ONE='log')
+    def test_log_mode(self):
+        with self.assertLogs('foodgram.middleware', 'WARNING') as logs:
+            response = self.client.get('/loop/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('users_one_by_one', logs.output[0])
+
+
+class RegistryFlushTest(SimpleTestCase):
+    def test_reused_pid_keeps_dead_process_file(self):
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(METRICS_DIR=directory), \
+                mock.patch('foodgram.metrics.os.getpid', return_value=42):
+            dead, new = Registry(), Registry()
+            dead.inc('foodgram_test_total', (), 3)
+            dead.flush()
+            new.inc('foodgram_test_total', (), 1)
+            new.flush()
+            filenames = os.listdir(directory)
+        self.assertEqual(len(filenames), 2)
+        self.assertTrue(all(name.startswith('42-') for name in filenames))
@@ -1,8 +1,11 @@
 from django.contrib import admin
 from django.urls import path, include
 
+from foodgram.views import metrics
+
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics', metrics, name='metrics'),
     path('api/', include('api.urls')),
     path('api/', include('djoser.urls')),
     path('api/auth/', include('djoser.urls.authtoken'))
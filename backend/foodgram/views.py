@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+
+from foodgram import metrics as project_metrics
+
+
+def metrics(request):
+    """Метрики всех процессов для Prometheus.
+
+    Доступны сотрудникам и по заголовку Authorization: Bearer
+    <METRICS_TOKEN>.
+    """
+    token = settings.METRICS_TOKEN
+    header = request.headers.get('Authorization', '')
+    if not (request.user.is_staff or token and constant_time_compare(
+            header, f'Bearer {token}')):
+        return HttpResponseForbidden()
+    return HttpResponse(project_metrics.render(),
+                        content_type='text/plain; version=0.0.4')
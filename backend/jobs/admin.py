@@ -0,0 +1,16 @@
+from django.contrib import admin
+
+from .models import Job
+
+
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'task', 'status', 'attempts', 'user',
+                    'created_at', 'finished_at')
+    list_filter = ('status', 'task')
+    list_select_related = ('user',)
+    raw_id_fields = ('user',)
+    readonly_fields = ('worker', 'locked_until', 'started_at',
+                       'finished_at', 'result', 'error')
+
+
+admin.site.register(Job, JobAdmin)
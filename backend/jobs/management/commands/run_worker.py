@@ -0,0 +1,78 @@
+import os
+import signal
+import socket
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management import BaseCommand
+from django.db import close_old_connections, connection
+from django.utils import timezone
+
+from jobs.models import Job
+from jobs.queue import claim, expire, run
+
+
+class Command(BaseCommand):
+    help = 'Выполняет задачи фоновой очереди.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=1,
+                            help='число потоков-воркеров')
+        parser.add_argument('--task', action='append', dest='tasks',
+                            help='выполнять только эти задачи')
+        parser.add_argument('--poll-interval', type=float,
+                            default=settings.JOBS_POLL_INTERVAL)
+        parser.add_argument('--burst', action='store_true',
+                            help='завершиться, когда очередь опустеет')
+        parser.add_argument('--purge-days', type=int, default=7,
+                            help='удалить завершённые задачи старше N дней')
+
+    def work(self, number, options):
+        name = f'{socket.gethostname()}:{os.getpid()}:{number}'
+        try:
+            while not self.stopping.is_set():
+                close_old_connections()
+                expire()
+                job = claim(name, options['tasks'])
+                if job is None:
+                    if options['burst']:
+                        return
+                    self.stopping.wait(options['poll_interval'])
+                    continue
+                ok = run(job)
+                with self.lock:
+                    self.processed[ok] += 1
+        finally:
+            connection.close()
+
+    def stop(self, signum, frame):
+        self.stdout.write('Завершаем текущие задачи...')
+        self.stopping.set()
+
+    def handle(self, *args, **options):
+        self.stopping = threading.Event()
+        self.lock = threading.Lock()
+        self.processed = {True: 0, False: 0}
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        if options['purge_days']:
+            Job.objects.filter(
+                status__in=(Job.DONE, Job.FAILED),
+                finished_at__lt=timezone.now() - timedelta(
+                    days=options['purge_days'])).delete()
+        connection.close()
+        start = time.perf_counter()
+        workers = [threading.Thread(target=self.work, args=(number, options))
+                   for number in range(options['concurrency'])]
+        for worker in workers:
+            worker.start()
+        while any(worker.is_alive() for worker in workers):
+            for worker in workers:
+                worker.join(0.5)
+        elapsed = time.perf_counter() - start
+        total = sum(self.processed.values())
+        self.stdout.write(self.style.SUCCESS(
+            f'Выполнено задач: {self.processed[True]}, с ошибкой: '
+            f'{self.processed[False]}, {total / elapsed:.1f} задач/с'))
@@ -0,0 +1,14 @@
+from foodgram.metrics import collector
+from jobs.models import Job
+from jobs.queue import stats
+
+
+@collector(per_process=False)
+def job_metrics():
+    """Состояние очереди из базы, одно на все процессы."""
+    result = stats()
+    for status, _ in Job.STATUSES:
+        yield 'foodgram_jobs', {'status': status}, result[status]
+    for name in ('lag', 'latency', 'duration'):
+        yield f'foodgram_jobs_{name}_seconds', {}, result[name]
+    yield 'foodgram_jobs_throughput', {}, result['throughput']
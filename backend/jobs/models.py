@@ -0,0 +1,43 @@
+from django.db import models
+from django.utils import timezone
+
+from users.models import User
+
+
+class Job(models.Model):
+    """Задача фоновой очереди, её выполняет команда run_worker."""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = (
+        (QUEUED, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (DONE, 'Выполнена'),
+        (FAILED, 'Ошибка'),
+    )
+
+    task = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    user = models.ForeignKey(User, related_name='jobs', null=True,
+                             blank=True, on_delete=models.CASCADE)
+    status = models.CharField(max_length=10, choices=STATUSES,
+                              default=QUEUED)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=1)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    worker = models.CharField(max_length=100, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    def __str__(self):
+        return f'{self.task} #{self.pk} ({self.status})'
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = (models.Index(fields=('status', 'run_at'),
+                                name='job_status_run_at_idx'),)
@@ -0,0 +1,151 @@
+"""Очередь фоновых задач в базе данных, без внешнего брокера.
+
+Задача - функция, зарегистрированная декоратором task в модуле tasks
+приложения; она получает объект Job и возвращает результат, который
+сохраняется в JSON. Воркер (команда run_worker) забирает задачу
+условным UPDATE: если два воркера выбрали одну задачу, строку получит
+только один. Пока задача выполняется, она скрыта от других воркеров
+на время таймаута (visibility timeout); если воркер за это время не
+отчитался, задачу заберёт другой. После ошибки задача повторяется с
+экспоненциальной задержкой, пока не кончатся попытки.
+"""
+import logging
+import traceback
+from collections import namedtuple
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from foodgram.queries import QueryInspector
+from jobs.models import Job
+
+logger = logging.getLogger(__name__)
+
+Task = namedtuple('Task', 'func max_attempts timeout')
+TASKS = {}
+
+
+def task(name, max_attempts=None, timeout=None):
+    """Регистрирует функцию как задачу очереди под именем name."""
+    def register(func):
+        TASKS[name] = Task(func, max_attempts or settings.JOBS_MAX_ATTEMPTS,
+                           timeout or settings.JOBS_VISIBILITY_TIMEOUT)
+        return func
+    return register
+
+
+def enqueue(name, payload=None, user=None, delay=0):
+    """Ставит задачу в очередь в текущей транзакции."""
+    if name not in TASKS:
+        raise LookupError(f'Неизвестная задача: {name}')
+    return Job.objects.create(
+        task=name, payload=payload or {}, user=user,
+        max_attempts=TASKS[name].max_attempts,
+        run_at=timezone.now() + timedelta(seconds=delay))
+
+
+def _ready(now):
+    return (Q(status=Job.QUEUED, run_at__lte=now)
+            | Q(status=Job.RUNNING, locked_until__lt=now,
+                attempts__lt=F('max_attempts')))
+
+
+def expire(now=None):
+    """Помечает ошибкой зависшие задачи без оставшихся попыток."""
+    now = now or timezone.now()
+    return Job.objects.filter(
+        status=Job.RUNNING, locked_until__lt=now,
+        attempts__gte=F('max_attempts')).update(
+        status=Job.FAILED, finished_at=now, locked_until=None,
+        error='Истёк таймаут выполнения.')
+
+
+def claim(worker, tasks=None, batch=10):
+    """Забирает готовую к выполнению задачу или возвращает None."""
+    now = timezone.now()
+    queryset = Job.objects.filter(_ready(now))
+    if tasks:
+        queryset = queryset.filter(task__in=tasks)
+    candidates = queryset.order_by('run_at').values_list('id', 'task')
+    for job_id, name in candidates[:batch]:
+        timeout = (TASKS[name].timeout if name in TASKS
+                   else settings.JOBS_VISIBILITY_TIMEOUT)
+        claimed = Job.objects.filter(_ready(now), id=job_id).update(
+            status=Job.RUNNING, worker=worker, started_at=now,
+            attempts=F('attempts') + 1,
+            locked_until=now + timedelta(seconds=timeout))
+        if claimed:
+            return Job.objects.select_related('user').get(id=job_id)
+    return None
+
+
+def backoff(attempts):
+    """Задержка перед следующей попыткой, секунды."""
+    return min(settings.JOBS_RETRY_BACKOFF * 2 ** (attempts - 1),
+               settings.JOBS_RETRY_MAX_DELAY)
+
+
+def run(job):
+    """Выполняет забранную задачу и записывает её итог.
+
+    Итог записывается, только если задачу не забрал другой воркер
+    после истечения таймаута. Возвращает True при успехе.
+    """
+    mine = Job.objects.filter(id=job.id, worker=job.worker,
+                              attempts=job.attempts, status=Job.RUNNING)
+    try:
+        if job.task not in TASKS:
+            raise LookupError(f'Неизвестная задача: {job.task}')
+        # Медленные запросы задачи попадают в тот же журнал.
+        inspector = QueryInspector(fingerprints=False, context={
+            'task': job.task, 'job': job.id})
+        with connection.execute_wrapper(inspector):
+            result = TASKS[job.task].func(job)
+    except Exception:
+        logger.exception('Job %s (%s) failed', job.id, job.task)
+        now = timezone.now()
+        error = traceback.format_exc()
+        if job.attempts < job.max_attempts:
+            mine.update(status=Job.QUEUED, locked_until=None, error=error,
+                        run_at=now + timedelta(
+                            seconds=backoff(job.attempts)))
+        else:
+            mine.update(status=Job.FAILED, locked_until=None, error=error,
+                        finished_at=now)
+        return False
+    mine.update(status=Job.DONE, locked_until=None, result=result,
+                error='', finished_at=timezone.now())
+    return True
+
+
+def stats(window=300):
+    """Состояние очереди и работа воркеров за последние window секунд.
+
+    latency - время от постановки задачи до её (последнего) запуска,
+    lag - сколько ждёт самая старая готовая к выполнению задача.
+    """
+    now = timezone.now()
+    since = now - timedelta(seconds=window)
+    result = dict.fromkeys((status for status, _ in Job.STATUSES), 0)
+    result.update(Job.objects.order_by().values_list('status')
+                  .annotate(total=Count('id')))
+    oldest = (Job.objects.filter(status=Job.QUEUED, run_at__lte=now)
+              .order_by('run_at').values_list('run_at', flat=True).first())
+    recent = Job.objects.filter(finished_at__gte=since,
+                                started_at__isnull=False)
+    finished = list(recent.order_by('-finished_at')
+                    .values_list('created_at', 'started_at', 'finished_at')
+                    [:1000])
+    waits = [(started - created).total_seconds()
+             for created, started, _ in finished]
+    durations = [(done - started).total_seconds()
+                 for _, started, done in finished]
+    result.update(
+        lag=(now - oldest).total_seconds() if oldest else 0.0,
+        throughput=recent.count() / window,
+        latency=sum(waits) / len(waits) if waits else 0.0,
+        duration=sum(durations) / len(durations) if durations else 0.0)
+    return result
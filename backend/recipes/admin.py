@@ -1,30 +1,76 @@
 from django.contrib import admin
 
+from .images import replace_variants, schedule_variants
 from .models import (Tag, Recipe, Ingredient, IngredientInRecipe,
                      FavoriteRecipe, ShoppingCart)
+from .paginators import EstimatedCountPaginator
 
 
-class IngredientInRecipeInline(admin.StackedInline):
+class IngredientInRecipeInline(admin.TabularInline):
     model = IngredientInRecipe
+    autocomplete_fields = ('ingredient', )
     extra = 1
 
 
 class RecipeAdmin(admin.ModelAdmin):
     inlines = (IngredientInRecipeInline, )
-    list_filter = ('author', 'name', 'tags',)
+    list_filter = ('tags',)
     search_fields = ('name',)
-    list_display = ('id', 'name', 'author', 'in_favorites',)
+    list_display = ('id', 'name', 'author', 'pub_date', 'in_favorites',
+                    'in_carts',)
+    list_select_related = ('author',)
+    autocomplete_fields = ('author',)
+    readonly_fields = ('image_variants', 'favorites_count', 'in_carts_count')
+    actions = ('build_image_variants',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
+    @admin.display(description='В избранном', ordering='favorites_count')
     def in_favorites(self, obj):
-        return FavoriteRecipe.objects.filter(recipe=obj).count()
+        return obj.favorites_count
+
+    @admin.display(description='В корзинах', ordering='in_carts_count')
+    def in_carts(self, obj):
+        return obj.in_carts_count
+
+    def save_model(self, request, obj, form, change):
+        image_changed = 'image' in form.changed_data
+        if image_changed:
+            old_variants = obj.image_variants
+            obj.image_variants = {}
+        super().save_model(request, obj, form, change)
+        if image_changed:
+            replace_variants(obj, old_variants)
+
+    @admin.action(description='Пересоздать уменьшенные изображения')
+    def build_image_variants(self, request, queryset):
+        # Копии строятся так же, как после загрузки через API: в фоне.
+        count = 0
+        for recipe in queryset.exclude(image=''):
+            schedule_variants(recipe)
+            count += 1
+        self.message_user(request, f'Запущено пересоздание изображений '
+                                   f'рецептов: {count}')
 
 
 class IngredientAdmin(admin.ModelAdmin):
     list_display = ('name', 'measurement_unit')
-    list_filter = ('name', )
+    list_filter = ('measurement_unit', )
     search_fields = ('name', )
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+class UserRecipeAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'recipe')
+    list_select_related = ('user', 'recipe')
+    autocomplete_fields = ('user', 'recipe')
+    search_fields = ('recipe__name', 'user__username')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 
 admin.site.register(Recipe, RecipeAdmin)
 admin.site.register(Ingredient, IngredientAdmin)
-admin.site.register([Tag, FavoriteRecipe, ShoppingCart])
+admin.site.register(Tag)
+admin.site.register([FavoriteRecipe, ShoppingCart], UserRecipeAdmin)
@@ -1,6 +1,12 @@
 from django.apps import AppConfig
+from django.core import checks
 
 
 class RecipesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'recipes'
+
+    def ready(self):
+        import recipes.signals  # noqa: F401
+        from foodgram.cache import check_shared_tier
+        checks.register(check_shared_tier)
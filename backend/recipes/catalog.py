@@ -0,0 +1,44 @@
+"""Версии справочников (тэги, ингредиенты), рецептов и пользователей.
+
+POPULARITY - отдельная версия для числа добавлений в избранное: оно
+меняется часто и влияет только на порядок ordering=popular, поэтому
+не сбрасывает остальные данные о рецептах.
+
+Версия хранится в кэше и меняется при любом изменении справочника,
+по ней процессы понимают, что построенные в памяти данные устарели.
+Копия версии в памяти процесса живёт не больше секунды.
+"""
+import uuid
+
+from foodgram.cache import Namespace
+
+TAGS = 'tags'
+INGREDIENTS = 'ingredients'
+RECIPES = 'recipes'
+USERS = 'users'
+POPULARITY = 'popularity'
+
+VERSIONS = Namespace('catalog', local_timeout=1)
+
+
+def bump_version(catalog):
+    """Помечает справочник изменённым."""
+    VERSIONS.set(catalog, uuid.uuid4().hex, None)
+
+
+def get_version(catalog):
+    return get_versions(catalog)[0]
+
+
+def get_versions(*catalogs):
+    """Версии нескольких справочников одним обращением к кэшу.
+
+    Пропавшая из кэша версия (вытеснение, очистка) создаётся заново,
+    поэтому данные, собранные по старой версии, не используются.
+    """
+    versions = VERSIONS.get_many(catalogs)
+    for catalog in catalogs:
+        if versions.get(catalog) is None:
+            VERSIONS.add(catalog, uuid.uuid4().hex, None)
+            versions[catalog] = VERSIONS.get(catalog)
+    return [versions[catalog] for catalog in catalogs]
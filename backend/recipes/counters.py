@@ -0,0 +1,53 @@
+"""Счётчики рецептов и пользователей, хранимые в их таблицах."""
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from recipes.catalog import POPULARITY, bump_version
+from recipes.models import FavoriteRecipe, Recipe, ShoppingCart
+from users.models import Follower, User
+
+# (модель, поле-счётчик, модель связей, поле связи на модель)
+COUNTERS = (
+    (Recipe, 'favorites_count', FavoriteRecipe, 'recipe'),
+    (Recipe, 'in_carts_count', ShoppingCart, 'recipe'),
+    (User, 'recipes_count', Recipe, 'author'),
+    (User, 'followers_count', Follower, 'author'),
+)
+# Версии, которые меняются вместе со счётчиком: update() не посылает
+# сигналов. Остальные счётчики в кэшированных ответах не видны:
+# recipes_count меняется вместе с рецептами, in_carts_count и
+# followers_count API не отдаёт.
+CATALOGS = {(Recipe, 'favorites_count'): POPULARITY}
+
+
+def counters_changed(model, field):
+    catalog = CATALOGS.get((model, field))
+    if catalog is not None:
+        transaction.on_commit(lambda: bump_version(catalog))
+
+
+def increment(model, pk, field, value=1):
+    model.objects.filter(pk=pk).update(**{field: F(field) + value})
+    counters_changed(model, field)
+
+
+def actual_count(related_model, related_field):
+    return Coalesce(Subquery(
+        related_model.objects.filter(**{related_field: OuterRef('pk')})
+        .order_by().values(related_field).annotate(total=Count('*'))
+        .values('total')), 0)
+
+
+def reconcile(fix=True):
+    """Находит (и исправляет) расхождения: {(модель, поле): число строк}."""
+    drift = {}
+    for model, field, related_model, related_field in COUNTERS:
+        actual = actual_count(related_model, related_field)
+        wrong = (model.objects.annotate(actual=actual)
+                 .exclude(**{field: F('actual')}).values('pk'))
+        drift[(model.__name__, field)] = wrong.count()
+        if fix and drift[(model.__name__, field)]:
+            model.objects.filter(pk__in=wrong).update(**{field: actual})
+            counters_changed(model, field)
+    return drift
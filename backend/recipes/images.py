@@ -0,0 +1,121 @@
+"""Уменьшенные копии изображений рецептов."""
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from PIL import Image
+
+from jobs.queue import enqueue
+from recipes.catalog import RECIPES, bump_version
+from recipes.models import Recipe
+
+logger = logging.getLogger(__name__)
+
+EXTENSIONS = {'WEBP': 'webp', 'JPEG': 'jpg'}
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.RECIPE_IMAGE_WORKERS,
+            thread_name_prefix='recipe-images')
+    return _executor
+
+
+def variant_name(image_name, variant):
+    image_format = settings.RECIPE_IMAGE_FORMAT
+    base = os.path.splitext(os.path.basename(image_name))[0]
+    return f'upload/variants/{base}_{variant}.{EXTENSIONS[image_format]}'
+
+
+def render_variant(image, size):
+    image = image.copy()
+    image.thumbnail(size, Image.LANCZOS)
+    image_format = settings.RECIPE_IMAGE_FORMAT
+    if image_format == 'JPEG' and image.mode != 'RGB':
+        image = image.convert('RGB')
+    buffer = BytesIO()
+    image.save(buffer, image_format, quality=settings.RECIPE_IMAGE_QUALITY)
+    return buffer.getvalue()
+
+
+def delete_variants(variants):
+    """Удаляет из хранилища файлы копий {вариант: путь}."""
+    for name in set(variants.values()):
+        default_storage.delete(name)
+
+
+def generate_variants(recipe):
+    """Создаёт все копии изображения рецепта и сохраняет их пути.
+
+    Копии прежнего формата, которые не перезаписаны новыми, удаляются.
+    """
+    if not recipe.image:
+        return {}
+    image_name = recipe.image.name
+    old_variants = recipe.image_variants or {}
+    with recipe.image.open('rb') as file:
+        image = Image.open(file)
+        image.load()
+    variants = {}
+    for variant, size in settings.RECIPE_IMAGE_VARIANTS.items():
+        name = variant_name(image_name, variant)
+        if default_storage.exists(name):
+            default_storage.delete(name)
+        variants[variant] = default_storage.save(
+            name, ContentFile(render_variant(image, size)))
+    updated = Recipe.objects.filter(pk=recipe.pk, image=image_name).update(
+        image_variants=variants)
+    if updated:
+        delete_variants({variant: name
+                         for variant, name in old_variants.items()
+                         if name not in variants.values()})
+    bump_version(RECIPES)
+    recipe.image_variants = variants
+    return variants
+
+
+def _generate_in_background(recipe_id):
+    close_old_connections()
+    try:
+        recipe = Recipe.objects.filter(pk=recipe_id).first()
+        if recipe is not None:
+            generate_variants(recipe)
+    except Exception:
+        logger.exception('Failed to build image variants for recipe %s',
+                         recipe_id)
+    finally:
+        close_old_connections()
+
+
+def schedule_variants(recipe):
+    """Запускает генерацию копий после фиксации транзакции."""
+    if settings.RECIPE_IMAGE_JOBS:
+        enqueue('recipes.image_variants', {'recipe': recipe.pk})
+        return
+    if not settings.RECIPE_IMAGE_ASYNC:
+        transaction.on_commit(lambda: generate_variants(recipe))
+        return
+    recipe_id = recipe.pk
+    transaction.on_commit(
+        lambda: get_executor().submit(_generate_in_background, recipe_id))
+
+
+def replace_variants(recipe, old_variants):
+    """После смены изображения удаляет старые копии и строит новые.
+
+    recipe.image_variants к этому моменту уже очищены: старые пути
+    передаются отдельно, файлы удаляются только после фиксации.
+    """
+    names = dict(old_variants or {})
+    if names:
+        transaction.on_commit(lambda: delete_variants(names))
+    schedule_variants(recipe)
@@ -0,0 +1,70 @@
+import random
+import time
+from collections import defaultdict
+
+from django.core.management import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from recipes.models import IngredientInRecipe
+from recipes.similar import similar_recipes
+
+
+def jaccard(left, right):
+    shared = len(left & right)
+    return shared / (len(left) + len(right) - shared)
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает поиск похожих рецептов по индексу LSH с точным '
+            'перебором коэффициента Жаккара: полнота и время ответа.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queries', type=int, default=100)
+        parser.add_argument('--limit', type=int, default=10)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def exact(self, sets, recipe_id, limit):
+        target = sets[recipe_id]
+        scores = ((jaccard(target, items), pk) for pk, items in sets.items()
+                  if pk != recipe_id)
+        return sorted(((score, pk) for score, pk in scores if score > 0),
+                      key=lambda pair: (-pair[0], pair[1]))[:limit]
+
+    def handle(self, *args, **options):
+        limit = options['limit']
+        sets = defaultdict(set)
+        for recipe_id, ingredient_id in IngredientInRecipe.objects.values_list(
+                'recipe_id', 'ingredient_id').iterator(chunk_size=10000):
+            sets[recipe_id].add(ingredient_id)
+        if not sets:
+            raise CommandError('Нет рецептов с ингредиентами.')
+        sample = random.Random(options['seed']).sample(
+            sorted(sets), min(options['queries'], len(sets)))
+        exact_time = lsh_time = found = relevant = 0
+        with CaptureQueriesContext(connection) as queries:
+            for recipe_id in sample:
+                start = time.perf_counter()
+                expected = self.exact(sets, recipe_id, limit)
+                exact_time += time.perf_counter() - start
+                start = time.perf_counter()
+                ranked = similar_recipes(recipe_id, limit)
+                lsh_time += time.perf_counter() - start
+                if not expected:
+                    continue
+                # Рецепты с тем же сходством, что и последний точный, тоже
+                # считаются верным ответом.
+                threshold = expected[-1][0]
+                relevant += len(expected)
+                found += sum(
+                    jaccard(sets[recipe_id], sets[pk]) >= threshold
+                    for pk, _ in ranked)
+        count = len(sample)
+        self.stdout.write(f'Рецептов: {len(sets)}, запросов: {count}')
+        self.stdout.write(f'Точный перебор: {exact_time / count * 1e3:.2f} '
+                          f'мс/запрос')
+        self.stdout.write(f'LSH: {lsh_time / count * 1e3:.2f} мс/запрос, '
+                          f'{len(queries) / count:.1f} SQL/запрос')
+        recall = found / relevant if relevant else 1.0
+        self.stdout.write(self.style.SUCCESS(
+            f'Полнота LSH@{limit}: {recall:.3f}'))
@@ -0,0 +1,84 @@
+import base64
+import gzip
+import json
+import sys
+
+from django.core.management import BaseCommand
+from django.db.models import Prefetch
+
+from recipes.models import IngredientInRecipe, Recipe
+
+
+def open_output(path):
+    if path == '-':
+        return sys.stdout
+    if path.endswith('.gz'):
+        return gzip.open(path, 'wt', encoding='utf-8')
+    return open(path, 'w', encoding='utf-8')
+
+
+class Command(BaseCommand):
+    help = 'Выгружает рецепты в JSONL: одна строка - один рецепт.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='файл (.jsonl или .jsonl.gz), '
+                                         '"-" - стандартный вывод')
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--no-images', action='store_true',
+                            help='не включать изображения')
+
+    def serialize(self, recipe, with_images):
+        author = recipe.author
+        data = {
+            'name': recipe.name,
+            'text': recipe.text,
+            'cooking_time': recipe.cooking_time,
+            'pub_date': recipe.pub_date.isoformat(),
+            'author': {'email': author.email, 'username': author.username,
+                       'first_name': author.first_name,
+                       'last_name': author.last_name},
+            'tags': [{'slug': tag.slug, 'name': tag.name, 'color': tag.color}
+                     for tag in recipe.tags.all()],
+            'ingredients': [
+                {'name': item.ingredient.name,
+                 'measurement_unit': item.ingredient.measurement_unit,
+                 'amount': item.amount}
+                for item in recipe.ingredients.all()],
+            'image': None,
+        }
+        if with_images and recipe.image:
+            try:
+                with recipe.image.open('rb') as file:
+                    data['image'] = {
+                        'name': recipe.image.name.rsplit('/', 1)[-1],
+                        'data': base64.b64encode(file.read()).decode()}
+            except OSError as error:
+                self.stderr.write(f'{recipe.name}: {error}')
+        return data
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        with_images = not options['no_images']
+        ingredients = IngredientInRecipe.objects.select_related('ingredient')
+        queryset = (Recipe.objects.select_related('author')
+                    .prefetch_related('tags', Prefetch('ingredients',
+                                                       queryset=ingredients))
+                    .order_by('id'))
+        output = open_output(options['path'])
+        last_id, total = 0, 0
+        try:
+            while True:
+                batch = list(queryset.filter(id__gt=last_id)[:batch_size])
+                if not batch:
+                    break
+                for recipe in batch:
+                    output.write(json.dumps(self.serialize(recipe,
+                                                           with_images),
+                                            ensure_ascii=False) + '\n')
+                last_id = batch[-1].id
+                total += len(batch)
+                self.stderr.write(f'Выгружено рецептов: {total}')
+        finally:
+            if output is not sys.stdout:
+                output.close()
+        self.stderr.write(self.style.SUCCESS(f'Готово, рецептов: {total}'))
@@ -0,0 +1,26 @@
+from django.core.management import BaseCommand
+
+from recipes.images import generate_variants
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Создаёт уменьшенные копии изображений рецептов.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='пересоздать и уже готовые копии')
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.exclude(image='').exclude(image=None)
+        if not options['all']:
+            recipes = recipes.filter(image_variants={})
+        done = 0
+        for recipe in recipes.iterator():
+            try:
+                generate_variants(recipe)
+            except (OSError, ValueError) as error:
+                self.stderr.write(f'{recipe.pk}: {error}')
+                continue
+            done += 1
+        self.stdout.write(self.style.SUCCESS(f'Обработано рецептов: {done}'))
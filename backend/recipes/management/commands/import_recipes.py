@@ -0,0 +1,304 @@
+import base64
+import binascii
+import gzip
+import json
+import os
+import time
+import uuid
+from collections import Counter
+from itertools import islice
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+from recipes import similar
+from recipes.catalog import INGREDIENTS, RECIPES, TAGS, bump_version
+from recipes.counters import increment
+from recipes.models import Ingredient, IngredientInRecipe, Recipe, Tag
+from users.models import User
+
+
+def open_input(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8')
+    return open(path, 'r', encoding='utf-8')
+
+
+class Command(BaseCommand):
+    help = ('Загружает рецепты из JSONL, созданного export_recipes. '
+            'Рецепты с уже существующим названием пропускаются, как и '
+            'рецепты, автора или тэги которых нельзя создать.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--checkpoint',
+                            help='файл с номером последней загруженной '
+                                 'строки (по умолчанию <path>.checkpoint)')
+        parser.add_argument('--restart', action='store_true',
+                            help='начать заново, не читая checkpoint')
+
+    def read_checkpoint(self, path):
+        try:
+            with open(path) as file:
+                return int(file.read().strip() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def write_checkpoint(self, path, line):
+        with open(f'{path}.tmp', 'w') as file:
+            file.write(str(line))
+        os.replace(f'{path}.tmp', path)
+
+    def load_lookups(self):
+        self.ingredients = {name: pk for pk, name in
+                            Ingredient.objects.values_list('id', 'name')}
+        self.tags = {slug: pk for pk, slug in
+                     Tag.objects.values_list('id', 'slug')}
+        self.authors = {}
+        self.skipped = 0
+
+    def resolve_authors(self, records):
+        """id авторов по email.
+
+        Автор, чей username уже занят пользователем с другим email, не
+        создаётся, его рецепты пропускаются.
+        """
+        wanted = {record['author']['email']: record['author']
+                  for record in records
+                  if record['author']['email'] not in self.authors}
+        if not wanted:
+            return
+        self.authors.update(User.objects.filter(email__in=wanted)
+                            .values_list('email', 'id'))
+        missing = [data for email, data in wanted.items()
+                   if email not in self.authors]
+        taken = set(User.objects.filter(
+            username__in=[data['username'] for data in missing])
+            .values_list('username', flat=True))
+        users = []
+        for data in missing:
+            if data['username'] in taken:
+                continue
+            taken.add(data['username'])
+            user = User(**data)
+            user.set_unusable_password()
+            users.append(user)
+        User.objects.bulk_create(users, ignore_conflicts=True)
+        self.authors.update(User.objects.filter(email__in=wanted)
+                            .values_list('email', 'id'))
+
+    def resolve_tags(self, records):
+        """id тэгов по slug.
+
+        Тэг с новым slug, но существующим названием - тот же тэг. Тэг,
+        цвет которого занят другим тэгом, не создаётся, рецепты с ним
+        пропускаются.
+        """
+        missing = {tag['slug']: tag for record in records
+                   for tag in record['tags'] if tag['slug'] not in self.tags}
+        if not missing:
+            return
+        existing = Tag.objects.filter(
+            Q(name__in=[tag['name'] for tag in missing.values()])
+            | Q(color__in=[tag['color'] for tag in missing.values()]))
+        by_name = {tag.name: tag.id for tag in existing}
+        colors = {tag.color for tag in existing}
+        created, aliases = {}, {}
+        for slug, tag in missing.items():
+            if tag['name'] in by_name:
+                self.tags[slug] = by_name[tag['name']]
+            elif tag['name'] in created:
+                aliases[slug] = created[tag['name']]
+            elif tag['color'] not in colors:
+                colors.add(tag['color'])
+                created[tag['name']] = slug
+        if not created:
+            return
+        Tag.objects.bulk_create(
+            (Tag(**missing[slug]) for slug in created.values()),
+            ignore_conflicts=True)
+        self.tags.update((slug, pk) for pk, slug in Tag.objects.filter(
+            slug__in=created.values()).values_list('id', 'slug'))
+        self.tags.update((slug, self.tags[alias])
+                         for slug, alias in aliases.items()
+                         if alias in self.tags)
+        transaction.on_commit(lambda: bump_version(TAGS))
+
+    def resolve_ingredients(self, records):
+        missing = {item['name']: item for record in records
+                   for item in record['ingredients']
+                   if item['name'] not in self.ingredients}
+        if not missing:
+            return
+        Ingredient.objects.bulk_create(
+            (Ingredient(name=name, measurement_unit=item['measurement_unit'])
+             for name, item in missing.items()),
+            ignore_conflicts=True)
+        self.ingredients.update((name, pk) for pk, name in
+                                Ingredient.objects.filter(name__in=missing)
+                                .values_list('id', 'name'))
+        transaction.on_commit(lambda: bump_version(INGREDIENTS))
+
+    def skip_reason(self, record):
+        """Почему рецепт нельзя загрузить, или None."""
+        author = record['author']
+        if author['email'] not in self.authors:
+            return (f'имя пользователя {author["username"]} занято '
+                    f'другим пользователем')
+        slugs = [tag['slug'] for tag in record['tags']
+                 if tag['slug'] not in self.tags]
+        if slugs:
+            return (f'цвет тэгов {", ".join(slugs)} занят другими '
+                    f'тэгами')
+        return None
+
+    def merge_ingredients(self, record):
+        """Складывает количества ингредиента, указанного в рецепте дважды.
+
+        Иначе строка нарушила бы уникальность (рецепт, ингредиент) и
+        откатила всю пачку.
+        """
+        merged = {}
+        for item in record['ingredients']:
+            if item['name'] in merged:
+                merged[item['name']] = dict(
+                    merged[item['name']],
+                    amount=merged[item['name']]['amount'] + item['amount'])
+            else:
+                merged[item['name']] = item
+        if len(merged) != len(record['ingredients']):
+            self.stderr.write(self.style.WARNING(
+                f'Рецепт «{record["name"]}»: повторяющиеся ингредиенты '
+                f'объединены'))
+            record['ingredients'] = list(merged.values())
+
+    def decode_image(self, image):
+        """(имя файла, содержимое) или None; файл пишется после коммита."""
+        if not image:
+            return None
+        try:
+            content = base64.b64decode(image['data'])
+        except (binascii.Error, ValueError, KeyError, TypeError):
+            return None
+        extension = os.path.splitext(image.get('name', ''))[1] or '.png'
+        return f'upload/{uuid.uuid4()}{extension}', content
+
+    def save_images(self, images):
+        for recipe_name, (name, content) in images.items():
+            saved = default_storage.save(name, ContentFile(content))
+            if saved != name:
+                Recipe.objects.filter(name=recipe_name).update(image=saved)
+
+    @transaction.atomic
+    def import_batch(self, records):
+        names = [record['name'] for record in records]
+        existing = set(Recipe.objects.filter(name__in=names)
+                       .values_list('name', flat=True))
+        records = [record for record in records
+                   if record['name'] not in existing]
+        records = list({record['name']: record for record in records}
+                       .values())
+        if not records:
+            return 0
+        self.resolve_authors(records)
+        self.resolve_tags(records)
+        importable = []
+        for record in records:
+            reason = self.skip_reason(record)
+            if reason is None:
+                importable.append(record)
+            else:
+                self.skipped += 1
+                self.stderr.write(self.style.WARNING(
+                    f'Рецепт «{record["name"]}» пропущен: {reason}'))
+        records = importable
+        if not records:
+            return 0
+        for record in records:
+            self.merge_ingredients(record)
+        self.resolve_ingredients(records)
+        images = {}
+        for record in records:
+            image = self.decode_image(record.get('image'))
+            if image is not None:
+                images[record['name']] = image
+        Recipe.objects.bulk_create(
+            Recipe(name=record['name'], text=record['text'],
+                   cooking_time=record['cooking_time'],
+                   author_id=self.authors[record['author']['email']],
+                   image=images.get(record['name'], (None,))[0])
+            for record in records)
+        # Файлы пишутся только после коммита, при откате их не остаётся.
+        transaction.on_commit(lambda: self.save_images(images))
+        recipes = {recipe.name: recipe for recipe in Recipe.objects.filter(
+            name__in=[record['name'] for record in records]).only(
+            'id', 'name', 'pub_date')}
+        dated = []
+        for record in records:
+            pub_date = parse_datetime(record.get('pub_date') or '')
+            if pub_date is not None:
+                recipe = recipes[record['name']]
+                recipe.pub_date = pub_date
+                dated.append(recipe)
+        Recipe.objects.bulk_update(dated, ('pub_date',))
+        # Разные slug могут указывать на один тэг.
+        Recipe.tags.through.objects.bulk_create(
+            Recipe.tags.through(recipe_id=recipes[record['name']].id,
+                                tag_id=tag_id)
+            for record in records
+            for tag_id in {self.tags[tag['slug']] for tag in record['tags']})
+        IngredientInRecipe.objects.bulk_create(
+            IngredientInRecipe(recipe_id=recipes[record['name']].id,
+                               ingredient_id=self.ingredients[item['name']],
+                               amount=item['amount'])
+            for record in records for item in record['ingredients'])
+        similar.index_recipes({
+            recipes[record['name']].id: [self.ingredients[item['name']]
+                                         for item in record['ingredients']]
+            for record in records})
+        transaction.on_commit(lambda: bump_version(RECIPES))
+        per_author = Counter(self.authors[record['author']['email']]
+                             for record in records)
+        for author_id, count in per_author.items():
+            increment(User, author_id, 'recipes_count', count)
+        return len(records)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        checkpoint = options['checkpoint'] or f'{path}.checkpoint'
+        start = 0 if options['restart'] else self.read_checkpoint(checkpoint)
+        batch_size = options['batch_size']
+        self.load_lookups()
+        line, imported = start, 0
+        started = time.monotonic()
+        if start:
+            self.stdout.write(f'Продолжение со строки {start}')
+        with open_input(path) as file:
+            lines = islice(file, start, None)
+            while True:
+                chunk = list(islice(lines, batch_size))
+                if not chunk:
+                    break
+                try:
+                    records = [json.loads(raw) for raw in chunk
+                               if raw.strip()]
+                except json.JSONDecodeError as error:
+                    raise CommandError(
+                        f'Ошибка в строках после {line}: {error}')
+                imported += self.import_batch(records)
+                line += len(chunk)
+                self.write_checkpoint(checkpoint, line)
+                rate = (line - start) / (time.monotonic() - started)
+                self.stdout.write(f'Строк: {line}, новых рецептов: '
+                                  f'{imported}, {rate:.0f} строк/с')
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово, загружено рецептов: {imported}, пропущено: '
+            f'{self.skipped}. Уменьшенные копии изображений создаёт '
+            f'команда image_variants.'))
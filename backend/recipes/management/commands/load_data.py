@@ -1,20 +1,113 @@
+import csv
 import json
+import os
+from itertools import islice
 
-from django.core.management import BaseCommand
+from django.core.management import BaseCommand, CommandError
+from django.db import transaction
 
 from recipes.models import Ingredient
+from recipes.catalog import INGREDIENTS, bump_version
 
-TABLES = {
-    Ingredient: 'ingredients.json',
-}
+DEFAULT_PATH = 'data/ingredients.json'
+READ_SIZE = 64 * 1024
+
+
+def iter_json(file):
+    """Объекты JSON-массива по одному, не читая файл целиком."""
+    decoder = json.JSONDecoder()
+    buffer, position, started = '', 0, False
+    while True:
+        chunk = file.read(READ_SIZE)
+        buffer = buffer[position:] + chunk
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if position == len(buffer):
+                break
+            if not started:
+                if buffer[position] != '[':
+                    raise ValueError('Ожидался JSON-массив')
+                started = True
+                position += 1
+                continue
+            if buffer[position] == ']':
+                return
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if not chunk:
+                    raise
+                break
+            yield item
+        if not chunk:
+            return
+
+
+def iter_csv(file):
+    for row in csv.reader(file):
+        if row:
+            yield {'name': row[0], 'measurement_unit': row[1]}
+
+
+READERS = {'json': iter_json, 'csv': iter_csv}
 
 
 class Command(BaseCommand):
+    help = ('Загружает ингредиенты из JSON или CSV. Существующие '
+            'ингредиенты с тем же названием обновляются.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default=DEFAULT_PATH)
+        parser.add_argument('--format', choices=READERS,
+                            help='по умолчанию - по расширению файла')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true',
+                            help='только посчитать изменения')
+
+    def load_batch(self, rows, dry_run):
+        rows = {row['name']: row['measurement_unit'] for row in rows}
+        existing = {ingredient.name: ingredient for ingredient in
+                    Ingredient.objects.filter(name__in=rows)}
+        to_create, to_update = [], []
+        for name, unit in rows.items():
+            ingredient = existing.get(name)
+            if ingredient is None:
+                to_create.append(Ingredient(name=name,
+                                            measurement_unit=unit))
+            elif ingredient.measurement_unit != unit:
+                ingredient.measurement_unit = unit
+                to_update.append(ingredient)
+        if not dry_run:
+            with transaction.atomic():
+                Ingredient.objects.bulk_create(to_create)
+                Ingredient.objects.bulk_update(to_update,
+                                               ('measurement_unit',))
+        return (len(to_create), len(to_update),
+                len(rows) - len(to_create) - len(to_update))
 
-    def handle(self, *args, **kwargs):
-        for model, csv_f in TABLES.items():
-            with open(f'data/{csv_f}', 'r', encoding='utf-8') as file:
-                reader = json.loads(file.read())
-                model.objects.bulk_create((model(**data) for data in reader),
-                                          ignore_conflicts=True)
-        self.stdout.write(self.style.SUCCESS('Все данные загружены'))
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = (options['format']
+                       or os.path.splitext(path)[1].lstrip('.').lower())
+        if file_format not in READERS:
+            raise CommandError(f'Неизвестный формат: {file_format}')
+        inserted = updated = unchanged = 0
+        with open(path, 'r', encoding='utf-8') as file:
+            rows = READERS[file_format](file)
+            while True:
+                batch = list(islice(rows, options['batch_size']))
+                if not batch:
+                    break
+                created, changed, same = self.load_batch(batch,
+                                                         options['dry_run'])
+                inserted += created
+                updated += changed
+                unchanged += same
+        if not options['dry_run'] and (inserted or updated):
+            bump_version(INGREDIENTS)
+        prefix = 'Пробный запуск. ' if options['dry_run'] else ''
+        self.stdout.write(self.style.SUCCESS(
+            f'{prefix}Добавлено: {inserted}, обновлено: {updated}, '
+            f'без изменений: {unchanged}'))
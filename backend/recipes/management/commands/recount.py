@@ -0,0 +1,21 @@
+from django.core.management import BaseCommand, CommandError
+
+from recipes.counters import reconcile
+
+
+class Command(BaseCommand):
+    help = ('Сверяет и исправляет счётчики избранного, корзин, рецептов '
+            'и подписчиков.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='только проверить')
+
+    def handle(self, *args, **options):
+        drift = reconcile(fix=not options['check'])
+        for (model, field), count in drift.items():
+            self.stdout.write(f'{model}.{field}: расхождений {count}')
+        total = sum(drift.values())
+        if options['check'] and total:
+            raise CommandError(f'Расхождений: {total}')
+        self.stdout.write(self.style.SUCCESS('Счётчики в порядке'))
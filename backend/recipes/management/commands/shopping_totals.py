@@ -0,0 +1,32 @@
+from django.core.management import BaseCommand, CommandError
+
+from recipes.shopping import live_totals, rebuild, stored_totals
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает или проверяет суммы списков покупок.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='только сравнить с корзинами')
+        parser.add_argument('--user', type=int, action='append',
+                            dest='users', help='id пользователя')
+
+    def handle(self, *args, **options):
+        user_ids = options['users']
+        if not options['check']:
+            count = rebuild(user_ids)
+            self.stdout.write(self.style.SUCCESS(
+                f'Таблица пересчитана, строк: {count}'))
+            return
+        live, stored = live_totals(user_ids), stored_totals(user_ids)
+        drift = {key for key in live.keys() | stored.keys()
+                 if live.get(key) != stored.get(key)}
+        for user_id, ingredient_id in sorted(drift):
+            self.stdout.write(
+                f'user={user_id} ingredient={ingredient_id}: '
+                f'{stored.get((user_id, ingredient_id))} != '
+                f'{live.get((user_id, ingredient_id))}')
+        if drift:
+            raise CommandError(f'Расхождений: {len(drift)}')
+        self.stdout.write(self.style.SUCCESS('Расхождений нет'))
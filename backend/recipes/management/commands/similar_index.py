@@ -0,0 +1,19 @@
+import time
+
+from django.core.management import BaseCommand
+
+from recipes.similar import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Перестраивает индекс похожих рецептов (MinHash/LSH).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        total = rebuild(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Проиндексировано рецептов: {total} '
+            f'за {time.perf_counter() - start:.1f} с'))
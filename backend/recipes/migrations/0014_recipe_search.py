@@ -0,0 +1,113 @@
+# Generated by Django 3.2.3 on 2026-10-18 17:38
+# flake8: noqa
+import django.contrib.postgres.search
+from django.db import migrations
+
+POSTGRES_FORWARD = (
+    """
+    CREATE FUNCTION recipes_recipe_search_vector() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector :=
+            setweight(to_tsvector('russian', coalesce(NEW.name, '')), 'A') ||
+            setweight(to_tsvector('russian', coalesce(NEW.text, '')), 'B');
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql;
+    """,
+    """
+    CREATE TRIGGER recipes_recipe_search_vector_trigger
+    BEFORE INSERT OR UPDATE OF name, text ON recipes_recipe
+    FOR EACH ROW EXECUTE FUNCTION recipes_recipe_search_vector();
+    """,
+    """
+    UPDATE recipes_recipe SET search_vector =
+        setweight(to_tsvector('russian', coalesce(name, '')), 'A') ||
+        setweight(to_tsvector('russian', coalesce(text, '')), 'B');
+    """,
+    'CREATE INDEX recipe_search_vector_idx ON recipes_recipe '
+    'USING gin (search_vector);',
+)
+
+POSTGRES_BACKWARD = (
+    'DROP INDEX IF EXISTS recipe_search_vector_idx;',
+    'DROP TRIGGER IF EXISTS recipes_recipe_search_vector_trigger '
+    'ON recipes_recipe;',
+    'DROP FUNCTION IF EXISTS recipes_recipe_search_vector();',
+)
+
+SQLITE_FORWARD = (
+    """
+    CREATE VIRTUAL TABLE recipes_recipe_fts USING fts5(
+        name, text, content='recipes_recipe', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2');
+    """,
+    """
+    CREATE TRIGGER recipes_recipe_fts_insert AFTER INSERT ON recipes_recipe
+    BEGIN
+        INSERT INTO recipes_recipe_fts(rowid, name, text)
+        VALUES (new.id, new.name, new.text);
+    END;
+    """,
+    """
+    CREATE TRIGGER recipes_recipe_fts_delete AFTER DELETE ON recipes_recipe
+    BEGIN
+        INSERT INTO recipes_recipe_fts(recipes_recipe_fts, rowid, name, text)
+        VALUES ('delete', old.id, old.name, old.text);
+    END;
+    """,
+    """
+    CREATE TRIGGER recipes_recipe_fts_update
+    AFTER UPDATE OF name, text ON recipes_recipe
+    BEGIN
+        INSERT INTO recipes_recipe_fts(recipes_recipe_fts, rowid, name, text)
+        VALUES ('delete', old.id, old.name, old.text);
+        INSERT INTO recipes_recipe_fts(rowid, name, text)
+        VALUES (new.id, new.name, new.text);
+    END;
+    """,
+    "INSERT INTO recipes_recipe_fts(recipes_recipe_fts) VALUES ('rebuild');",
+)
+
+SQLITE_BACKWARD = (
+    'DROP TRIGGER IF EXISTS recipes_recipe_fts_update;',
+    'DROP TRIGGER IF EXISTS recipes_recipe_fts_delete;',
+    'DROP TRIGGER IF EXISTS recipes_recipe_fts_insert;',
+    'DROP TABLE IF EXISTS recipes_recipe_fts;',
+)
+
+STATEMENTS = {
+    'postgresql': (POSTGRES_FORWARD, POSTGRES_BACKWARD),
+    'sqlite': (SQLITE_FORWARD, SQLITE_BACKWARD),
+}
+
+
+def run_statements(schema_editor, forward):
+    statements = STATEMENTS.get(schema_editor.connection.vendor)
+    if statements is None:
+        return
+    for statement in statements[0 if forward else 1]:
+        schema_editor.execute(statement)
+
+
+def create_search(apps, schema_editor):
+    run_statements(schema_editor, forward=True)
+
+
+def drop_search(apps, schema_editor):
+    run_statements(schema_editor, forward=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0013_recipe_image_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search, drop_search),
+    ]
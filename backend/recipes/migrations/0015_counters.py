@@ -0,0 +1,49 @@
+# Generated by Django 3.2.3 on 2026-10-18 17:39
+# flake8: noqa
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def count_of(model, field):
+    return Coalesce(models.Subquery(
+        model.objects.filter(**{field: models.OuterRef('pk')}).order_by()
+        .values(field).annotate(total=models.Count('*')).values('total')),
+        0)
+
+
+def fill_counters(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    FavoriteRecipe = apps.get_model('recipes', 'FavoriteRecipe')
+    ShoppingCart = apps.get_model('recipes', 'ShoppingCart')
+    User = apps.get_model('users', 'User')
+    Follower = apps.get_model('users', 'Follower')
+    Recipe.objects.update(favorites_count=count_of(FavoriteRecipe, 'recipe'),
+                          in_carts_count=count_of(ShoppingCart, 'recipe'))
+    User.objects.update(recipes_count=count_of(Recipe, 'author'),
+                        followers_count=count_of(Follower, 'author'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0014_recipe_search'),
+        ('users', '0005_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='in_carts_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-favorites_count', '-pub_date', '-id'], name='recipe_popular_idx'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,57 @@
+# flake8: noqa
+from django.db import migrations
+
+# SQLite пересоздаёт таблицу при AddField/AlterField (0015 и далее), и
+# триггеры FTS5 из 0014 пропадают вместе со старой таблицей. Миграция
+# создаёт их заново и перестраивает индекс. Её нужно повторять после
+# каждой миграции, которая пересоздаёт recipes_recipe; тест
+# RecipeSearchTest.test_sqlite_triggers это проверяет.
+SQLITE_FORWARD = (
+    'DROP TRIGGER IF EXISTS recipes_recipe_fts_insert;',
+    'DROP TRIGGER IF EXISTS recipes_recipe_fts_delete;',
+    'DROP TRIGGER IF EXISTS recipes_recipe_fts_update;',
+    """
+    CREATE TRIGGER recipes_recipe_fts_insert AFTER INSERT ON recipes_recipe
+    BEGIN
+        INSERT INTO recipes_recipe_fts(rowid, name, text)
+        VALUES (new.id, new.name, new.text);
+    END;
+    """,
+    """
+    CREATE TRIGGER recipes_recipe_fts_delete AFTER DELETE ON recipes_recipe
+    BEGIN
+        INSERT INTO recipes_recipe_fts(recipes_recipe_fts, rowid, name, text)
+        VALUES ('delete', old.id, old.name, old.text);
+    END;
+    """,
+    """
+    CREATE TRIGGER recipes_recipe_fts_update
+    AFTER UPDATE OF name, text ON recipes_recipe
+    BEGIN
+        INSERT INTO recipes_recipe_fts(recipes_recipe_fts, rowid, name, text)
+        VALUES ('delete', old.id, old.name, old.text);
+        INSERT INTO recipes_recipe_fts(rowid, name, text)
+        VALUES (new.id, new.name, new.text);
+    END;
+    """,
+    "INSERT INTO recipes_recipe_fts(recipes_recipe_fts) VALUES ('rebuild');",
+)
+
+
+def create_triggers(apps, schema_editor):
+    # PostgreSQL меняет таблицу через ALTER TABLE, его триггер на месте.
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for statement in SQLITE_FORWARD:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0017_recipe_author_pub_date_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_triggers, migrations.RunPython.noop),
+    ]
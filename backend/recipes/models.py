@@ -1,6 +1,7 @@
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
 
-from users.models import User
+from users.models import DerivedFieldsMixin, User
 from recipes.validators import validate_tag_slug
 from recipes.validators import validate_recipe_cooking_time as vldreccook
 from recipes.validators import validate_ingredientInRecipe_amount as vldingrec
@@ -22,21 +23,35 @@ class Tag(models.Model):
         ordering = ['name']
 
 
-class Recipe(models.Model):
+class Recipe(DerivedFieldsMixin, models.Model):
     author = models.ForeignKey(User, related_name='recipes',
                                on_delete=models.CASCADE, db_index=True)
     name = models.CharField(max_length=NAME_MAX_LENGHT, unique=True)
     image = models.ImageField(upload_to='upload/', null=True)
+    image_variants = models.JSONField(default=dict, blank=True)
     text = models.TextField()
     tags = models.ManyToManyField(Tag)
     cooking_time = models.PositiveSmallIntegerField(validators=[vldreccook])
     pub_date = models.DateTimeField(auto_now_add=True)
+    # Заполняется триггером PostgreSQL, см. миграцию 0014.
+    search_vector = SearchVectorField(null=True, editable=False)
+    favorites_count = models.PositiveIntegerField(default=0, editable=False)
+    in_carts_count = models.PositiveIntegerField(default=0, editable=False)
+
+    DERIVED_FIELDS = ('search_vector', 'favorites_count', 'in_carts_count')
 
     def __str__(self):
         return self.name
 
     class Meta:
         ordering = ['-pub_date', ]
+        indexes = (models.Index(fields=('-pub_date', '-id'),
+                                name='recipe_pub_date_id_idx'),
+                   models.Index(fields=('-favorites_count', '-pub_date',
+                                        '-id'),
+                                name='recipe_popular_idx'),
+                   models.Index(fields=('author', '-pub_date', '-id'),
+                                name='recipe_author_pub_date_idx'))
 
 
 class Ingredient(models.Model):
@@ -86,3 +101,36 @@ class ShoppingCart(models.Model):
         constraints = (models.UniqueConstraint
                        (fields=('user', 'recipe'),
                         name='unique_user_recipe_cart'),)
+
+
+class ShoppingListItem(models.Model):
+    """Сумма ингредиента в корзине пользователя.
+
+    Поддерживается при изменении корзины и состава рецептов, чтобы
+    список покупок читался одним запросом без агрегации.
+    """
+    user = models.ForeignKey(User, related_name='shopping_list',
+                             on_delete=models.CASCADE)
+    ingredient = models.ForeignKey(Ingredient, related_name='+',
+                                   on_delete=models.CASCADE)
+    amount = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = (models.UniqueConstraint(
+                       fields=('user', 'ingredient'),
+                       name='unique_user_ingredient_total'),)
+
+
+class RecipeSignature(models.Model):
+    """MinHash-подпись набора ингредиентов рецепта (см. recipes.similar)."""
+    recipe = models.OneToOneField(Recipe, primary_key=True,
+                                  related_name='signature',
+                                  on_delete=models.CASCADE)
+    minhash = models.BinaryField()
+
+
+class RecipeBucket(models.Model):
+    """Корзина LSH: рецепты с одинаковым ключом полосы подписи."""
+    key = models.BigIntegerField(db_index=True)
+    recipe = models.ForeignKey(Recipe, related_name='+',
+                               on_delete=models.CASCADE)
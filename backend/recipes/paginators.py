@@ -0,0 +1,43 @@
+"""Пагинатор админки с приблизительным числом строк для больших таблиц."""
+import json
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import QuerySet
+from django.utils.functional import cached_property
+
+
+def estimated_count(queryset):
+    """Оценка планировщика PostgreSQL вместо COUNT(*) или None."""
+    if not isinstance(queryset, QuerySet):
+        return None
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        if not queryset.query.where:
+            cursor.execute('SELECT reltuples FROM pg_class '
+                           'WHERE oid = %s::regclass',
+                           [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+            # До первого ANALYZE reltuples равен -1 (или 0).
+            return int(row[0]) if row and row[0] > 0 else None
+        sql, params = queryset.order_by().query.sql_with_params()
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class EstimatedCountPaginator(Paginator):
+    """Точный COUNT(*) только там, где строк немного."""
+
+    @cached_property
+    def count(self):
+        estimate = estimated_count(self.object_list)
+        if (estimate is not None
+                and estimate > settings.ADMIN_EXACT_COUNT_LIMIT):
+            return estimate
+        return super().count
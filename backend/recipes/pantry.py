@@ -0,0 +1,127 @@
+"""Подбор рецептов по продуктам пользователя («что приготовить»).
+
+Обратный индекс ингредиент -> рецепты хранится в памяти процесса как
+отсортированные массивы NumPy: для каждого ингредиента - отрезок
+массива позиций рецептов. Покрытие рецепта - доля его ингредиентов,
+которые есть у пользователя; считается сразу для всех рецептов.
+"""
+import threading
+import time
+from collections import namedtuple
+from itertools import chain
+
+import numpy as np
+from django.conf import settings
+
+from recipes.catalog import RECIPES, get_version
+
+Postings = namedtuple('Postings', 'keys starts ends positions')
+Snapshot = namedtuple('Snapshot', 'recipe_ids authors sizes ingredients tags')
+
+
+def _pairs(queryset, fields):
+    rows = queryset.order_by().values_list(*fields).iterator(
+        chunk_size=10000)
+    return np.fromiter(chain.from_iterable(rows), dtype=np.int64).reshape(
+        -1, len(fields))
+
+
+def _postings(pairs, recipe_ids):
+    """Списки позиций рецептов по ключу из пар (ключ, id рецепта)."""
+    positions = np.searchsorted(recipe_ids, pairs[:, 1])
+    known = positions < len(recipe_ids)
+    known[known] = recipe_ids[positions[known]] == pairs[known, 1]
+    keys, positions = pairs[known, 0], positions[known]
+    order = np.lexsort((positions, keys))
+    keys, positions = keys[order], positions[order].astype(np.int32)
+    unique, starts = np.unique(keys, return_index=True)
+    ends = np.append(starts[1:], len(keys))
+    return Postings(unique, starts, ends, positions)
+
+
+def _gather(postings, keys):
+    """Позиции рецептов для всех keys (с повторами)."""
+    keys = np.asarray(sorted(set(keys)), dtype=np.int64)
+    found = np.searchsorted(postings.keys, keys)
+    found = found[found < len(postings.keys)]
+    found = found[np.isin(postings.keys[found], keys)]
+    return np.concatenate([postings.positions[postings.starts[i]:
+                                              postings.ends[i]]
+                           for i in found] or [np.empty(0, np.int32)])
+
+
+class PantryIndex:
+    """Обратный индекс ингредиентов и тэгов рецептов.
+
+    Перестраивается целиком, когда меняется версия RECIPES, но не
+    чаще раза в PANTRY_INDEX_REFRESH секунд.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._built_at = None
+        self._snapshot = None
+
+    def _build(self):
+        from recipes.models import IngredientInRecipe, Recipe
+
+        recipes = _pairs(Recipe.objects.all(), ('id', 'author_id'))
+        order = np.argsort(recipes[:, 0])
+        recipe_ids, authors = recipes[order, 0], recipes[order, 1]
+        ingredients = _postings(
+            _pairs(IngredientInRecipe.objects.all(),
+                   ('ingredient_id', 'recipe_id')), recipe_ids)
+        tags = _postings(_pairs(Recipe.tags.through.objects.all(),
+                                ('tag_id', 'recipe_id')), recipe_ids)
+        sizes = np.bincount(ingredients.positions, minlength=len(recipe_ids))
+        return Snapshot(recipe_ids, authors, sizes, ingredients, tags)
+
+    def _stale(self, version):
+        if self._snapshot is None:
+            return True
+        return (version != self._version and time.monotonic()
+                - self._built_at >= settings.PANTRY_INDEX_REFRESH)
+
+    def snapshot(self):
+        version = get_version(RECIPES)
+        if self._stale(version):
+            with self._lock:
+                if self._stale(version):
+                    self._snapshot = self._build()
+                    self._version = version
+                    self._built_at = time.monotonic()
+        return self._snapshot
+
+    def match(self, ingredient_ids, limit, tag_ids=None, author_id=None,
+              recipe_ids=None):
+        """[(id рецепта, покрытие)], лучшие - первыми.
+
+        При равном покрытии выше рецепт, в котором совпало больше
+        ингредиентов, затем более новый.
+        """
+        data = self.snapshot()
+        counts = np.bincount(_gather(data.ingredients, ingredient_ids),
+                             minlength=len(data.recipe_ids))
+        matched = counts > 0
+        if tag_ids:
+            tagged = np.zeros_like(matched)
+            tagged[_gather(data.tags, tag_ids)] = True
+            matched &= tagged
+        if author_id is not None:
+            matched &= data.authors == author_id
+        if recipe_ids is not None:
+            matched &= np.isin(data.recipe_ids, list(recipe_ids))
+        candidates = np.flatnonzero(matched)
+        coverage = counts[candidates] / data.sizes[candidates]
+        if len(candidates) > limit:
+            kth = np.partition(coverage, -limit)[-limit]
+            best = coverage >= kth
+            candidates, coverage = candidates[best], coverage[best]
+        order = np.lexsort((-data.recipe_ids[candidates], -counts[candidates],
+                            -coverage))[:limit]
+        return [(int(data.recipe_ids[candidates[i]]), float(coverage[i]))
+                for i in order]
+
+
+pantry_index = PantryIndex()
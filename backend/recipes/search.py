@@ -0,0 +1,118 @@
+"""Поиск: автодополнение ингредиентов и полнотекстовый поиск рецептов."""
+import re
+import threading
+from bisect import bisect_left
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connections
+from django.db.models import F
+from django.db.models.expressions import RawSQL
+
+from recipes.catalog import INGREDIENTS, get_version
+
+
+def fold(value):
+    """Приводит строку к виду для поиска: регистр и ё -> е."""
+    return value.casefold().replace('ё', 'е')
+
+
+class IngredientIndex:
+    """Отсортированный массив названий ингредиентов.
+
+    Префиксные совпадения ищутся бинарным поиском, совпадения по
+    подстроке - перебором уже нормализованных строк. Индекс
+    перестраивается, когда меняется версия каталога.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._keys = []
+        self._items = []
+        self._built = False
+
+    def _build(self):
+        from recipes.models import Ingredient
+
+        # Сравниваются только ключи: у Соль и соль он один, а словари
+        # между собой не сравниваются.
+        rows = sorted(
+            ((fold(name), {'id': pk, 'name': name, 'measurement_unit': unit})
+             for pk, name, unit in Ingredient.objects.order_by(
+                 'name').values_list('id', 'name', 'measurement_unit')),
+            key=lambda row: row[0])
+        self._keys = [key for key, _ in rows]
+        self._items = [item for _, item in rows]
+
+    def _ensure_fresh(self):
+        version = get_version(INGREDIENTS)
+        if self._built and version == self._version:
+            return
+        with self._lock:
+            if self._built and version == self._version:
+                return
+            self._build()
+            self._version = version
+            self._built = True
+
+    def search(self, query, limit=None):
+        """Ингредиенты, начинающиеся с query, затем содержащие его."""
+        self._ensure_fresh()
+        if limit is None:
+            limit = settings.INGREDIENT_SEARCH_LIMIT
+        query = fold(query)
+        keys, items = self._keys, self._items
+        start = bisect_left(keys, query)
+        end = bisect_left(keys, query + '\uffff', start)
+        result = items[start:min(end, start + limit)]
+        if len(result) >= limit:
+            return result
+        for position, key in enumerate(keys):
+            if start <= position < end:
+                continue
+            if query in key:
+                result.append(items[position])
+                if len(result) >= limit:
+                    break
+        return result
+
+
+ingredient_index = IngredientIndex()
+
+
+SEARCH_CONFIG = 'russian'
+WORD_RE = re.compile(r'\w+')
+
+
+def fts5_query(query):
+    """Слова запроса как префиксы, соединённые через AND."""
+    return ' '.join(f'"{word}"*' for word in WORD_RE.findall(query))
+
+
+def search_recipes(queryset, query):
+    """Рецепты, найденные по названию и описанию, лучшие - первыми.
+
+    На PostgreSQL используется поле search_vector (GIN-индекс), на
+    SQLite - таблица recipes_recipe_fts (FTS5). Обе поддерживаются
+    триггерами базы данных, см. миграции recipes.0014 и 0018.
+    """
+    vendor = connections[queryset.db].vendor
+    if vendor == 'postgresql':
+        search_query = SearchQuery(query, config=SEARCH_CONFIG,
+                                   search_type='websearch')
+        return (queryset.filter(search_vector=search_query)
+                .annotate(rank=SearchRank(F('search_vector'), search_query))
+                .order_by('-rank', '-pub_date', '-id'))
+    if vendor == 'sqlite':
+        match = fts5_query(query)
+        if not match:
+            return queryset.none()
+        matched = RawSQL('SELECT rowid FROM recipes_recipe_fts '
+                         'WHERE recipes_recipe_fts MATCH %s', (match,))
+        rank = RawSQL('SELECT bm25(recipes_recipe_fts, 10.0, 1.0) '
+                      'FROM recipes_recipe_fts WHERE recipes_recipe_fts '
+                      'MATCH %s AND rowid = recipes_recipe.id', (match,))
+        return (queryset.filter(id__in=matched).annotate(rank=rank)
+                .order_by('rank', '-pub_date', '-id'))
+    return queryset.filter(name__icontains=query)
@@ -0,0 +1,115 @@
+"""Поддержка таблицы сумм списка покупок (ShoppingListItem)."""
+from django.db import transaction
+from django.db.models import Sum
+
+from recipes.models import IngredientInRecipe, ShoppingCart, ShoppingListItem
+from users.models import User
+
+
+def recipe_amounts(recipe):
+    """Состав рецепта: {id ингредиента: количество}."""
+    return dict(IngredientInRecipe.objects.filter(recipe=recipe)
+                .values_list('ingredient_id', 'amount'))
+
+
+def cart_user_ids(recipe):
+    return list(ShoppingCart.objects.filter(recipe=recipe)
+                .values_list('user_id', flat=True))
+
+
+def live_totals(user_ids=None):
+    """Суммы, посчитанные по корзинам: {(user_id, ingredient_id): сумма}."""
+    queryset = IngredientInRecipe.objects.filter(
+        recipe__in_shopping_cart__user__isnull=False)
+    if user_ids is not None:
+        queryset = queryset.filter(recipe__in_shopping_cart__user__in=user_ids)
+    rows = (queryset.values('recipe__in_shopping_cart__user', 'ingredient')
+            .annotate(total=Sum('amount'))
+            .values_list('recipe__in_shopping_cart__user', 'ingredient',
+                         'total'))
+    return {(user_id, ingredient_id): total
+            for user_id, ingredient_id, total in rows}
+
+
+def stored_totals(user_ids=None):
+    queryset = ShoppingListItem.objects.all()
+    if user_ids is not None:
+        queryset = queryset.filter(user_id__in=user_ids)
+    return {(user_id, ingredient_id): amount
+            for user_id, ingredient_id, amount in queryset.values_list(
+                'user_id', 'ingredient_id', 'amount')}
+
+
+def apply_deltas(user_ids, deltas):
+    """Прибавляет deltas {id ингредиента: изменение} каждому из user_ids.
+
+    Строки пользователей блокируются, поэтому параллельные изменения
+    одной корзины выполняются последовательно. Нулевые суммы удаляются.
+    """
+    deltas = {key: value for key, value in deltas.items() if value}
+    if not user_ids or not deltas:
+        return
+    # Вложенный вызов не ставит своей точки сохранения.
+    with transaction.atomic(savepoint=False):
+        list(User.objects.select_for_update().filter(id__in=user_ids)
+             .order_by('id').values_list('id', flat=True))
+        existing = {(item.user_id, item.ingredient_id): item
+                    for item in ShoppingListItem.objects.filter(
+                        user_id__in=user_ids, ingredient_id__in=deltas)}
+        to_create, to_update, to_delete = [], [], []
+        for user_id in user_ids:
+            for ingredient_id, delta in deltas.items():
+                item = existing.get((user_id, ingredient_id))
+                if item is None:
+                    if delta > 0:
+                        to_create.append(ShoppingListItem(
+                            user_id=user_id, ingredient_id=ingredient_id,
+                            amount=delta))
+                    continue
+                item.amount += delta
+                if item.amount > 0:
+                    to_update.append(item)
+                else:
+                    to_delete.append(item.id)
+        ShoppingListItem.objects.bulk_create(to_create)
+        ShoppingListItem.objects.bulk_update(to_update, ('amount',))
+        ShoppingListItem.objects.filter(id__in=to_delete).delete()
+
+
+def add_recipe(user, recipe):
+    apply_deltas([user.id], recipe_amounts(recipe))
+
+
+def remove_recipe(user, recipe):
+    apply_deltas([user.id], {ingredient_id: -amount for ingredient_id, amount
+                             in recipe_amounts(recipe).items()})
+
+
+def recipe_changed(recipe, deltas):
+    """Переносит изменение состава рецепта в корзины пользователей.
+
+    deltas - {id ингредиента: новое количество минус старое}.
+    """
+    if any(deltas.values()):
+        apply_deltas(cart_user_ids(recipe), deltas)
+
+
+def recipe_deleted(recipe):
+    recipe_changed(recipe, {ingredient_id: -amount for ingredient_id, amount
+                            in recipe_amounts(recipe).items()})
+
+
+def rebuild(user_ids=None):
+    """Пересчитывает таблицу по корзинам, возвращает число строк."""
+    totals = live_totals(user_ids)
+    with transaction.atomic():
+        queryset = ShoppingListItem.objects.all()
+        if user_ids is not None:
+            queryset = queryset.filter(user_id__in=user_ids)
+        queryset.delete()
+        ShoppingListItem.objects.bulk_create(
+            (ShoppingListItem(user_id=user_id, ingredient_id=ingredient_id,
+                              amount=total)
+             for (user_id, ingredient_id), total in totals.items()),
+            batch_size=1000)
+    return len(totals)
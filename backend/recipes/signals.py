@@ -0,0 +1,24 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from recipes.catalog import INGREDIENTS, RECIPES, TAGS, bump_version
+from recipes.models import Ingredient, IngredientInRecipe, Recipe, Tag
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def ingredient_changed(**kwargs):
+    bump_version(INGREDIENTS)
+
+
+@receiver((post_save, post_delete), sender=Tag)
+def tag_changed(**kwargs):
+    bump_version(TAGS)
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+@receiver((post_save, post_delete), sender=IngredientInRecipe)
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def recipe_changed(**kwargs):
+    # Другие процессы перестраивают индексы только после коммита.
+    transaction.on_commit(lambda: bump_version(RECIPES))
@@ -0,0 +1,115 @@
+"""Похожие рецепты: MinHash-подписи наборов ингредиентов и LSH.
+
+Подпись рецепта - минимумы PERMUTATIONS хеш-функций по id его
+ингредиентов; доля совпавших позиций двух подписей оценивает
+коэффициент Жаккара наборов. Подпись делится на BANDS полос, ключи
+полос лежат в RecipeBucket: рецепты хотя бы с одним общим ключом
+становятся кандидатами и ранжируются по оценке сходства.
+
+После изменения PERMUTATIONS или BANDS индекс нужно перестроить
+командой similar_index.
+"""
+from itertools import chain, groupby, islice
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+
+from recipes.models import IngredientInRecipe, RecipeBucket, RecipeSignature
+
+PERMUTATIONS = settings.SIMILAR_RECIPES_PERMUTATIONS
+BANDS = settings.SIMILAR_RECIPES_BANDS
+# Простое число больше 2 ** 32: a * x + b помещается в uint64.
+PRIME = np.uint64(4294967311)
+MIX = np.uint64(0x9E3779B97F4A7C15)
+# Параметры хеш-функций одинаковы во всех процессах.
+_random = np.random.RandomState(20210601)
+_A = _random.randint(1, 2 ** 32, size=(PERMUTATIONS, 1), dtype=np.uint64)
+_B = _random.randint(0, 2 ** 32, size=(PERMUTATIONS, 1), dtype=np.uint64)
+
+
+def signatures(sets):
+    """Подписи непустых наборов id: массив (len(sets), PERMUTATIONS)."""
+    sizes = np.fromiter(map(len, sets), dtype=np.int64, count=len(sets))
+    values = np.fromiter(chain.from_iterable(sets), dtype=np.uint64,
+                         count=int(sizes.sum()))
+    hashed = (_A * values + _B) % PRIME
+    offsets = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+    return np.minimum.reduceat(hashed, offsets, axis=1).T.astype(np.uint32)
+
+
+def band_keys(signatures):
+    """Ключи полос (n, BANDS); номер полосы входит в ключ."""
+    bands = signatures.reshape(len(signatures), BANDS, -1).astype(np.uint64)
+    keys = np.broadcast_to(np.arange(BANDS, dtype=np.uint64), bands.shape[:2])
+    for row in range(bands.shape[2]):
+        keys = keys * MIX + bands[:, :, row]
+    return keys.view(np.int64)
+
+
+def _write(recipe_sets):
+    recipe_sets = {pk: items for pk, items in recipe_sets.items() if items}
+    if not recipe_sets:
+        return
+    ids = list(recipe_sets)
+    matrix = signatures([list(recipe_sets[pk]) for pk in ids])
+    RecipeSignature.objects.bulk_create(
+        RecipeSignature(recipe_id=pk, minhash=signature.tobytes())
+        for pk, signature in zip(ids, matrix))
+    RecipeBucket.objects.bulk_create(
+        RecipeBucket(recipe_id=pk, key=key)
+        for pk, keys in zip(ids, band_keys(matrix).tolist()) for key in keys)
+
+
+@transaction.atomic(savepoint=False)
+def index_recipes(recipe_sets):
+    """Обновляет индекс для рецептов {id: id ингредиентов}."""
+    RecipeBucket.objects.filter(recipe_id__in=list(recipe_sets)).delete()
+    RecipeSignature.objects.filter(recipe_id__in=list(recipe_sets)).delete()
+    _write(recipe_sets)
+
+
+@transaction.atomic
+def rebuild(batch_size=1000):
+    """Строит индекс заново по всем рецептам, возвращает их число."""
+    RecipeBucket.objects.all().delete()
+    RecipeSignature.objects.all().delete()
+    rows = (IngredientInRecipe.objects.order_by('recipe_id')
+            .values_list('recipe_id', 'ingredient_id')
+            .iterator(chunk_size=batch_size * 10))
+    recipes = ((pk, [item for _, item in items])
+               for pk, items in groupby(rows, key=lambda row: row[0]))
+    total = 0
+    while True:
+        batch = dict(islice(recipes, batch_size))
+        if not batch:
+            return total
+        _write(batch)
+        total += len(batch)
+
+
+def similar_recipes(recipe_id, limit=None):
+    """[(id рецепта, оценка сходства)], самые похожие - первыми."""
+    if limit is None:
+        limit = settings.SIMILAR_RECIPES_LIMIT
+    minhash = (RecipeSignature.objects.filter(recipe_id=recipe_id)
+               .values_list('minhash', flat=True).first())
+    if minhash is None:
+        return []
+    signature = np.frombuffer(minhash, dtype=np.uint32)
+    keys = band_keys(signature[np.newaxis]).ravel().tolist()
+    candidates = (RecipeBucket.objects.filter(key__in=keys)
+                  .exclude(recipe_id=recipe_id).values('recipe_id')
+                  .annotate(hits=Count('id')).order_by('-hits', 'recipe_id')
+                  .values_list('recipe_id', flat=True)
+                  [:settings.SIMILAR_RECIPES_CANDIDATES])
+    rows = RecipeSignature.objects.filter(
+        recipe_id__in=list(candidates)).values_list('recipe_id', 'minhash')
+    if not rows:
+        return []
+    ids, blobs = zip(*rows)
+    matrix = np.frombuffer(b''.join(map(bytes, blobs)), dtype=np.uint32)
+    scores = (matrix.reshape(len(ids), -1) == signature).mean(axis=1)
+    order = np.lexsort((ids, -scores))[:limit]
+    return [(ids[i], float(scores[i])) for i in order]
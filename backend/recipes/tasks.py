@@ -0,0 +1,26 @@
+"""Фоновые задачи рецептов (см. jobs.queue)."""
+from io import StringIO
+
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+
+from jobs.queue import task
+from recipes.images import generate_variants
+from recipes.models import Recipe
+
+
+@task('recipes.image_variants')
+def image_variants(job):
+    recipe = Recipe.objects.filter(pk=job.payload['recipe']).first()
+    if recipe is None or not recipe.image:
+        return None
+    return generate_variants(recipe)
+
+
+@task('recipes.import', timeout=6 * 60 * 60)
+def import_recipes(job):
+    """Загрузка JSONL; повтор продолжает с последней контрольной точки."""
+    output = StringIO()
+    call_command('import_recipes', default_storage.path(job.payload['path']),
+                 stdout=output)
+    return {'output': output.getvalue().strip().splitlines()[-1:]}
@@ -0,0 +1,275 @@
+import base64
+import json
+import os
+import tempfile
+from io import BytesIO, StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.contrib import admin
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from PIL import Image
+
+from jobs.models import Job
+from recipes import images
+from recipes.catalog import INGREDIENTS, VERSIONS, get_version
+from recipes.models import Ingredient, Recipe, Tag
+from recipes.search import IngredientIndex
+from users.models import User
+
+
+class OtherProcessMixin:
+    """Изменения из другого процесса видны только через общий кэш."""
+
+    def setUp(self):
+        caches['default'].clear()
+        self.now = 1000.0
+        patcher = mock.patch('foodgram.cache.time.monotonic',
+                             side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def bump_in_other_process(self, catalog):
+        caches['shared'].set(VERSIONS.key(catalog), 'other', None)
+        # Копия версии в памяти этого процесса живёт не больше секунды.
+        self.now += 2
+
+
+class IngredientIndexTest(OtherProcessMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        for name in ('Соль', 'соль', 'мёд', 'мед', 'морская соль', 'сахар'):
+            Ingredient.objects.create(name=name, measurement_unit='г')
+
+    def names(self, query, limit=10):
+        return [item['name']
+                for item in IngredientIndex().search(query, limit)]
+
+    def test_same_folded_names(self):
+        self.assertCountEqual(self.names('сол')[:2], ['Соль', 'соль'])
+        self.assertCountEqual(self.names('мед'), ['мёд', 'мед'])
+
+    def test_prefix_before_substring(self):
+        self.assertEqual(self.names('соль')[-1], 'морская соль')
+
+    def test_limit(self):
+        self.assertEqual(len(self.names('с', limit=2)), 2)
+
+    def test_rebuilt_after_change_in_other_process(self):
+        index = IngredientIndex()
+        version = get_version(INGREDIENTS)
+        self.assertEqual(len(index.search('сахар')), 1)
+        Ingredient.objects.filter(name='сахар').update(name='сахар песок')
+        self.bump_in_other_process(INGREDIENTS)
+        self.assertNotEqual(get_version(INGREDIENTS), version)
+        self.assertEqual([item['name'] for item in index.search('сахар')],
+                         ['сахар песок'])
+
+
+def recipe_record(name, author='chef', tags=(), image=None):
+    return {
+        'name': name, 'text': 'Текст', 'cooking_time': 10,
+        'pub_date': '2023-08-01T10:00:00+00:00',
+        'author': {'email': f'{author}@example.com', 'username': author,
+                   'first_name': 'Имя', 'last_name': 'Фамилия'},
+        'tags': [{'slug': slug, 'name': name, 'color': color}
+                 for slug, name, color in tags],
+        'ingredients': [{'name': 'соль', 'measurement_unit': 'г',
+                         'amount': 5}],
+        'image': image,
+    }
+
+
+class ImportRecipesTest(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.media = os.path.join(self.directory, 'media')
+        settings = override_settings(MEDIA_ROOT=self.media)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def run_import(self, records):
+        path = os.path.join(self.directory, 'recipes.jsonl')
+        with open(path, 'w', encoding='utf-8') as file:
+            for record in records:
+                file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        stderr = StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('import_recipes', path, stdout=StringIO(),
+                         stderr=stderr)
+        return stderr.getvalue()
+
+    def uploads(self):
+        try:
+            return os.listdir(os.path.join(self.media, 'upload'))
+        except FileNotFoundError:
+            return []
+
+    def test_tag_conflicts(self):
+        breakfast = Tag.objects.create(name='Завтрак', color='#111111',
+                                       slug='breakfast')
+        errors = self.run_import([
+            recipe_record('Омлет', tags=[('zavtrak', 'Завтрак', '#222222')]),
+            recipe_record('Суп', tags=[('lunch', 'Обед', '#111111')]),
+            recipe_record('Каша', tags=[('dinner', 'Ужин', '#333333'),
+                                        ('supper', 'Ужин', '#444444')]),
+        ])
+        self.assertEqual(list(Recipe.objects.get(name='Омлет').tags.all()),
+                         [breakfast])
+        self.assertFalse(Recipe.objects.filter(name='Суп').exists())
+        self.assertIn('«Суп» пропущен', errors)
+        self.assertEqual(
+            list(Recipe.objects.get(name='Каша').tags.values_list('slug',
+                                                                  flat=True)),
+            ['dinner'])
+
+    def test_username_taken(self):
+        User.objects.create_user(username='chef', email='other@example.com',
+                                 first_name='Имя', last_name='Фамилия',
+                                 password='pass-word-42')
+        errors = self.run_import([recipe_record('Омлет'),
+                                  recipe_record('Суп', author='cook')])
+        self.assertIn('«Омлет» пропущен', errors)
+        self.assertEqual(list(Recipe.objects.values_list('name', flat=True)),
+                         ['Суп'])
+
+    def test_images_saved_after_commit(self):
+        image = {'name': 'photo.png',
+                 'data': base64.b64encode(b'not really a png').decode()}
+        self.run_import([recipe_record('Омлет', image=image)])
+        recipe = Recipe.objects.get(name='Омлет')
+        self.assertEqual(self.uploads(),
+                         [os.path.basename(recipe.image.name)])
+
+    def test_duplicate_ingredients_merged(self):
+        record = recipe_record('Омлет')
+        record['ingredients'] += [
+            {'name': 'перец', 'measurement_unit': 'г', 'amount': 1},
+            {'name': 'соль', 'measurement_unit': 'г', 'amount': 3}]
+        errors = self.run_import([record, recipe_record('Суп')])
+        self.assertIn('«Омлет»: повторяющиеся ингредиенты', errors)
+        self.assertEqual(
+            dict(Recipe.objects.get(name='Омлет').ingredients.values_list(
+                'ingredient__name', 'amount')),
+            {'соль': 8, 'перец': 1})
+        self.assertTrue(Recipe.objects.filter(name='Суп').exists())
+
+    def export(self):
+        path = os.path.join(self.directory, 'export.jsonl')
+        call_command('export_recipes', path, stderr=StringIO())
+        with open(path, encoding='utf-8') as file:
+            records = [json.loads(line) for line in file]
+        for record in records:
+            # Имя файла при загрузке становится новым.
+            if record['image']:
+                record['image'].pop('name')
+        return records
+
+    def test_round_trip(self):
+        image = {'name': 'photo.png',
+                 'data': base64.b64encode(b'not really a png').decode()}
+        soup = recipe_record('Суп', author='cook',
+                             tags=[('lunch', 'Обед', '#111111')])
+        soup['ingredients'].append(
+            {'name': 'вода', 'measurement_unit': 'мл', 'amount': 500})
+        self.run_import([
+            recipe_record('Омлет', image=image,
+                          tags=[('breakfast', 'Завтрак', '#222222'),
+                                ('lunch', 'Обед', '#111111')]),
+            soup])
+        exported = self.export()
+        self.assertEqual([record['name'] for record in exported],
+                         ['Омлет', 'Суп'])
+        self.assertIsNotNone(exported[0]['image'])
+        Recipe.objects.all().delete()
+        Tag.objects.all().delete()
+        Ingredient.objects.all().delete()
+        User.objects.all().delete()
+        self.run_import(exported)
+        self.assertEqual(self.export(), exported)
+
+    def test_no_images_after_rollback(self):
+        image = {'name': 'photo.png',
+                 'data': base64.b64encode(b'not really a png').decode()}
+        with mock.patch('recipes.similar.index_recipes',
+                        side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.run_import([recipe_record('Омлет', image=image)])
+        self.assertEqual(self.uploads(), [])
+        self.assertFalse(Recipe.objects.exists())
+
+
+@override_settings(RECIPE_IMAGE_ASYNC=False, RECIPE_IMAGE_JOBS=False)
+class RecipeImagesTest(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        media = override_settings(MEDIA_ROOT=directory.name)
+        media.enable()
+        self.addCleanup(media.disable)
+        author = User.objects.create_user(
+            username='chef', email='chef@example.com', first_name='Имя',
+            last_name='Фамилия', password='pass-word-42')
+        self.recipe = Recipe.objects.create(
+            author=author, name='Омлет', text='Текст', cooking_time=10,
+            image=self.save_image('photo.png', (800, 600)))
+
+    def save_image(self, name, size):
+        buffer = BytesIO()
+        Image.new('RGB', size, 'red').save(buffer, 'PNG')
+        return default_storage.save(f'upload/{name}',
+                                    ContentFile(buffer.getvalue()))
+
+    def test_generate_variants(self):
+        variants = images.generate_variants(self.recipe)
+        self.assertEqual(Recipe.objects.get(pk=self.recipe.pk)
+                         .image_variants, variants)
+        for variant, (width, height) in (
+                settings.RECIPE_IMAGE_VARIANTS.items()):
+            with self.subTest(variant=variant):
+                self.assertTrue(variants[variant].endswith('.webp'))
+                with default_storage.open(variants[variant]) as file:
+                    size = Image.open(file).size
+                self.assertLessEqual(size[0], min(width, 800))
+                self.assertEqual(size[0] * 3, size[1] * 4)
+
+    def test_old_format_deleted(self):
+        old = images.generate_variants(self.recipe)
+        with override_settings(RECIPE_IMAGE_FORMAT='JPEG'):
+            new = images.generate_variants(self.recipe)
+        self.assertTrue(all(default_storage.exists(name)
+                            for name in new.values()))
+        self.assertFalse(any(default_storage.exists(name)
+                             for name in old.values()))
+
+    def test_replace_variants(self):
+        old = images.generate_variants(self.recipe)
+        self.recipe.image = self.save_image('other.png', (300, 300))
+        self.recipe.image_variants = {}
+        self.recipe.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            images.replace_variants(self.recipe, old)
+        new = Recipe.objects.get(pk=self.recipe.pk).image_variants
+        self.assertEqual(new.keys(), old.keys())
+        self.assertTrue(all(default_storage.exists(name)
+                            for name in new.values()))
+        self.assertFalse(any(default_storage.exists(name)
+                             for name in old.values()))
+
+    @override_settings(RECIPE_IMAGE_JOBS=True)
+    def test_admin_action_enqueues(self):
+        model_admin = admin.site._registry[Recipe]
+        with mock.patch.object(model_admin, 'message_user'), \
+                mock.patch('recipes.images.generate_variants') as generate:
+            model_admin.build_image_variants(
+                None, Recipe.objects.filter(pk=self.recipe.pk))
+        generate.assert_not_called()
+        self.assertEqual(list(Job.objects.values_list('task', 'payload')),
+                         [('recipes.image_variants',
+                           {'recipe': self.recipe.pk})])
@@ -1,12 +1,27 @@
 from django.contrib import admin
 
+from recipes.paginators import EstimatedCountPaginator
 from .models import User, Follower
 
 
 class UserAdmin(admin.ModelAdmin):
     search_fields = ('username', 'email',)
-    list_filter = ('username', 'email',)
+    list_display = ('id', 'username', 'email', 'recipes_count',
+                    'followers_count',)
+    list_filter = ('is_staff', 'is_active',)
+    readonly_fields = ('recipes_count', 'followers_count',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+class FollowerAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'author')
+    list_select_related = ('user', 'author')
+    autocomplete_fields = ('user', 'author')
+    search_fields = ('user__username', 'author__username')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 
 admin.site.register(User, UserAdmin)
-admin.site.register([Follower])
+admin.site.register(Follower, FollowerAdmin)
@@ -1,17 +1,43 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import AbstractUser
 
 from .validators import validate_username
 
 
-class User(AbstractUser):
+class DerivedFieldsMixin:
+    """save() без update_fields не перезаписывает DERIVED_FIELDS.
+
+    Эти поля ведутся в обход save(): счётчики - через update(F()) в
+    recipes.counters, поисковый вектор - триггером базы. Полное
+    сохранение экземпляра, загруженного раньше, вернуло бы им старые
+    значения.
+    """
+    DERIVED_FIELDS = ()
+
+    def save(self, *args, **kwargs):
+        if (not args and not self._state.adding
+                and kwargs.get('update_fields') is None
+                and not kwargs.get('force_insert')):
+            skipped = set(self.DERIVED_FIELDS) | self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.attname not in skipped
+                and field.name not in skipped]
+        super().save(*args, **kwargs)
+
+
+class User(DerivedFieldsMixin, AbstractUser):
     username = models.CharField(max_length=150, blank=False, unique=True,
                                 validators=(validate_username,))
     password = models.CharField(max_length=150, blank=False)
     email = models.EmailField(max_length=254, blank=False, unique=True)
     first_name = models.CharField(max_length=150, blank=False)
     last_name = models.CharField(max_length=150, blank=False)
+    recipes_count = models.PositiveIntegerField(default=0, editable=False)
+    followers_count = models.PositiveIntegerField(default=0, editable=False)
 
+    DERIVED_FIELDS = ('recipes_count', 'followers_count')
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ('username', 'first_name', 'last_name', 'password')
 
@@ -21,23 +47,33 @@ class User(AbstractUser):
     def __str__(self):
         return self.username
 
+    def get_shopping_list_rows(self):
+        """Строки списка покупок: (название, единица, количество)."""
+        return (self.shopping_list
+                .values_list('ingredient__name',
+                             'ingredient__measurement_unit', 'amount')
+                .order_by('ingredient__name'))
+
     def get_shopping_list(self):
-        shopping_list = []
-        t = models.Sum("recipe__ingredients__amount")
-        q = "recipe__ingredients__ingredient__name"
-        s = "recipe__ingredients__ingredient__measurement_unit"
-        r = self.shopping_cart.values_list(q, s).annotate(total_amount=t)
-        for name, unit, total in r:
-            shopping_list.append(f'{name}: {total} {unit}')
-        return '\n'.join(shopping_list)
+        return '\n'.join(f'{name}: {total} {unit}'
+                         for name, unit, total
+                         in self.get_shopping_list_rows())
 
     def follow(self, author):
-        if not self.is_following(author):
-            Follower.objects.create(user=self, author=author)
+        with transaction.atomic():
+            _, created = Follower.objects.get_or_create(user=self,
+                                                        author=author)
+            if created:
+                User.objects.filter(pk=author.pk).update(
+                    followers_count=models.F('followers_count') + 1)
 
     def unfollow(self, author):
-        if self.is_following(author):
-            Follower.objects.filter(user=self, author=author).delete()
+        with transaction.atomic():
+            deleted, _ = Follower.objects.filter(user=self,
+                                                 author=author).delete()
+            if deleted:
+                User.objects.filter(pk=author.pk).update(
+                    followers_count=models.F('followers_count') - deleted)
 
     def is_following(self, author) -> bool:
         return Follower.objects.filter(user=self, author=author).exists()